@@ -0,0 +1,5 @@
+from flask_main import app
+from flask_app import img_util
+from flask_app.asgi import AsgiApp
+
+application = AsgiApp(app, img_util)
@@ -0,0 +1,208 @@
+"""Local stand-in for the Cloudinary endpoints `ImageUtil` talks to.
+
+    python -m benchmarks.fake_cloudinary --port 8780 --latency 20
+
+It serves the upload API, the destroy, delete, delete-by-prefix and folder API calls and
+delivery URLs for what was uploaded, all kept in memory. Point the app at
+it with `CLOUDINARY_API_URL=http://127.0.0.1:8780`.
+"""
+import argparse
+import hashlib
+import io
+import json
+import struct
+import threading
+import time
+import zlib
+
+from storage.image_store import image_info
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
+
+
+def png(width: int, height: int, seed: int = 0) -> bytes:
+    """Return a valid, solid-colour PNG of the given size, different for every seed."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    pixel = bytes([seed % 256, (seed * 7) % 256, (seed * 13) % 256])
+    raw = b''.join(b'\x00' + pixel * width for _ in range(height))
+
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        + chunk(b'tEXt', b'seed\x00' + str(seed).encode())
+        + chunk(b'IDAT', zlib.compress(raw))
+        + chunk(b'IEND', b'')
+    )
+
+
+class FakeCloudinary:
+    """In-memory Cloudinary served over HTTP on a background thread.
+
+    `latency` seconds are added to every request to stand in for the
+    round trip to the real service.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, cloud_name: str = 'bench', latency: float = 0.0) -> None:
+        self.cloud_name = cloud_name
+        self.latency = latency
+        self.images = {}
+        self.calls = {'upload': 0, 'fetch': 0, 'destroy': 0, 'delete_resources': 0, 'delete_by_prefix': 0, 'folders': 0}
+
+        self._lock = threading.Lock()
+        self._server = make_server(host, port, self.wsgi_app, threaded=True)
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self._server.host}:{self._server.port}"
+
+    def delivery_url(self, public_id: str) -> str:
+        return f"{self.url}/{self.cloud_name}/image/upload/v1/{public_id}.png"
+
+    def put(self, public_id: str, content: bytes) -> str:
+        """Add an image without going through the upload API and return its URL."""
+        with self._lock:
+            self.images[public_id] = content
+
+        return self.delivery_url(public_id)
+
+    def start(self) -> 'FakeCloudinary':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-cloudinary', daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._thread.join()
+
+    def wsgi_app(self, environ: dict, start_response) -> list[bytes]:
+        request = Request(environ)
+        if self.latency:
+            time.sleep(self.latency)
+
+        response = self.dispatch(request)
+        return response(environ, start_response)
+
+    def dispatch(self, request: Request) -> Response:
+        parts = request.path.strip('/').split('/')
+
+        if parts[:2] == ['v1_1', self.cloud_name] and request.method == 'POST':
+            if parts[2:] == ['image', 'upload']:
+                return self.upload(request)
+            if parts[2:] == ['image', 'destroy']:
+                return self.destroy(request)
+
+        if parts[:2] == ['v1_1', self.cloud_name] and request.method == 'DELETE':
+            if parts[2:] == ['resources', 'image', 'upload']:
+                return self.delete_resources(request)
+
+        if parts[:3] == ['v1_1', self.cloud_name, 'folders'] and request.method == 'GET':
+            return self.folders('/'.join(parts[3:]))
+
+        if parts[:3] == [self.cloud_name, 'image', 'upload'] and request.method == 'GET':
+            return self.fetch('/'.join(parts[4:]).rsplit('.', 1)[0], request)
+
+        return Response(status=404)
+
+    def upload(self, request: Request) -> Response:
+        file = request.files['file']
+        content = file.read()
+        public_id = f"{request.form['folder']}/{request.form['public_id']}"
+        _, width, height = image_info(io.BytesIO(content)) or (None, 0, 0)
+
+        with self._lock:
+            self.images[public_id] = content
+            self.calls['upload'] += 1
+
+        return self.json_response({
+            'public_id': public_id,
+            'width': width,
+            'height': height,
+            'bytes': len(content),
+            'secure_url': self.delivery_url(public_id)
+        })
+
+    def fetch(self, public_id: str, request: Request) -> Response:
+        with self._lock:
+            content = self.images.get(public_id)
+            self.calls['fetch'] += 1
+
+        if content is None:
+            return Response(status=404)
+
+        response = Response(content, mimetype='image/png')
+        response.set_etag(hashlib.sha256(content).hexdigest())
+
+        return response.make_conditional(request)
+
+    def destroy(self, request: Request) -> Response:
+        params = request.form or request.get_json(silent=True) or {}
+
+        with self._lock:
+            found = self.images.pop(params.get('public_id'), None) is not None
+            self.calls['destroy'] += 1
+
+        return self.json_response({'result': 'ok' if found else 'not found'})
+
+    def delete_resources(self, request: Request) -> Response:
+        params = {**request.args, **(request.form or request.get_json(silent=True) or {})}
+        if 'public_ids' not in params:
+            return self.delete_by_prefix(params)
+
+        with self._lock:
+            deleted = {
+                public_id: 'deleted' if self.images.pop(public_id, None) is not None else 'not_found'
+                for public_id in params['public_ids']
+            }
+            self.calls['delete_resources'] += 1
+
+        return self.json_response({'deleted': deleted, 'partial': False})
+
+    def delete_by_prefix(self, params: dict) -> Response:
+        prefix = params.get('prefix', '')
+
+        with self._lock:
+            deleted = {public_id: 'deleted' for public_id in self.images if public_id.startswith(prefix)}
+            for public_id in deleted:
+                del self.images[public_id]
+            self.calls['delete_by_prefix'] += 1
+
+        return self.json_response({'deleted': deleted, 'partial': False})
+
+    def folders(self, parent: str) -> Response:
+        with self._lock:
+            names = {
+                public_id[len(parent) + 1:].split('/', 1)[0]
+                for public_id in self.images
+                if public_id.startswith(parent + '/') and '/' in public_id[len(parent) + 1:]
+            }
+            self.calls['folders'] += 1
+
+        return self.json_response({
+            'folders': [{'name': name, 'path': f"{parent}/{name}"} for name in sorted(names)],
+            'total_count': len(names)
+        })
+
+    @staticmethod
+    def json_response(data: dict) -> Response:
+        return Response(json.dumps(data), mimetype='application/json')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8780)
+    parser.add_argument('--cloud-name', default='bench')
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every request')
+    args = parser.parse_args()
+
+    fake = FakeCloudinary(args.host, args.port, args.cloud_name, args.latency / 1000)
+    print(f"Serving a fake Cloudinary for cloud {args.cloud_name!r} on {fake.url}")
+    fake._server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
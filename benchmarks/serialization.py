@@ -0,0 +1,104 @@
+"""Compare domain model serialization against the former deepcopy-based path.
+
+    python -m benchmarks.serialization --images 2000 --boxes 12
+"""
+import argparse
+import copy
+import json
+import timeit
+
+from src.model import Project, Image, Annotation, Category
+
+
+class LegacyModel:
+    """The `BaseModel.to_dict` implementation the slotted models replaced."""
+
+    def __init__(self, **attrs: dict) -> None:
+        self.__dict__.update(attrs)
+
+    def to_dict(self):
+        model_dict = copy.deepcopy(vars(self))
+        if 'password' in model_dict:
+            del model_dict['password']
+
+        for k, v in model_dict.items():
+            if isinstance(v, LegacyModel):
+                model_dict[k] = v.to_dict()
+
+            if isinstance(v, list):
+                lst = []
+                for model in v:
+                    if isinstance(model, LegacyModel):
+                        model = model.to_dict()
+
+                    lst.append(model)
+
+                model_dict[k] = lst
+
+        return model_dict
+
+
+def build_project(n_images: int, n_boxes: int) -> Project:
+    categories = [Category(name, color) for name, color in (('car', 'red'), ('bus', 'blue'))]
+    images = []
+    for i in range(n_images):
+        image = Image(f"https://res.example.com/FLASK/P/image-{i}.jpg", 1920, 1080, f"image-{i}")
+        image.annotations = []
+        for j in range(n_boxes):
+            annotation = Annotation(j * 1.5, j * 2.5, 40.0, 30.0)
+            annotation.category = categories[j % len(categories)]
+            image.annotations.append(annotation)
+
+        images.append(image)
+
+    project = Project('P')
+    project.categories = categories
+    project.images = images
+
+    return project
+
+
+def to_legacy(model):
+    if isinstance(model, list):
+        return [to_legacy(m) for m in model]
+
+    if not hasattr(model, '_fields'):
+        return model
+
+    attrs = {}
+    for k in model._fields:
+        if hasattr(model, k):
+            attrs[k] = to_legacy(getattr(model, k))
+
+    return LegacyModel(**attrs)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=1000)
+    parser.add_argument('--boxes', type=int, default=12)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    project = build_project(args.images, args.boxes)
+    legacy = to_legacy(project)
+
+    # `jsonify` sorts keys, both orderings must match byte for byte
+    for sort_keys in (True, False):
+        assert json.dumps(project.to_dict(), sort_keys=sort_keys) == \
+            json.dumps(legacy.to_dict(), sort_keys=sort_keys)
+
+    results = {
+        'legacy': min(timeit.repeat(legacy.to_dict, number=1, repeat=args.repeat)),
+        'slotted': min(timeit.repeat(project.to_dict, number=1, repeat=args.repeat)),
+    }
+
+    print(f"{args.images} images x {args.boxes} boxes")
+    for name, seconds in results.items():
+        print(f"  {name:<8} {seconds * 1000:10.1f} ms")
+
+    print(f"  speedup  {results['legacy'] / results['slotted']:10.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,13 @@ from storage.orm import db
 from flask_app.config import config
 from flask_migrate import Migrate
 from flask_bcrypt import Bcrypt
+from utils import ImageUtil
+from flask_app.export import ExportJobRunner
+from flask_app.ingest import IngestPipeline
+from flask_app.tiles import TileService
+from flask_app.user_cache import UserCache
+from flask_app.metrics import Metrics
+from flask_app.reaper import Reaper
 from werkzeug.exceptions import BadRequest, NotFound, Unauthorized, InternalServerError
 from flask_app.error_handlers import (
     handle_bad_request,
@@ -12,6 +19,13 @@ from flask_app.error_handlers import (
 )
 
 bcrypt = Bcrypt()
+metrics = Metrics()
+img_util = ImageUtil()
+export_jobs = ExportJobRunner(img_util)
+tiles = TileService(img_util)
+ingest = IngestPipeline(img_util, tiles)
+users = UserCache()
+reaper = Reaper(img_util, tiles, users, export_jobs, ingest)
 
 
 def create_app(config_type: str) -> Flask:
@@ -24,7 +38,15 @@ def create_app(config_type: str) -> Flask:
     app.register_error_handler(Unauthorized, handle_unauthorized)
     app.register_error_handler(InternalServerError, handle_internal_server_error)
 
+    # First, so the other extensions find it and its hooks run before the app's
+    metrics.init_app(app)
     bcrypt.init_app(app)
+    img_util.init_app(app)
+    export_jobs.init_app(app)
+    tiles.init_app(app)
+    ingest.init_app(app)
+    users.init_app(app)
+    reaper.init_app(app)
     db.init_app(app)
     Migrate(app, db)
 
@@ -0,0 +1,198 @@
+import asyncio
+import contextvars
+import io
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator
+from flask import Flask, Response, request
+from werkzeug.exceptions import ClientDisconnected
+from utils import iterate_in_thread
+
+# Where views leave a body that is sent from the event loop
+ASYNC_BODY = 'annotate.async_body'
+
+
+def serving_async() -> bool:
+    """Return whether the current request is served by `AsgiApp`, whose loop awaits async bodies."""
+    return 'asgi.scope' in request.environ
+
+
+class Prepended:
+    """`first`, then the chunks of `rest`, which is closed with it even if it was never iterated."""
+
+    def __init__(self, first: bytes, rest: AsyncIterator[bytes]) -> None:
+        self._first = first
+        self._rest = rest
+
+    def __aiter__(self) -> 'Prepended':
+        return self
+
+    async def __anext__(self) -> bytes:
+        if self._first is None:
+            return await self._rest.__anext__()
+
+        first, self._first = self._first, None
+        return first
+
+    async def aclose(self) -> None:
+        self._first = None
+        await self._rest.aclose()
+
+
+class RequestBody(io.RawIOBase):
+    """`wsgi.input` fed from the ASGI `receive` channel, read by a view's thread as it goes."""
+
+    def __init__(self, receive, loop: asyncio.AbstractEventLoop) -> None:
+        self._receive = receive
+        self._loop = loop
+        self._buffer = bytearray()
+        self._more = True
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer and self._more:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+
+            self._buffer += message.get('body', b'')
+            self._more = message.get('more_body', False)
+
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        del self._buffer[:n]
+
+        return n
+
+
+class AsgiApp:
+    """Serves the Flask app to an ASGI server, e.g. `uvicorn asgi:application`.
+
+    Views stay plain Flask views and run on a pool of `ASGI_THREADS`
+    threads, where they use SQLAlchemy as usual. `ImageUtil` is attached to
+    the server's event loop, so every call to the image store, from views
+    or from the background pools, is made there. Response bodies that are
+    async iterables, such as streamed exports in this mode, are sent from
+    the loop and hold no thread while they wait on the image store, which
+    lets one worker serve many exports at once. Request bodies are read
+    from the server while the view consumes them.
+    """
+
+    def __init__(self, app: Flask, img_util) -> None:
+        self.app = app
+        self.img_util = img_util
+        self.executor = None
+
+        app.after_request(self._keep_async_body)
+
+    def _keep_async_body(self, response: Response) -> Response:
+        if hasattr(response.response, '__aiter__'):
+            request.environ[ASYNC_BODY] = response.response
+
+        return response
+
+    async def __call__(self, scope: dict, receive, send) -> None:
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            self.startup()
+            await self.http(scope, receive, send)
+
+    def startup(self) -> None:
+        # Servers that skip the lifespan protocol start on their first request
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.app.config['ASGI_THREADS'],
+                thread_name_prefix='asgi-view'
+            )
+            self.img_util.attach(asyncio.get_running_loop())
+
+    async def lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.executor is not None:
+                    await self.img_util.detach()
+                    self.executor.shutdown(wait=False)
+                    self.executor = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def environ(self, scope: dict, body: RequestBody) -> dict:
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BufferedReader(body, 64 * 1024),
+            # Read to the end of a chunked body without a Content-Length
+            'wsgi.input_terminated': True,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'asgi.scope': scope
+        }
+
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = f"HTTP_{name}"
+
+            environ[name] = f"{environ[name]},{value}" if name in environ else value
+
+        return environ
+
+    async def http(self, scope: dict, receive, send) -> None:
+        loop = asyncio.get_running_loop()
+        environ = self.environ(scope, RequestBody(receive, loop))
+        started = {}
+
+        def start_response(status: str, headers: list[tuple[str, str]], exc_info=None) -> None:
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+        # Request metrics are kept in context variables, sent bodies see the view's
+        context = contextvars.copy_context()
+        app_iter = await loop.run_in_executor(self.executor, context.run, self.app, environ, start_response)
+        body = environ.get(ASYNC_BODY)
+        try:
+            await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+            if scope['method'] != 'HEAD':
+                if body is None:
+                    # Closed by the thread that iterates it
+                    body, app_iter = iterate_in_thread(app_iter), None
+                await asyncio.create_task(self.send_body(body, send), context=context)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # A body left unsent, as for HEAD, may already hold downloads
+            if body is not None:
+                await asyncio.create_task(self.close_body(body), context=context)
+            if hasattr(app_iter, 'close'):
+                await loop.run_in_executor(self.executor, context.run, app_iter.close)
+
+    @staticmethod
+    async def send_body(body: AsyncIterator[bytes], send) -> None:
+        async for chunk in body:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+    @staticmethod
+    async def close_body(body: AsyncIterator[bytes]) -> None:
+        await body.aclose()
@@ -1,22 +1,77 @@
+import hashlib
+import io
+import logging
+
+from datetime import datetime, timedelta
 from flask_app.auth_bp import auth
-from flask import request, render_template, redirect, url_for, g, session, jsonify
-from storage import user_repo, get_db_session, project_repo, image_repo, category_repo, demo_repo
-from flask_app import bcrypt
+from flask import current_app, request, render_template, redirect, url_for, g, session, jsonify
+from sqlalchemy.exc import IntegrityError
+from storage import user_repo, get_db_session, project_repo, image_repo, category_repo, demo_repo, asset_repo
+from storage.image_store import image_info
+from flask_app import bcrypt, img_util, users
 from flask_app.services import require_login
-from src.model import User, Project, Image, Category
+from src.model import User, Project, Image, Category, Asset
 from werkzeug.exceptions import BadRequest, NotFound, InternalServerError
-from utils import generate_unique_name, ImageUtil
+from utils import generate_unique_name
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_demo_template() -> list[Asset]:
+    """Return the assets of the demo images, adding any the template lacks.
+
+    Each demo image becomes an asset the first time it is needed, from a
+    single download of the images that are not assets yet. The demo row
+    keeps a reference to its asset, so the stored file outlives every
+    demo project that shares it. A row whose image cannot be read is
+    marked failed and left out, rather than downloaded on every sign-in.
+    """
+    demos = demo_repo.get_unlinked()
+    if demos:
+        contents = img_util.fetch_images([demo.url for demo in demos])
+        for demo, content in zip(demos, contents):
+            info = image_info(io.BytesIO(content))
+            if info is None:
+                logger.warning(f"Demo image {demo.url} is not a supported image")
+                demo_repo.fail(demo.id)
+                continue
+
+            digest = hashlib.sha256(content).hexdigest()
+            asset = asset_repo.acquire(digest)
+            if asset is None:
+                _, width, height = info
+                asset = Asset(digest, demo.url, width, height)
+                asset_repo.add(asset)
+            demo_repo.link(demo.id, asset.id)
+
+        try:
+            get_db_session().commit()
+        except IntegrityError:
+            # Prepared concurrently by another request
+            get_db_session().rollback()
+
+    return demo_repo.get_template()
 
-img_util = ImageUtil()
+
+@auth.cli.command('build-demo')
+def build_demo() -> None:
+    """Add the demo images to the template demo users are given."""
+    print(f"Demo template holds {len(prepare_demo_template())} images")
 
 
 @auth.route('/demo-signin', methods=['GET'])
 def demo_signin():
     if not session.get('user_id'):
+        try:
+            template = prepare_demo_template()
+        except Exception:
+            raise InternalServerError('Network Error')
+
         usernames = user_repo.get_usernames()
         username = generate_unique_name(usernames, 'demo')
 
-        user = User(username=username, password='demo')
+        expires_at = datetime.now() + timedelta(seconds=current_app.config['DEMO_TTL'])
+        user = User(username=username, password='demo', expires_at=expires_at)
         user_id = user_repo.add(user)
 
         session['user_id'] = user_id
@@ -37,30 +92,18 @@ def demo_signin():
             category = Category(name=name, color=color)
             _ = category_repo.add(category, project_id)
 
-        # Upload Images
-        demo_images_urls = demo_repo.get_image_urls()
-        images = img_util.fetch_images(demo_images_urls)
-
-        files = []
+        # Images share the template's stored files, nothing is uploaded
+        images = []
         image_names = []
 
-        for img in images:
+        for asset in template:
             image_name = generate_unique_name(image_names, 'image')
             image_names.append(image_name)
-            files.append((
-                image_name,
-                img.content,
-                "application/octet-stream"
-            ))
-
-        try:
-            uploaded_imgs = img_util.upload_images(files, f"FLASK/{project_name}")
-        except Exception:
-            raise InternalServerError('Network Error')
+            image = Image(asset.url, asset.width, asset.height, image_name)
+            images.append((image, asset.id))
 
-        for uploaded_img in uploaded_imgs:
-            image = Image(**uploaded_img)
-            _ = image_repo.add(image, project_id)
+        image_repo.add_many(images, project_id)
+        asset_repo.retain([asset.id for asset in template])
 
         get_db_session().commit()
 
@@ -119,15 +162,12 @@ def signout():
     _ = session.pop('user_id', None)
     demo = session.pop('demo', None)
     if demo:
-        for project in project_repo.list(g.user.id):
-            try:
-                img_util.delete_all(f"FLASK/{project.name}")
-            except Exception:
-                raise InternalServerError('Network Error')
-
-        user_repo.remove(g.user.id)
+        # Removed with everything it owns by the reaper
+        user_repo.expire(g.user.id, datetime.now())
         get_db_session().commit()
 
+    users.invalidate(g.user.id)
+
     return jsonify({
         'status': 'success',
         'data': {}
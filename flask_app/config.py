@@ -5,6 +5,98 @@ class Config:
     SECRET_KEY = getenv('SECRET_KEY')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Prometheus-style histograms on /metrics, and a log line with the
+    # breakdown of every request slower than SLOW_REQUEST_SECONDS (0 disables it)
+    METRICS_ENABLED = getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    SLOW_REQUEST_SECONDS = float(getenv('SLOW_REQUEST_SECONDS', 0))
+
+    # Signed-in users are cached per worker for this many seconds
+    USER_CACHE_TTL = float(getenv('USER_CACHE_TTL', 60))
+    USER_CACHE_SIZE = int(getenv('USER_CACHE_SIZE', 10000))
+
+    # Demo users expire this many seconds after signing in, or when they sign out
+    DEMO_TTL = float(getenv('DEMO_TTL', 24 * 3600))
+
+    # Background removal of expired demo users and unused image store folders:
+    # seconds between runs of each worker (0 disables it, `flask reap` runs it
+    # once), users per batch, seconds to pause between batches, and how long a
+    # worker holds the users it claimed before another may retry them
+    REAPER_INTERVAL = float(getenv('REAPER_INTERVAL', 600))
+    REAPER_BATCH_SIZE = int(getenv('REAPER_BATCH_SIZE', 50))
+    REAPER_PAUSE = float(getenv('REAPER_PAUSE', 1.0))
+    REAPER_LEASE = float(getenv('REAPER_LEASE', 600))
+
+    # Image storage backend: 'cloudinary' or 'local'
+    IMAGE_STORE = getenv('IMAGE_STORE', 'cloudinary')
+    LOCAL_STORE_ROOT = getenv('LOCAL_STORE_ROOT', 'media')
+    LOCAL_STORE_URL = '/media'
+    CLOUDINARY_API_URL = getenv('CLOUDINARY_API_URL', 'https://api.cloudinary.com')
+
+    # On-disk cache of remote images used by exports, shared by the workers
+    IMAGE_CACHE_DIR = getenv('IMAGE_CACHE_DIR', 'cache/images')
+    IMAGE_CACHE_MAX_BYTES = int(getenv('IMAGE_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+    IMAGE_CACHE_MAX_AGE = float(getenv('IMAGE_CACHE_MAX_AGE', 7 * 24 * 3600))
+    IMAGE_CACHE_FRESHNESS = float(getenv('IMAGE_CACHE_FRESHNESS', 3600))
+
+    # Thumbnails and tile pyramids of stored images, built on a per-worker process pool
+    TILE_DIR = getenv('TILE_DIR', 'cache/tiles')
+    TILE_SIZE = int(getenv('TILE_SIZE', 256))
+    TILE_QUALITY = int(getenv('TILE_QUALITY', 85))
+    THUMBNAIL_SIZE = int(getenv('THUMBNAIL_SIZE', 256))
+    TILE_WORKERS = int(getenv('TILE_WORKERS', 2))
+
+    # Uploads are spooled here until the ingest pipeline has stored them
+    INGEST_DIR = getenv('INGEST_DIR', 'ingest')
+    INGEST_WORKERS = int(getenv('INGEST_WORKERS', 8))
+    # Seconds after which an image still pending counts as interrupted
+    INGEST_TIMEOUT = int(getenv('INGEST_TIMEOUT', 30 * 60))
+
+    # Uploads are parsed from the request body `UPLOAD_READ_SIZE` bytes at a time,
+    # form fields are bounded by Flask's `MAX_FORM_MEMORY_SIZE` and `MAX_FORM_PARTS`
+    UPLOAD_READ_SIZE = int(getenv('UPLOAD_READ_SIZE', 64 * 1024))
+    # Uploads of one request that may be in flight to the image store at once
+    INGEST_REQUEST_CONCURRENCY = int(getenv('INGEST_REQUEST_CONCURRENCY', 4))
+
+    # Default and largest page of `GET /projects/<id>/images`
+    IMAGES_PAGE_SIZE = int(getenv('IMAGES_PAGE_SIZE', 100))
+    IMAGES_PAGE_MAX = int(getenv('IMAGES_PAGE_MAX', 500))
+
+    # Images removed per transaction by `DELETE /projects/<id>/images`, their
+    # files are deleted from the store in as few calls as it allows
+    IMAGE_DELETE_BATCH_SIZE = int(getenv('IMAGE_DELETE_BATCH_SIZE', 100))
+
+    # Annotation rows fetched per round trip while streaming annotations.json
+    EXPORT_CURSOR_BATCH = int(getenv('EXPORT_CURSOR_BATCH', 1000))
+
+    # Number of image downloads kept in flight while streaming an export
+    EXPORT_FETCH_WINDOW = int(getenv('EXPORT_FETCH_WINDOW', 16))
+
+    # Background export jobs: where archives are written, and how many run per worker
+    EXPORT_DIR = getenv('EXPORT_DIR', 'exports')
+    EXPORT_MAX_JOBS = int(getenv('EXPORT_MAX_JOBS', 2))
+    # Seconds without progress after which a job counts as interrupted, and
+    # seconds a finished archive is kept
+    EXPORT_JOB_TIMEOUT = int(getenv('EXPORT_JOB_TIMEOUT', 900))
+    EXPORT_TTL = int(getenv('EXPORT_TTL', 24 * 60 * 60))
+
+    # Threads per worker rendering the label files of YOLO and Pascal VOC exports
+    EXPORT_LABEL_WORKERS = int(getenv('EXPORT_LABEL_WORKERS', 4))
+
+    # Threads running views when served by `asgi.py`, streamed exports need none
+    ASGI_THREADS = int(getenv('ASGI_THREADS', 32))
+
+    # Connection pool of the image host client, shared by a worker's requests
+    HTTP_MAX_CONNECTIONS = int(getenv('HTTP_MAX_CONNECTIONS', 100))
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = int(getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', 20))
+    HTTP_KEEPALIVE_EXPIRY = float(getenv('HTTP_KEEPALIVE_EXPIRY', 30.0))
+    HTTP_TIMEOUT = float(getenv('HTTP_TIMEOUT', 30.0))
+
+    # Uploads in flight per batch, and per-file retries with jittered backoff
+    UPLOAD_CONCURRENCY = int(getenv('UPLOAD_CONCURRENCY', 8))
+    UPLOAD_RETRIES = int(getenv('UPLOAD_RETRIES', 3))
+    UPLOAD_BACKOFF_BASE = float(getenv('UPLOAD_BACKOFF_BASE', 0.5))
+    UPLOAD_BACKOFF_MAX = float(getenv('UPLOAD_BACKOFF_MAX', 10.0))
+
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -18,7 +110,8 @@ class DevelopmentConfig(Config):
 
 class TestingConfig(Config):
     DEBUG = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_DATABASE_URI = getenv('TEST_DATABASE_URL', 'sqlite:///:memory:')
+    REAPER_INTERVAL = float(getenv('REAPER_INTERVAL', 0))
 
 
 class DeploymentConfig(Config):
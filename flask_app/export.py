@@ -0,0 +1,565 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import zipfile
+
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+from typing import AsyncIterator, Callable, Iterable, Iterator
+from xml.sax.saxutils import escape as xml_escape
+from flask import Flask
+from storage import project_repo, export_job_repo, get_db_session
+from flask_app.metrics import segment
+from utils import iterate_in_thread
+
+logger = logging.getLogger(__name__)
+
+NOT_IMPLEMENTED_ERROR = NotImplementedError('Method must be implemented')
+
+EXPORT_FORMATS = ('coco', 'yolo', 'voc')
+
+# Characters of annotations.json, and bytes of small entries, handed out at a time
+JSON_CHUNK_SIZE = 256 * 1024
+
+
+class ZipStream:
+    """Write-only sink that lets `zipfile` build an archive as a stream.
+
+    It reports a position but cannot seek, so `zipfile` falls back to data
+    descriptors and every entry can be handed out as soon as it is written.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self._position += len(data)
+
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    @property
+    def pending(self) -> int:
+        """Bytes written since the last `pop`."""
+        return len(self._buffer)
+
+    def pop(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+
+        return data
+
+
+def iter_coco_json(project: dict, annotations: Iterable[dict], compact: bool = False) -> Iterator[str]:
+    """Yield the COCO document of `project` piece by piece.
+
+    The output is the same as `json.dumps` of `project` with `annotations`
+    as its last list, indented by 2 or, when `compact`, with no whitespace
+    at all, but only one annotation is held in memory at a time.
+    """
+    if compact:
+        separators, newline, item_newline = (',', ':'), '', ''
+    else:
+        separators, newline, item_newline = (',', ': '), '\n  ', '\n    '
+
+    def items(values: Iterable[dict]) -> Iterator[str]:
+        empty = True
+        for value in values:
+            encoded = json.dumps(value, separators=separators, indent=None if compact else 2)
+            # Strings in JSON cannot hold a raw newline, so this only shifts the structure
+            yield ('[' if empty else ',') + item_newline + encoded.replace('\n', item_newline)
+            empty = False
+
+        yield '[]' if empty else newline + ']'
+
+    sections = {**project, 'annotations': annotations}
+    yield '{'
+    for i, (key, values) in enumerate(sections.items()):
+        yield (',' if i else '') + newline + json.dumps(key) + separators[1]
+        yield from items(values)
+    yield '\n}' if not compact else '}'
+
+
+def encode_chunks(pieces: Iterable[str], size: int = JSON_CHUNK_SIZE) -> Iterator[bytes]:
+    """Join text pieces into UTF-8 chunks of about `size` characters."""
+    buffer = []
+    buffered = 0
+    for piece in pieces:
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= size:
+            yield ''.join(buffer).encode('utf-8')
+            buffer.clear()
+            buffered = 0
+
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def ordered_map(executor: Executor, fn: Callable, items: Iterable, window: int) -> Iterator:
+    """Like `executor.map`, but with at most `window` calls submitted ahead of the consumer."""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+## Exporters
+def stem(filename: str) -> str:
+    """Label files are named after their image, without its extension."""
+    return os.path.splitext(filename)[0]
+
+
+class Exporter(ABC):
+    """Lays out a project's images and labels in an export archive.
+
+    Images are written first, under `image_dir`, as they are downloaded,
+    then the entries yielded by `entries`: `(name, data)` pairs where data
+    is either bytes or an iterator of byte chunks for large entries.
+    """
+
+    # Whether `entries` needs the annotations of each image next to each other
+    by_image = False
+    image_dir = 'images'
+    suffix = 'annotations'
+
+    def image_path(self, image: dict) -> str:
+        return f"{self.image_dir}/{image['filename']}"
+
+    @abstractmethod
+    def entries(self, project: dict, annotations: Iterable[dict]) -> Iterator[tuple[str, bytes | Iterator[bytes]]]:
+        raise NOT_IMPLEMENTED_ERROR
+
+
+class CocoExporter(Exporter):
+    """A single `annotations.json` in COCO format, as documented in the README."""
+
+    def __init__(self, compact: bool = False) -> None:
+        self.compact = compact
+
+    def entries(self, project: dict, annotations: Iterable[dict]) -> Iterator[tuple[str, bytes | Iterator[bytes]]]:
+        yield 'annotations.json', encode_chunks(iter_coco_json(project, annotations, self.compact))
+
+
+class LabelFileExporter(Exporter):
+    """Base of the formats with one label file per image.
+
+    Label files are rendered in batches on `executor` while the archive
+    compresses the previous ones, with at most `window` batches in flight.
+    """
+
+    by_image = True
+
+    # Images rendered per task
+    BATCH_SIZE = 256
+
+    def __init__(self, executor: Executor, window: int = 8) -> None:
+        self.executor = executor
+        self.window = window
+
+    @abstractmethod
+    def label_path(self, image: dict) -> str:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def render(self, image: dict, boxes: list[dict], categories: dict) -> bytes:
+        raise NOT_IMPLEMENTED_ERROR
+
+    def categories(self, project: dict) -> dict:
+        """Map category ids to what `render` writes for them."""
+        return {category['id']: category['name'] for category in project['categories']}
+
+    def extra_entries(self, project: dict) -> Iterator[tuple[str, bytes]]:
+        return iter(())
+
+    def labelled_images(self, project: dict, annotations: Iterable[dict]) -> Iterator[tuple[dict, list[dict]]]:
+        images = {image['id']: image for image in project['images']}
+        for image_id, boxes in groupby(annotations, key=itemgetter('image_id')):
+            yield images.pop(image_id), list(boxes)
+
+        # Images without any annotation still get their (empty) label file
+        for image in images.values():
+            yield image, []
+
+    def entries(self, project: dict, annotations: Iterable[dict]) -> Iterator[tuple[str, bytes | Iterator[bytes]]]:
+        yield from self.extra_entries(project)
+
+        categories = self.categories(project)
+
+        def render_batch(batch: list[tuple[dict, list[dict]]]) -> list[tuple[str, bytes]]:
+            return [(self.label_path(image), self.render(image, boxes, categories)) for image, boxes in batch]
+
+        batches = batched(self.labelled_images(project, annotations), self.BATCH_SIZE)
+        for rendered in ordered_map(self.executor, render_batch, batches, self.window):
+            yield from rendered
+
+
+class YoloExporter(LabelFileExporter):
+    """`labels/<image>.txt` with one `class cx cy w h` line per box, relative to the image size."""
+
+    suffix = 'yolo'
+
+    def label_path(self, image: dict) -> str:
+        return f"labels/{stem(image['filename'])}.txt"
+
+    def categories(self, project: dict) -> dict:
+        return {category['id']: index for index, category in enumerate(project['categories'])}
+
+    def extra_entries(self, project: dict) -> Iterator[tuple[str, bytes]]:
+        names = [category['name'] for category in project['categories']]
+        yield 'classes.txt', ''.join(f"{name}\n" for name in names).encode('utf-8')
+        yield 'data.yaml', (
+            "path: .\ntrain: images\nval: images\n"
+            f"nc: {len(names)}\n"
+            f"names: {json.dumps(names)}\n"
+        ).encode('utf-8')
+
+    def render(self, image: dict, boxes: list[dict], categories: dict) -> bytes:
+        width, height = image['width'], image['height']
+        # Boxes cannot be normalized against an unknown size
+        if not boxes or not (width and height):
+            return b''
+
+        # Normalize column by column rather than box by box
+        xs, ys, ws, hs = zip(*(box['bbox'] for box in boxes))
+        cxs = [(x + w / 2) / width for x, w in zip(xs, ws)]
+        cys = [(y + h / 2) / height for y, h in zip(ys, hs)]
+        nws = [w / width for w in ws]
+        nhs = [h / height for h in hs]
+        classes = [categories[box['category_id']] for box in boxes]
+
+        return ''.join(
+            f"{c} {cx:.6f} {cy:.6f} {w:.6f} {h:.6f}\n"
+            for c, cx, cy, w, h in zip(classes, cxs, cys, nws, nhs)
+        ).encode('utf-8')
+
+
+class VocExporter(LabelFileExporter):
+    """Pascal VOC layout: `JPEGImages/`, `Annotations/<image>.xml` and an image set listing them."""
+
+    suffix = 'voc'
+    image_dir = 'JPEGImages'
+
+    def label_path(self, image: dict) -> str:
+        return f"Annotations/{stem(image['filename'])}.xml"
+
+    def extra_entries(self, project: dict) -> Iterator[tuple[str, bytes]]:
+        names = ''.join(f"{stem(image['filename'])}\n" for image in project['images'])
+        yield 'ImageSets/Main/default.txt', names.encode('utf-8')
+
+    def render(self, image: dict, boxes: list[dict], categories: dict) -> bytes:
+        objects = ''.join(
+            "  <object>\n"
+            f"    <name>{xml_escape(categories[box['category_id']])}</name>\n"
+            "    <pose>Unspecified</pose>\n"
+            "    <truncated>0</truncated>\n"
+            "    <difficult>0</difficult>\n"
+            "    <bndbox>\n"
+            f"      <xmin>{round(x)}</xmin>\n"
+            f"      <ymin>{round(y)}</ymin>\n"
+            f"      <xmax>{round(x + w)}</xmax>\n"
+            f"      <ymax>{round(y + h)}</ymax>\n"
+            "    </bndbox>\n"
+            "  </object>\n"
+            for box in boxes
+            for x, y, w, h in (box['bbox'],)
+        )
+
+        return (
+            "<annotation>\n"
+            f"  <folder>{self.image_dir}</folder>\n"
+            f"  <filename>{xml_escape(image['filename'])}</filename>\n"
+            "  <size>\n"
+            f"    <width>{round(image['width'])}</width>\n"
+            f"    <height>{round(image['height'])}</height>\n"
+            "    <depth>3</depth>\n"
+            "  </size>\n"
+            "  <segmented>0</segmented>\n"
+            f"{objects}"
+            "</annotation>\n"
+        ).encode('utf-8')
+
+
+def snapshot_annotations(project: dict, annotations: Iterable[dict]) -> Iterator[dict]:
+    """Keep the annotations of the images and categories in the project snapshot.
+
+    Annotations are read after the snapshot, once the images have been
+    downloaded, so they may meanwhile refer to images that became ready or
+    categories that were added. The snapshot holds the categories of other
+    projects that legacy annotations use, so those are kept.
+    """
+    image_ids = {image['id'] for image in project['images']}
+    category_ids = {category['id'] for category in project['categories']}
+    for annotation in annotations:
+        if annotation['image_id'] in image_ids and annotation['category_id'] in category_ids:
+            yield annotation
+
+
+def write_image(zip_file: zipfile.ZipFile, exporter: Exporter, image: dict, content: bytes) -> None:
+    with segment('compress'):
+        zip_file.writestr(exporter.image_path(image), content)
+
+
+def write_entries(
+    zip_file: zipfile.ZipFile,
+    sink: ZipStream,
+    project: dict,
+    annotations: Iterable[dict],
+    exporter: Exporter
+) -> Iterator[bytes]:
+    """Write the exporter's entries, built from `annotations`, yielding the archive as it grows."""
+    for name, data in exporter.entries(project, snapshot_annotations(project, annotations)):
+        if isinstance(data, bytes):
+            with segment('compress'):
+                zip_file.writestr(name, data)
+
+            # Small entries are handed out together
+            if sink.pending >= JSON_CHUNK_SIZE:
+                yield sink.pop()
+            continue
+
+        # The size is unknown up front, so allow the entry to outgrow 4 GiB
+        with zip_file.open(name, 'w', force_zip64=True) as entry:
+            for chunk in data:
+                with segment('compress'):
+                    entry.write(chunk)
+                yield sink.pop()
+
+
+def stream_export_archive(
+    project: dict,
+    images: Iterator[tuple[int, bytes]],
+    annotations: Iterable[dict],
+    exporter: Exporter
+) -> Iterator[bytes]:
+    """Yield an export zip chunk by chunk.
+
+    `images` yields `(index, content)` pairs in completion order, where
+    `index` points into `project['images']`. The exporter's entries follow,
+    built from `annotations`.
+    """
+    sink = ZipStream()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for index, content in images:
+            write_image(zip_file, exporter, project['images'][index], content)
+            yield sink.pop()
+
+        yield from write_entries(zip_file, sink, project, annotations, exporter)
+
+    yield sink.pop()
+
+
+async def async_stream_export_archive(
+    project: dict,
+    images: AsyncIterator[tuple[int, bytes]],
+    annotations: Iterable[dict],
+    exporter: Exporter
+) -> AsyncIterator[bytes]:
+    """`stream_export_archive` for an event loop, with `images` awaited on it.
+
+    Deflating runs in threads, and the entries, which read the database,
+    run in a single one, so the loop only waits on the image store.
+    """
+    sink = ZipStream()
+    zip_file = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED)
+    try:
+        async for index, content in images:
+            await asyncio.to_thread(write_image, zip_file, exporter, project['images'][index], content)
+            yield sink.pop()
+
+        async for chunk in iterate_in_thread(write_entries(zip_file, sink, project, annotations, exporter)):
+            yield chunk
+    finally:
+        zip_file.close()
+
+    yield sink.pop()
+
+
+class ExportJobRunner:
+    """Builds export archives on a thread pool that is separate from request handling.
+
+    Jobs are rows of `export_jobs`, so any worker can report their progress.
+    Each worker process runs at most `EXPORT_MAX_JOBS` of them at a time and
+    queues the rest.
+
+    The queue lives in the worker, so `sweep`, run by the reaper, fails the
+    jobs of workers that went away: those not updated for
+    `EXPORT_JOB_TIMEOUT` seconds. It also expires archives `EXPORT_TTL`
+    seconds after they are done, and deletes the files no job needs.
+    """
+
+    # Minimum seconds between two progress writes of a job
+    PROGRESS_INTERVAL = 1.0
+
+    def __init__(self, img_util) -> None:
+        self.img_util = img_util
+        self.app = None
+        self._executor = None
+        self._label_executor = None
+        self._pid = None
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        Path(app.config['EXPORT_DIR']).mkdir(parents=True, exist_ok=True)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # Threads do not survive a fork, each worker gets its own pool
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.app.config['EXPORT_MAX_JOBS'],
+                thread_name_prefix='export-job'
+            )
+            self._label_executor = ThreadPoolExecutor(
+                max_workers=self.app.config['EXPORT_LABEL_WORKERS'],
+                thread_name_prefix='export-labels'
+            )
+            self._pid = os.getpid()
+
+        return self._executor
+
+    @property
+    def label_executor(self) -> ThreadPoolExecutor:
+        """Pool rendering label files, shared by the streamed exports and the jobs of a worker."""
+        self.executor
+        return self._label_executor
+
+    def exporter(self, format: str, compact: bool = False) -> Exporter:
+        if format == 'coco':
+            return CocoExporter(compact)
+        if format == 'yolo':
+            return YoloExporter(self.label_executor)
+        if format == 'voc':
+            return VocExporter(self.label_executor)
+
+        raise ValueError(f"Unknown export format {format!r}, expected one of {', '.join(EXPORT_FORMATS)}")
+
+    def artifact_path(self, job_id: str) -> Path:
+        return Path(self.app.config['EXPORT_DIR']).resolve() / f"{job_id}.zip"
+
+    def submit(self, job_id: str, project_id: str, exporter: Exporter) -> None:
+        self.executor.submit(self._run, job_id, project_id, exporter)
+
+    def discard(self, job_ids: list[str]) -> None:
+        for job_id in job_ids:
+            path = self.artifact_path(job_id)
+            path.unlink(missing_ok=True)
+            path.with_suffix('.part').unlink(missing_ok=True)
+
+    def sweep(self) -> tuple[int, int]:
+        """Fail interrupted jobs, expire old archives and delete files of no job.
+
+        Returns the number of jobs failed and expired.
+        """
+        now = datetime.now()
+        failed = export_job_repo.fail_stale(now - timedelta(seconds=self.app.config['EXPORT_JOB_TIMEOUT']), now)
+        expired = export_job_repo.expire_finished(now - timedelta(seconds=self.app.config['EXPORT_TTL']))
+        get_db_session().commit()
+        if failed or expired:
+            logger.info(f"Failed {len(failed)} interrupted export jobs, expired {len(expired)}")
+
+        paths = [
+            path for path in Path(self.app.config['EXPORT_DIR']).resolve().iterdir()
+            if path.suffix in ('.zip', '.part')
+        ]
+        statuses = export_job_repo.get_statuses([path.stem for path in paths])
+        for path in paths:
+            status = statuses.get(path.stem)
+            # A running job renames its archive just before it is marked done
+            needed = ('done', 'running') if path.suffix == '.zip' else ('queued', 'running')
+            if status not in needed:
+                path.unlink(missing_ok=True)
+
+        return len(failed), len(expired)
+
+    def _run(self, job_id: str, project_id: str, exporter: Exporter) -> None:
+        with self.app.app_context():
+            try:
+                self._export(job_id, project_id, exporter)
+            except Exception as e:
+                logger.exception(f"Export job {job_id} failed")
+                get_db_session().rollback()
+                self.artifact_path(job_id).with_suffix('.part').unlink(missing_ok=True)
+                export_job_repo.update(
+                    job_id,
+                    status='failed',
+                    error=str(e)[:256],
+                    finished_at=datetime.now()
+                )
+                get_db_session().commit()
+
+    def _export(self, job_id: str, project_id: str, exporter: Exporter) -> None:
+        project = project_repo.export_project_data(project_id)
+        if not project:
+            raise ValueError('Project does not exist')
+
+        project.pop('name')
+        image_urls = project.pop('image_urls')
+
+        # Failed by `sweep` while it waited in the queue
+        started = export_job_repo.start(job_id, len(image_urls), datetime.now())
+        get_db_session().commit()
+        if not started:
+            return
+
+        progress = {'images_fetched': 0, 'bytes_written': 0}
+
+        def count(images: Iterator[tuple[int, bytes]]) -> Iterator[tuple[int, bytes]]:
+            for image in images:
+                progress['images_fetched'] += 1
+                yield image
+
+        images = self.img_util.iter_images(image_urls, self.app.config['EXPORT_FETCH_WINDOW'])
+        annotations = project_repo.iter_export_annotations(
+            project_id,
+            self.app.config['EXPORT_CURSOR_BATCH'],
+            by_image=exporter.by_image
+        )
+        path = self.artifact_path(job_id)
+        part_path = path.with_suffix('.part')
+
+        reported_at = time.monotonic()
+        with open(part_path, 'wb') as f:
+            for chunk in stream_export_archive(project, count(images), annotations, exporter):
+                f.write(chunk)
+                progress['bytes_written'] += len(chunk)
+
+                if time.monotonic() - reported_at > self.PROGRESS_INTERVAL:
+                    export_job_repo.update(job_id, **progress)
+                    get_db_session().commit()
+                    reported_at = time.monotonic()
+
+        os.replace(part_path, path)
+
+        export_job_repo.update(job_id, status='done', finished_at=datetime.now(), **progress)
+        get_db_session().commit()
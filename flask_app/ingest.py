@@ -0,0 +1,264 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable
+from flask import Flask
+from sqlalchemy.exc import IntegrityError
+from src.model import Asset, Image
+from storage import asset_repo, image_repo, project_repo, get_db_session
+from storage.image_store import copy_stream
+from utils import generate_unique_name
+
+logger = logging.getLogger(__name__)
+
+
+class IngestPipeline:
+    """Pushes uploaded images to the image store after the request has returned.
+
+    Views spool each upload to `INGEST_DIR` and add its `Image` row as
+    `pending`. The pipeline then uploads the files on a per-worker thread
+    pool and marks every row `ready` (with its URL and size) or `failed` as
+    soon as its own upload finishes.
+
+    Uploads are hashed while they are spooled. Content that is already in
+    the image store, as an asset, is not uploaded again: the image shares
+    the asset and is `ready` at once. The thumbnail and tiles of an image
+    are built from the spooled file before it is marked `ready`.
+
+    `receive` takes the file parts of a multipart body as they are parsed,
+    so each upload starts while the rest of the body is still arriving. At
+    most `INGEST_REQUEST_CONCURRENCY` uploads of one request run at a time,
+    the others wait in its `UploadQueue` while the request carries on.
+
+    Uploads only live in the worker that received them, so `sweep`, run by
+    the reaper, fails the images still pending `INGEST_TIMEOUT` seconds
+    after they were staged, and deletes spool files as old as that.
+    """
+
+    def __init__(self, img_util, tiles) -> None:
+        self.img_util = img_util
+        self.tiles = tiles
+        self.app = None
+        self._executor = None
+        self._pid = None
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        Path(app.config['INGEST_DIR']).mkdir(parents=True, exist_ok=True)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # Threads do not survive a fork, each worker gets its own pool
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.app.config['INGEST_WORKERS'],
+                thread_name_prefix='ingest'
+            )
+            self._pid = os.getpid()
+
+        return self._executor
+
+    def spool_path(self, image_id: str) -> Path:
+        return Path(self.app.config['INGEST_DIR']).resolve() / image_id
+
+    def spool(self, stream, image_id: str) -> str:
+        """Write an upload to its spool file and return its SHA-256."""
+        digest = hashlib.sha256()
+        fd = os.open(self.spool_path(image_id), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            copy_stream(stream, fd, digest)
+        finally:
+            os.close(fd)
+
+        return digest.hexdigest()
+
+    def sweep(self) -> int:
+        """Fail the images whose worker went away, and delete their spool files.
+
+        Returns the number of images failed.
+        """
+        timeout = self.app.config['INGEST_TIMEOUT']
+        failed = image_repo.fail_stale(datetime.now() - timedelta(seconds=timeout))
+        for project_id in {project_id for _, project_id in failed}:
+            project_repo.bump_revision(project_id)
+        get_db_session().commit()
+        if failed:
+            logger.info(f"Failed {len(failed)} interrupted uploads")
+
+        # Staged at the same time as their image, so no pending image needs them
+        cutoff = time.time() - timeout
+        for path in Path(self.app.config['INGEST_DIR']).resolve().iterdir():
+            if path.is_file() and path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+
+        return len(failed)
+
+    def stage(self, image: Image, project_id: str, stream) -> str | None:
+        """Spool an upload and add its image to the session.
+
+        Returns the upload's digest when it still has to be submitted, or
+        None when an asset with the same content was reused.
+        """
+        digest = self.spool(stream, image.id)
+
+        asset = asset_repo.acquire(digest)
+        if asset is None:
+            image_repo.add(image, project_id)
+            return digest
+
+        self.spool_path(image.id).unlink(missing_ok=True)
+        image.url = asset.url
+        image.width = asset.width
+        image.height = asset.height
+        image.status = 'ready'
+        image_repo.add(image, project_id, asset.id)
+
+        return None
+
+    def receive(self, files: Iterable, project_id: str, folder: str, image_names: list[str]) -> list[Image]:
+        """Stage the file parts of a request one at a time and queue their uploads.
+
+        Each image is committed before the next part is read, so the images
+        received before a broken or oversized part are kept.
+        """
+        images = []
+        uploads = UploadQueue(self, self.app.config['INGEST_REQUEST_CONCURRENCY'])
+
+        for part in files:
+            image_name = generate_unique_name(image_names, 'image')
+            image_names.append(image_name)
+
+            image = Image(url='', width=0, height=0, filename=image_name, status='pending')
+            try:
+                digest = self.stage(image, project_id, part)
+                get_db_session().commit()
+            except Exception:
+                get_db_session().rollback()
+                self.spool_path(image.id).unlink(missing_ok=True)
+                raise
+            images.append(image)
+
+            if digest:
+                uploads.put(image.id, image.filename, part.mimetype, folder, digest)
+
+        return images
+
+    def _run(self, image_id: str, filename: str, mimetype: str, folder: str, digest: str) -> None:
+        path = self.spool_path(image_id)
+
+        with self.app.app_context():
+            try:
+                # An identical upload may have been stored since the image was staged
+                asset = asset_repo.acquire(digest)
+                if asset is None:
+                    # No transaction, or SQLite write lock, is held over the upload
+                    get_db_session().rollback()
+                    asset = self._store(path, filename, mimetype, folder, digest)
+                if asset is None:
+                    self._finish(image_id, status='failed')
+                    return
+
+                # Served lazily from the original if this fails
+                try:
+                    self.tiles.build(asset.url, path)
+                except Exception:
+                    logger.exception(f"Tiles of image {image_id} failed")
+
+                updated = self._finish(
+                    image_id,
+                    status='ready',
+                    asset_id=asset.id,
+                    url=asset.url,
+                    width=asset.width,
+                    height=asset.height
+                )
+
+                # The image was deleted while it was being uploaded
+                if not updated:
+                    unused = asset_repo.release([asset.id])
+                    get_db_session().commit()
+                    if unused:
+                        self.img_util.store.delete_many(unused)
+                        self.tiles.discard(unused)
+            except Exception:
+                logger.exception(f"Ingest of image {image_id} failed")
+                get_db_session().rollback()
+                self._finish(image_id, status='failed')
+            finally:
+                path.unlink(missing_ok=True)
+
+    def _store(self, path: Path, filename: str, mimetype: str, folder: str, digest: str) -> Asset | None:
+        """Upload a spooled file and add it as an asset, or return None if the upload failed."""
+        with open(path, 'rb') as f:
+            [uploaded_img] = self.img_util.upload_images([(filename, f, mimetype)], folder)
+
+        if uploaded_img['status'] != 'uploaded':
+            return None
+
+        fields = uploaded_img['image']
+        asset = Asset(digest, fields['url'], fields['width'], fields['height'])
+        try:
+            asset_repo.add(asset)
+            get_db_session().commit()
+        except IntegrityError:
+            # The same content was stored meanwhile, keep that copy
+            get_db_session().rollback()
+            self.img_util.store.delete(asset.url)
+
+            return asset_repo.acquire(digest)
+
+        return asset
+
+    def _finish(self, image_id: str, **fields: dict) -> int:
+        updated = image_repo.update(image_id, **fields)
+        if updated:
+            project_repo.bump_revision(image_repo.get_project_id(image_id))
+        get_db_session().commit()
+
+        return updated
+
+
+class UploadQueue:
+    """The uploads of one request, run on the pipeline's pool at most `concurrency` at a time.
+
+    Uploads past the limit wait in the queue rather than on a thread: each
+    running upload picks up the next queued one when it finishes.
+    """
+
+    def __init__(self, pipeline: IngestPipeline, concurrency: int) -> None:
+        self.pipeline = pipeline
+        self.concurrency = concurrency
+        self._queue = deque()
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def put(self, image_id: str, filename: str, mimetype: str, folder: str, digest: str) -> None:
+        upload = (image_id, filename, mimetype, folder, digest)
+        with self._lock:
+            if self._running >= self.concurrency:
+                self._queue.append(upload)
+                return
+            self._running += 1
+
+        self.pipeline.executor.submit(self._drain, upload)
+
+    def _drain(self, upload: tuple) -> None:
+        while upload is not None:
+            # A failed upload must not stall the ones queued behind it
+            try:
+                self.pipeline._run(*upload)
+            except Exception:
+                logger.exception(f"Ingest of image {upload[0]} failed")
+            with self._lock:
+                if self._queue:
+                    upload = self._queue.popleft()
+                else:
+                    upload = None
+                    self._running -= 1
@@ -0,0 +1,264 @@
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+from flask import Flask, Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BYTES_BUCKETS = tuple(1024 * 10 ** i for i in range(7))
+INF = 'le="+Inf"'
+
+# Breakdown of the request being served, shared with the tasks it starts on
+# the ImageUtil loop since they run in copies of its context
+_request_stats: ContextVar['RequestStats | None'] = ContextVar('request_stats', default=None)
+
+
+class Histogram:
+    """Prometheus histogram with a fixed set of labels, safe to update from any thread."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...], buckets: tuple[float, ...]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+
+        for key, counts, total, count in sorted(series):
+            labels = [f'{label}="{escape(value)}"' for label, value in zip(self.labels, key)]
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = f'le="{bound:g}"'
+                yield f"{self.name}_bucket{label_set(labels + [le])} {bucket_count}"
+            yield f"{self.name}_bucket{label_set(labels + [INF])} {count}"
+            yield f"{self.name}_sum{label_set(labels)} {total:g}"
+            yield f"{self.name}_count{label_set(labels)} {count}"
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def label_set(labels: list[str]) -> str:
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class RequestStats:
+    __slots__ = ('started_at', 'sql_queries', 'sql_seconds', 'segments')
+
+    def __init__(self) -> None:
+        self.started_at = time.perf_counter()
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        # name -> [calls, seconds, bytes]
+        self.segments = {}
+
+    def add(self, name: str, seconds: float, nbytes: int = 0) -> None:
+        segment = self.segments.setdefault(name, [0, 0.0, 0])
+        segment[0] += 1
+        segment[1] += seconds
+        segment[2] += nbytes
+
+    def breakdown(self) -> str:
+        parts = [f"sql {self.sql_queries} queries {self.sql_seconds:.3f}s"]
+        for name, (calls, seconds, nbytes) in sorted(self.segments.items()):
+            part = f"{name} {calls} calls {seconds:.3f}s"
+            if nbytes:
+                part += f" {nbytes / 1024 ** 2:.1f}MiB"
+            parts.append(part)
+
+        return ', '.join(parts)
+
+
+@contextmanager
+def segment(name: str) -> Iterator[dict]:
+    """Time a block as part of the current request's breakdown.
+
+    Set `bytes` on the yielded dict to record how much data the block moved.
+    Outside of a request this does nothing.
+    """
+    info = {'bytes': 0}
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.add(name, time.perf_counter() - start, info['bytes'])
+
+
+class Metrics:
+    """Request timings, SQL and outbound call breakdowns, exposed on `/metrics`.
+
+    Every route is timed from the start of the request until its response
+    has been sent, so streamed bodies such as exports are included. SQL is
+    counted through engine events and outbound calls are reported by
+    `ImageUtil` through `outbound`. Figures are kept per worker process;
+    scrape each worker, or run one, to get the full picture. Requests slower
+    than `SLOW_REQUEST_SECONDS` are logged with their breakdown.
+    """
+
+    def __init__(self) -> None:
+        self.slow_request_seconds = 0.0
+
+        self.request_duration = Histogram(
+            'http_request_duration_seconds',
+            'Time from the start of a request until its response was sent.',
+            ('method', 'route', 'status'),
+            SECONDS_BUCKETS
+        )
+        self.request_segment = Histogram(
+            'http_request_segment_seconds',
+            'Time a request spent in SQL, outbound calls or compression, summed over concurrent calls.',
+            ('route', 'segment'),
+            SECONDS_BUCKETS
+        )
+        self.request_sql_queries = Histogram(
+            'http_request_sql_queries',
+            'SQL statements executed by a request.',
+            ('route',),
+            COUNT_BUCKETS
+        )
+        self.request_outbound_bytes = Histogram(
+            'http_request_outbound_bytes',
+            'Bytes a request moved to or from the image store.',
+            ('route',),
+            BYTES_BUCKETS
+        )
+        self.outbound_duration = Histogram(
+            'image_store_call_duration_seconds',
+            'Duration of calls from ImageUtil to the image store, from any request or background job.',
+            ('operation',),
+            SECONDS_BUCKETS
+        )
+        self.outbound_bytes = Histogram(
+            'image_store_call_bytes',
+            'Bytes moved by a call from ImageUtil to the image store.',
+            ('operation',),
+            BYTES_BUCKETS
+        )
+        self.sql_duration = Histogram(
+            'sql_query_duration_seconds',
+            'Duration of SQL statements, from any request or background job.',
+            (),
+            SECONDS_BUCKETS
+        )
+        self._histograms = (
+            self.request_duration,
+            self.request_segment,
+            self.request_sql_queries,
+            self.request_outbound_bytes,
+            self.outbound_duration,
+            self.outbound_bytes,
+            self.sql_duration
+        )
+        self._listening = False
+
+    def init_app(self, app: Flask) -> None:
+        app.extensions['metrics'] = self
+        if not app.config['METRICS_ENABLED']:
+            return
+
+        self.slow_request_seconds = app.config['SLOW_REQUEST_SECONDS']
+
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        app.add_url_rule('/metrics', 'metrics', self.expose, methods=['GET'])
+
+        if not self._listening:
+            event.listen(Engine, 'before_cursor_execute', self._start_query)
+            event.listen(Engine, 'after_cursor_execute', self._end_query)
+            self._listening = True
+
+    @contextmanager
+    def outbound(self, operation: str) -> Iterator[dict]:
+        """Time a call to the image store; set `bytes` on the yielded dict."""
+        with segment('outbound') as info:
+            start = time.perf_counter()
+            try:
+                yield info
+            finally:
+                self.outbound_duration.observe(time.perf_counter() - start, operation=operation)
+                self.outbound_bytes.observe(info['bytes'], operation=operation)
+
+    # The start time is kept on the execution context, which is dropped when the statement
+    # fails, so nothing is left behind when `after_cursor_execute` does not fire
+    def _start_query(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if context is not None:
+            context._query_started_at = time.perf_counter()
+
+    def _end_query(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        started_at = getattr(context, '_query_started_at', None)
+        if started_at is None:
+            return
+        elapsed = time.perf_counter() - started_at
+        self.sql_duration.observe(elapsed)
+
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.sql_queries += 1
+            stats.sql_seconds += elapsed
+
+    def _start_request(self) -> None:
+        _request_stats.set(RequestStats())
+
+    def _end_request(self, response: Response) -> Response:
+        stats = _request_stats.get()
+        if stats is None:
+            return response
+
+        method = request.method
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        status = response.status_code
+
+        # Streamed bodies are produced after this hook, so wait for the close
+        response.call_on_close(lambda: self._finish(stats, method, route, status))
+
+        return response
+
+    def _finish(self, stats: RequestStats, method: str, route: str, status: int) -> None:
+        elapsed = time.perf_counter() - stats.started_at
+        _request_stats.set(None)
+
+        self.request_duration.observe(elapsed, method=method, route=route, status=status)
+        self.request_sql_queries.observe(stats.sql_queries, route=route)
+        self.request_segment.observe(stats.sql_seconds, route=route, segment='sql')
+        for name, (_, seconds, _) in stats.segments.items():
+            self.request_segment.observe(seconds, route=route, segment=name)
+        if 'outbound' in stats.segments:
+            self.request_outbound_bytes.observe(stats.segments['outbound'][2], route=route)
+
+        if self.slow_request_seconds and elapsed > self.slow_request_seconds:
+            logger.warning(f"Slow request {method} {route} {status}: {elapsed:.3f}s ({stats.breakdown()})")
+
+    def expose(self) -> Response:
+        lines = [line for histogram in self._histograms for line in histogram.expose()]
+
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,156 @@
+import io
+
+from typing import Iterator
+from flask import Request
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData, Preamble
+
+
+class Part(io.RawIOBase):
+    """A form field or file of a multipart body, read straight from the request."""
+
+    def __init__(self, reader: 'MultipartReader', name: str, filename: str | None, mimetype: str) -> None:
+        self._reader = reader
+        self.name = name
+        self.filename = filename
+        self.mimetype = mimetype
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        return self._reader.readinto(self, b)
+
+    def text(self) -> str:
+        """Return the value of a form field, read up to the request's form memory limit."""
+        limit = self._reader.max_field_size
+        value = bytearray()
+        while chunk := self.read(limit + 1 - len(value)):
+            value += chunk
+            if len(value) > limit:
+                raise RequestEntityTooLarge(f"Form field {self.name!r} is too large")
+
+        return value.decode('utf-8', 'replace')
+
+
+class MultipartReader:
+    """Parses a `multipart/form-data` body while the view reads it.
+
+    Parts are handed out in order, each to be read before the next one, so
+    the body never has to be buffered or spooled as a whole: at most
+    `read_size` bytes of it are read at a time. A part left unread is
+    skipped when the next one is requested. Form fields are read first
+    with `fields`, then the files with `files`.
+    """
+
+    def __init__(
+        self,
+        stream,
+        boundary: bytes,
+        read_size: int = 64 * 1024,
+        max_field_size: int = 500000,
+        max_parts: int | None = 1000
+    ) -> None:
+        self.stream = stream
+        self.read_size = read_size
+        self.max_field_size = max_field_size
+        self._decoder = MultipartDecoder(boundary, max_parts=max_parts)
+        self._eof = False
+        self._current = None
+        self._pending = bytearray()
+        self._more = False
+        self._parts = self._iter_parts()
+        self._next_file = None
+
+    @classmethod
+    def from_request(cls, request: Request, read_size: int) -> 'MultipartReader':
+        if request.mimetype != 'multipart/form-data' or not request.mimetype_params.get('boundary'):
+            raise BadRequest('Expected a multipart/form-data body')
+
+        return cls(
+            request.stream,
+            request.mimetype_params['boundary'].encode('latin-1'),
+            read_size,
+            request.max_form_memory_size or 500000,
+            request.max_form_parts
+        )
+
+    def _next_event(self):
+        while True:
+            try:
+                event = self._decoder.next_event()
+            except ValueError:
+                raise BadRequest('Invalid multipart body')
+            if not isinstance(event, NeedData):
+                return event
+
+            if self._eof:
+                raise BadRequest('Incomplete multipart body')
+
+            chunk = self.stream.read(self.read_size)
+            if chunk:
+                self._decoder.receive_data(chunk)
+            else:
+                self._eof = True
+                self._decoder.receive_data(None)
+
+    def readinto(self, part: Part, b) -> int:
+        if part is not self._current:
+            return 0
+
+        while not self._pending and self._more:
+            event = self._next_event()
+            if not isinstance(event, Data):
+                raise BadRequest('Invalid multipart body')
+
+            self._pending += event.data
+            self._more = event.more_data
+
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        del self._pending[:n]
+
+        return n
+
+    def _iter_parts(self) -> Iterator[Part]:
+        while True:
+            # Skip whatever the previous part left unread
+            self._pending.clear()
+            while self._more:
+                self._more = self._next_event().more_data
+            self._current = None
+
+            event = self._next_event()
+            if isinstance(event, Preamble):
+                continue
+            if isinstance(event, Epilogue):
+                return
+
+            filename = event.filename if isinstance(event, File) else None
+            mimetype = event.headers.get('content-type', 'text/plain' if filename is None else 'application/octet-stream')
+            self._current = Part(self, event.name, filename, mimetype.split(';', 1)[0].strip())
+            self._more = True
+
+            yield self._current
+
+    def fields(self) -> dict[str, str]:
+        """Read the form fields that come before the first file."""
+        fields = {}
+        for part in self._parts:
+            if part.filename is not None:
+                self._next_file = part
+                break
+
+            fields[part.name] = part.text()
+
+        return fields
+
+    def files(self) -> Iterator[Part]:
+        """Yield the file parts, skipping any field that comes after the first file."""
+        if self._next_file is not None:
+            part, self._next_file = self._next_file, None
+            yield part
+
+        for part in self._parts:
+            if part.filename is not None:
+                yield part
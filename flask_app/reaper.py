@@ -0,0 +1,143 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from datetime import datetime, timedelta
+from flask import Flask
+from flask_app.services import release_images
+from storage import export_job_repo, image_repo, project_repo, user_repo, get_db_session
+
+logger = logging.getLogger(__name__)
+
+
+class Reaper:
+    """Removes expired demo users and image store folders nothing refers to.
+
+    Demo users expire `DEMO_TTL` seconds after signing in, or when they sign
+    out. Every `REAPER_INTERVAL` seconds each worker process runs the reaper
+    on a daemon thread. It claims expired users in batches of
+    `REAPER_BATCH_SIZE`, so concurrent workers never reap the same user.
+    Each batch is removed with one statement per table and batched image
+    store deletes. The reaper sleeps `REAPER_PAUSE` seconds between batches
+    to leave the database and the image store to live traffic. It also
+    sweeps the export jobs and uploads, once when it starts and then on
+    every run.
+
+    `flask reap` runs it once, e.g. from cron with the schedule disabled.
+    """
+
+    def __init__(self, img_util, tiles, users, export_jobs, ingest) -> None:
+        self.img_util = img_util
+        self.tiles = tiles
+        self.users = users
+        self.export_jobs = export_jobs
+        self.ingest = ingest
+        self.app = None
+        self.interval = 0.0
+        self.batch_size = 50
+        self.pause = 1.0
+        self.lease = 600.0
+        self.folder = 'FLASK'
+
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        self.interval = app.config['REAPER_INTERVAL']
+        self.batch_size = app.config['REAPER_BATCH_SIZE']
+        self.pause = app.config['REAPER_PAUSE']
+        self.lease = app.config['REAPER_LEASE']
+
+        app.cli.command('reap')(self.reap_command)
+        if self.interval:
+            app.before_request(self._ensure_started)
+
+    def _ensure_started(self) -> None:
+        # Threads do not survive a fork, each worker starts its own on its first request
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._loop, name='reaper', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _loop(self) -> None:
+        # Work left behind by a previous worker is cleaned up right away
+        run = self.sweep
+        while True:
+            with self.app.app_context():
+                try:
+                    run()
+                except Exception:
+                    logger.exception('Reaper run failed')
+                    get_db_session().rollback()
+
+            # Jittered, so the workers of a server do not run in step
+            time.sleep(self.interval * random.uniform(0.5, 1.5))
+            run = self.run
+
+    def reap_command(self) -> None:
+        """Remove expired demo users, unused image store folders, stale export jobs and uploads."""
+        reaped_users, reaped_folders = self.run()
+        print(f"Reaped {reaped_users} users and {reaped_folders} folders")
+
+    def sweep(self) -> None:
+        self.export_jobs.sweep()
+        self.ingest.sweep()
+
+    def run(self) -> tuple[int, int]:
+        self.sweep()
+        reaped_users = self.reap_users()
+        reaped_folders = self.reap_folders()
+        if reaped_users or reaped_folders:
+            logger.info(f"Reaped {reaped_users} users and {reaped_folders} folders")
+
+        return reaped_users, reaped_folders
+
+    def reap_users(self) -> int:
+        reaped = 0
+        while True:
+            now = datetime.now()
+            # The microseconds tell the leases of concurrent reapers apart
+            lease_until = now + timedelta(seconds=self.lease, microseconds=random.randrange(1, 1000000))
+            ids = user_repo.claim_expired(now, lease_until, self.batch_size)
+            get_db_session().commit()
+            if not ids:
+                return reaped
+
+            self._remove_users(ids)
+            reaped += len(ids)
+            time.sleep(self.pause)
+
+    def _remove_users(self, ids: list[str]) -> None:
+        unused = release_images(project_ids=project_repo.get_ids(ids))
+        if unused:
+            self.img_util.delete_many(unused)
+
+        job_ids = export_job_repo.get_ids(ids)
+        user_repo.remove_many(ids)
+        get_db_session().commit()
+
+        self.export_jobs.discard(job_ids)
+        self.tiles.discard(unused)
+        for id in ids:
+            self.users.invalidate(id)
+
+    def reap_folders(self) -> int:
+        """Delete the project folders of the image store that no project, image or asset uses."""
+        reaped = 0
+        for folder in self.img_util.list_folders(self.folder):
+            project_name = folder[len(self.folder) + 1:]
+            if project_repo.get(project_name) or image_repo.folder_in_use(folder):
+                continue
+
+            self.img_util.delete_all(folder)
+            reaped += 1
+            if reaped % self.batch_size == 0:
+                time.sleep(self.pause)
+
+        return reaped
@@ -1,9 +1,10 @@
 from functools import wraps
 from typing import Callable, Any
-from werkzeug.exceptions import NotFound, Unauthorized
-from flask import g
+from werkzeug.exceptions import BadRequest, NotFound, Unauthorized
+from flask import g, request, Response
+from flask_app.export import EXPORT_FORMATS
 from src.model import Project
-from storage import project_repo
+from storage import asset_repo, image_repo, project_repo
 
 
 def require_login(f: Callable[..., Any]) -> Callable[..., Any]:
@@ -23,3 +24,33 @@ def fetch_project(id: str) -> Project:
         raise NotFound('Invalid project id')
 
     return project
+
+
+def not_modified(etag: str, weak: bool = False) -> Response | None:
+    """Return a 304 response if the client already holds `etag`, else None."""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+
+    response = Response(status=304)
+    response.set_etag(etag, weak)
+
+    return response
+
+
+def release_images(ids: list[str] | None = None, project_ids: list[str] | None = None) -> list[str]:
+    """Drop the references of the selected images to their stored files.
+
+    Returns the URLs no image uses anymore, to delete from the image store
+    before committing the removal of the images.
+    """
+    asset_ids, urls = image_repo.get_storage_refs(ids, project_ids)
+
+    return urls + asset_repo.release(asset_ids)
+
+
+def export_options() -> tuple[str, bool]:
+    format = request.args.get('format', 'coco').lower()
+    if format not in EXPORT_FORMATS:
+        raise BadRequest(f"Unknown export format, expected one of {', '.join(EXPORT_FORMATS)}")
+
+    return format, request.args.get('compact', 'false').lower() == 'true'
@@ -39,37 +39,55 @@ export function AnnotationBoard({ projectId, setError, setLoading, setSaving })
   const [projectToBeDeleted, setProjectToBeDeleted] = useState(null);
 
   useEffect(() => {
+    let cancelled = false;
+
+    const fetchJson = async (url) => {
+      const res = await fetch(url);
+
+      if (!res.ok) {
+        let error = new Error('Failed to fetch project');
+
+        if (res.status === 401) {
+          window.location.href = '/signin';
+        }
+        else if (res.status === 404 || res.status === 400) {
+          const data = await res.json();
+          error = new Error(`${data.message}`);
+        }
+
+        throw error;
+      }
+
+      return await res.json();
+    };
+
+    // The summary comes first, then images one page at a time, so the
+    // first image can be shown before the whole project is loaded
     const fetchProject = async (pId) => {
       setLoading(true);
 
       try {
-        let data;
-        const res = await fetch(`/projects/${pId}`);
-
-        if (!res.ok) {
-          let error = new Error('Failed to fetch project');
-
-          if (res.status === 401) {
-            window.location.href = '/signin';
-          }
-          else if (res.status === 404 || res.status === 400) {
-            const data = await res.json();
-            error = new Error(`${data.message}`);
-          }
+        const summary = await fetchJson(`/projects/${pId}/summary`);
+        if (cancelled) return;
+
+        const proj = summary.data;
+        setProject({
+          id: proj.id,
+          name: proj.name,
+          categories: proj.categories
+        });
 
-            throw error;
-        } else {
-          data = await res.json();
+        let cursor = null;
+        do {
+          const query = cursor ? `?cursor=${cursor}` : '';
+          const page = await fetchJson(`/projects/${pId}/images${query}`);
+          if (cancelled) return;
 
-          const proj = data.data;
-          setProject({
-            id: proj.id,
-            name: proj.name,
-            categories: proj.categories
-          });
+          setImages(prev => cursor ? [...prev, ...page.data] : page.data);
+          setLoading(false);
 
-          setImages(proj.images);
-        }
+          cursor = page.next_cursor;
+        } while (cursor);
       } catch (err) {
         setError(err.message);
         setTimeout(() => setError(''), 3000);
@@ -81,6 +99,8 @@ export function AnnotationBoard({ projectId, setError, setLoading, setSaving })
     if (projectId) {
       fetchProject(projectId);
     }
+
+    return () => { cancelled = true; };
   }, [projectId]);
 
   useEffect(() => {
@@ -89,13 +109,41 @@ export function AnnotationBoard({ projectId, setError, setLoading, setSaving })
     const imageAnnotations = {};
 
     images.forEach(img => {
-      imageAnnotations[img.id] = img.annotations;
+      imageAnnotations[img.id] = annotations?.[img.id] ?? img.annotations;
     });
 
     if (!image) setImage(images[0]);
     setAnnotations(imageAnnotations);
   }, [images]);
 
+  useEffect(() => {
+    if (!images || !projectId) return;
+
+    const pendingIds = images.filter(img => img.status === 'pending').map(img => img.id);
+    if (!pendingIds.length) return;
+
+    // Uploads are stored in the background, poll them until they are done
+    const timer = setInterval(async () => {
+      try {
+        const res = await fetch(`/projects/${projectId}/images/status?ids=${pendingIds.join(',')}`);
+        if (!res.ok) return;
+
+        const updates = {};
+        (await res.json()).data.forEach(img => {
+          if (img.status !== 'pending') updates[img.id] = img;
+        });
+
+        if (!Object.keys(updates).length) return;
+
+        const merge = img => updates[img.id] ? {...img, ...updates[img.id]} : img;
+        setImages(prev => prev.map(merge));
+        setImage(prev => prev && merge(prev));
+      } catch (err) {}
+    }, 2000);
+
+    return () => clearInterval(timer);
+  }, [images, projectId]);
+
   const handleClear = (e) => {
     if (image) {
       setAnnotations({...annotations, [image.id]: []});
@@ -236,7 +284,7 @@ export function AnnotationBoard({ projectId, setError, setLoading, setSaving })
           setSaving('Exporting project...')
 
           try {
-            const res = await fetch(`/export/${projectId}`);
+            const res = await fetch(`/export/${projectId}?format=${option.format}`, { method: 'POST' });
 
             if (!res.ok) {
               let error = new Error('Failed to export projects');
@@ -249,17 +297,36 @@ export function AnnotationBoard({ projectId, setError, setLoading, setSaving })
               }
 
                 throw error;
-            } else {
-              const blob = await res.blob()
-              const url = window.URL.createObjectURL(blob);
+            }
+
+            const jobId = (await res.json()).data.id;
+
+            // Poll the export job until its archive is ready
+            let job;
+            while (true) {
+              await new Promise(resolve => setTimeout(resolve, 1000));
 
-              const a = document.createElement('a');
-              a.href = url;
-              a.download = `${project.name.toLowerCase()}_annotations.zip`;
-              a.click();
+              const statusRes = await fetch(`/export/jobs/${jobId}`);
+              if (!statusRes.ok) {
+                throw new Error('Failed to export projects');
+              }
+
+              job = (await statusRes.json()).data;
+              if (job.status === 'failed') {
+                throw new Error('Failed to export projects');
+              }
 
-              window.URL.revokeObjectURL(url);
+              if (job.status === 'done') {
+                break;
+              }
+
+              setSaving(`Exporting project... ${job.images_fetched}/${job.images_total}`);
             }
+
+            const a = document.createElement('a');
+            a.href = `/export/jobs/${jobId}/download`;
+            a.download = job.filename;
+            a.click();
           } catch (err) {
             setError(err.message);
             setTimeout(() => setError(''), 3000);
@@ -476,7 +543,9 @@ export function AnnotationBoard({ projectId, setError, setLoading, setSaving })
                   {id: 'New', value: {id: 'new'}},
                   {id: 'Open', value: {id: 'open'}},
                   {id: 'Add Images', value: {id: 'images'}},
-                  {id: 'Export', value: {id: 'export'}}
+                  {id: 'Export COCO', value: {id: 'export', format: 'coco'}},
+                  {id: 'Export YOLO', value: {id: 'export', format: 'yolo'}},
+                  {id: 'Export Pascal VOC', value: {id: 'export', format: 'voc'}}
                 ]}
                 popupPos=${projectPopupPos}
                 onSelect=${handleProjectOptionSelect}
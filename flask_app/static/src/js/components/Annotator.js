@@ -27,7 +27,7 @@ export function Annotator({
 
   const [scale, setScale] = useState(null);
 
-  const imageRef = useRef(null);
+  const tileCanvasRef = useRef(null);
   const canvasRef = useRef(null);
 
   const [labels, setLabels] = useState([]);
@@ -53,6 +53,83 @@ export function Annotator({
     drawAnnotations(scaleX, scaleY);
   }, [image]);
 
+  // Show the thumbnail at once, then the tiles of the level that fits the canvas as they arrive
+  useEffect(() => {
+    const canvas = tileCanvasRef.current;
+
+    if (!image || !canvas) return;
+
+    const ctx = canvas.getContext('2d');
+    let cancelled = false;
+
+    ctx.clearRect(0, 0, containerWidth, containerHeight);
+
+    const loadImage = (src) => new Promise((resolve, reject) => {
+      const img = new Image();
+      img.onload = () => resolve(img);
+      img.onerror = reject;
+      img.src = src;
+    });
+
+    const loadTiles = async () => {
+      const ratio = window.devicePixelRatio || 1;
+      const res = await fetch(
+        `/images/${image.id}/tiles?width=${Math.ceil(containerWidth * ratio)}&height=${Math.ceil(containerHeight * ratio)}`
+      );
+
+      if (!res.ok) {
+        const original = await loadImage(image.url);
+        if (!cancelled) {
+          ctx.drawImage(original, 0, 0, containerWidth, containerHeight);
+        }
+
+        return;
+      }
+
+      const info = (await res.json()).data;
+      const thumbnail = await loadImage(info.thumbnail);
+      if (cancelled) return;
+
+      ctx.drawImage(thumbnail, 0, 0, containerWidth, containerHeight);
+
+      const [levelWidth, levelHeight] = info.levels[info.level];
+      const tileScaleX = containerWidth / levelWidth;
+      const tileScaleY = containerHeight / levelHeight;
+      const tiles = [];
+
+      for (let y = 0; y * info.tile_size < levelHeight; y++) {
+        for (let x = 0; x * info.tile_size < levelWidth; x++) {
+          const url = info.tiles
+            .replace('{level}', info.level)
+            .replace('{x}', x)
+            .replace('{y}', y);
+
+          tiles.push(loadImage(url).then(tile => {
+            if (cancelled) return;
+
+            const left = Math.floor(x * info.tile_size * tileScaleX);
+            const top = Math.floor(y * info.tile_size * tileScaleY);
+            ctx.drawImage(
+              tile,
+              left,
+              top,
+              Math.ceil((x * info.tile_size + tile.width) * tileScaleX) - left,
+              Math.ceil((y * info.tile_size + tile.height) * tileScaleY) - top
+            );
+          }));
+        }
+      }
+
+      await Promise.allSettled(tiles);
+    };
+
+    loadTiles().catch(err => console.error(err));
+
+    return () => {
+      cancelled = true;
+    };
+  }, [image]);
+
   useEffect(() => {
     if (!annotations || !scale || !image) return;
 
@@ -249,10 +326,9 @@ export function Annotator({
   };
 
   useEffect(() => {
-    const img = imageRef.current;
     const canvas = canvasRef.current;
 
-    if (!img || !canvas) return;
+    if (!canvas) return;
 
     canvas.addEventListener('mousedown', handleMouseDown);
     canvas.addEventListener('mousemove', handleMouseMove);
@@ -270,11 +346,12 @@ export function Annotator({
       ? html`<p class="py-16 px-32 h2-c font-semibold">add an image for annotation</p>`
       : html`
           <div class="relative" style="width: ${containerWidth}px; height: ${containerHeight}px;">
-            <img
-              src=${image.url}
-              ref=${imageRef}
-              alt="annotatable"
-              class="absolute top-0 left-0 w-full h-full object-contain z-10"
+            <canvas
+              ref=${tileCanvasRef}
+              width=${containerWidth}
+              height=${containerHeight}
+              aria-label="annotatable"
+              class="absolute top-0 left-0 z-10"
             />
 
             <canvas
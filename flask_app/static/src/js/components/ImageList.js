@@ -26,7 +26,11 @@ export function ImageList({
   useEffect(() => {
     if (!image || !images) return;
 
-    setImgs(images.map(img => ({id: img.id, value: img.filename})));
+    setImgs(images.map(img => ({
+      id: img.id,
+      value: img.filename,
+      thumbnail: img.status === 'ready' ? `/images/${img.id}/thumbnail` : null
+    })));
   }, [image, images]);
 
   const handleSelectImage = (img, e) => {
@@ -13,12 +13,15 @@ export function Menu({ title, items = [], onSelect, onContextMenu, getItemClass}
             <li>
               <button
                 key=${item.id}
-                class="text-sm px-3 py-1 truncate hover:bg-blue-100 w-full text-left text-c ${getItemClass ? getItemClass(item) : ''}"
+                class="text-sm px-3 py-1 truncate hover:bg-blue-100 w-full text-left text-c flex items-center gap-2 ${getItemClass ? getItemClass(item) : ''}"
                 onClick=${onSelect ? (e) => onSelect(item, e) : undefined}
                 onContextMenu=${onContextMenu ? (e) => onContextMenu(item, e) : undefined}
                 title=${item.value}
               >
-                ${item.value}
+                ${item.thumbnail &&
+                  html`<img src=${item.thumbnail} alt="" loading="lazy" class="w-8 h-8 object-cover flex-none" />`
+                }
+                <span class="truncate">${item.value}</span>
               </button>
             </li>
           `
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import logging
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from flask import Flask, send_from_directory
+from flask.typing import ResponseReturnValue
+from PIL import Image as PILImage
+from werkzeug.exceptions import NotFound
+
+logger = logging.getLogger(__name__)
+
+
+def build_pyramid(source: str, target: str, tile_size: int, thumbnail_size: int, quality: int) -> dict:
+    """Write the thumbnail and tile pyramid of the image at `source` into `target`.
+
+    Level 0 fits in a single tile and every level doubles the previous one,
+    up to the full resolution. Tiles are `<level>/<column>_<row>.jpg`. The
+    pyramid is built in a scratch directory and renamed into place, so a
+    `target` that exists is complete. Runs in the process pool.
+    """
+    with PILImage.open(source) as image:
+        image = image.convert('RGB')
+
+    width, height = image.size
+    levels = max(0, math.ceil(math.log2(max(width, height) / tile_size))) + 1
+
+    scratch = f"{target}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(scratch)
+    try:
+        thumbnail = image.copy()
+        thumbnail.thumbnail((thumbnail_size, thumbnail_size))
+        thumbnail.save(os.path.join(scratch, 'thumbnail.jpg'), quality=quality)
+
+        # Walk down from the full resolution, halving the previous level each time
+        sizes = []
+        level_image = image
+        for level in reversed(range(levels)):
+            level_width, level_height = level_image.size
+            sizes.append([level_width, level_height])
+
+            level_dir = os.path.join(scratch, str(level))
+            os.mkdir(level_dir)
+            for top in range(0, level_height, tile_size):
+                for left in range(0, level_width, tile_size):
+                    box = (left, top, min(left + tile_size, level_width), min(top + tile_size, level_height))
+                    tile_path = os.path.join(level_dir, f"{left // tile_size}_{top // tile_size}.jpg")
+                    level_image.crop(box).save(tile_path, quality=quality)
+
+            if level:
+                level_image = level_image.reduce(2)
+
+        info = {'width': width, 'height': height, 'tile_size': tile_size, 'levels': sizes[::-1]}
+        with open(os.path.join(scratch, 'info.json'), 'w') as f:
+            json.dump(info, f)
+
+        try:
+            os.rename(scratch, target)
+        except OSError:
+            # Built concurrently by another worker, keep theirs
+            shutil.rmtree(scratch, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(scratch, ignore_errors=True)
+        raise
+
+    return info
+
+
+class TileService:
+    """Thumbnails and tile pyramids of stored images, cached on local disk.
+
+    The ingest pipeline builds them from its spooled copy before an image is
+    marked `ready`. Images stored otherwise, or whose pyramid was removed,
+    get theirs on first use from a download of the original. Pyramids are
+    keyed by the SHA-256 of the image URL, so images sharing an asset share
+    one, and they are built on a per-worker process pool since decoding and
+    resizing large originals is CPU bound.
+    """
+
+    def __init__(self, img_util) -> None:
+        self.img_util = img_util
+        self.root = None
+        self.tile_size = 256
+        self.thumbnail_size = 256
+        self.quality = 85
+        self.workers = 2
+
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._building = {}
+
+    def init_app(self, app: Flask) -> None:
+        self.root = Path(app.config['TILE_DIR']).resolve()
+        self.tile_size = app.config['TILE_SIZE']
+        self.thumbnail_size = app.config['THUMBNAIL_SIZE']
+        self.quality = app.config['TILE_QUALITY']
+        self.workers = app.config['TILE_WORKERS']
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # A forked worker cannot use its parent's pool
+        if self._pid != os.getpid():
+            # Forking copies the locks held by the threads serving requests,
+            # so the pool processes are started fresh
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            self._building = {}
+            self._pid = os.getpid()
+
+        return self._executor
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def info(self, url: str) -> dict | None:
+        try:
+            with open(self.path(self.key(url)) / 'info.json') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def build(self, url: str, source: str | Path) -> dict:
+        """Build the pyramid of `url` from a local copy of its file, unless it exists."""
+        info = self.info(url)
+        if info is not None:
+            return info
+
+        key = self.key(url)
+        with self._lock:
+            future = self._building.get(key)
+            if future is None:
+                self.path(key).parent.mkdir(exist_ok=True)
+                future = self.executor.submit(
+                    build_pyramid,
+                    str(source),
+                    str(self.path(key)),
+                    self.tile_size,
+                    self.thumbnail_size,
+                    self.quality
+                )
+                self._building[key] = future
+                future.add_done_callback(lambda _: self._building.pop(key, None))
+
+        return future.result()
+
+    def ensure(self, url: str) -> dict:
+        """Return the pyramid info of `url`, downloading the original to build it if needed."""
+        info = self.info(url)
+        if info is not None:
+            return info
+
+        [content] = self.img_util.fetch_images([url])
+        fd, source = tempfile.mkstemp(dir=self.root, prefix='.source-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+
+            return self.build(url, source)
+        finally:
+            os.unlink(source)
+
+    def discard(self, urls: list[str]) -> None:
+        for url in urls:
+            shutil.rmtree(self.path(self.key(url)), ignore_errors=True)
+
+    def level_for(self, info: dict, width: int, height: int) -> int:
+        """Return the smallest level that covers a `width` x `height` viewport."""
+        for level, (level_width, level_height) in enumerate(info['levels']):
+            if level_width >= width and level_height >= height:
+                return level
+
+        return len(info['levels']) - 1
+
+    def send(self, key: str, name: str) -> ResponseReturnValue:
+        if len(key) != 64 or not all(c in '0123456789abcdef' for c in key):
+            raise NotFound('Tile not found')
+
+        # Keys change with the file, so the content under one never does
+        return send_from_directory(self.path(key), name, max_age=31536000)
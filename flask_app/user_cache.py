@@ -0,0 +1,50 @@
+import threading
+import time
+
+from collections import OrderedDict
+from flask import Flask
+from src.model import User
+from storage import user_repo
+
+
+class UserCache:
+    """Per-worker TTL cache of signed-in users, keyed by user id.
+
+    Entries hold the id and username only, never the password hash. Each
+    worker process has its own cache, so a user deleted by another worker
+    can be served from here for up to `USER_CACHE_TTL` seconds; the worker
+    that deletes or signs out a user invalidates its entry right away.
+    """
+
+    def __init__(self) -> None:
+        self.ttl = 60.0
+        self.max_size = 10000
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask) -> None:
+        self.ttl = app.config['USER_CACHE_TTL']
+        self.max_size = app.config['USER_CACHE_SIZE']
+
+    def get(self, user_id: str) -> User | None:
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+
+        user = user_repo.get_identity(user_id)
+        if user is None:
+            self.invalidate(user_id)
+            return None
+
+        with self._lock:
+            self._users[user_id] = (user, time.monotonic() + self.ttl)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+
+        return user
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._users.pop(user_id, None)
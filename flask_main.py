@@ -4,29 +4,30 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import json
-import requests
-import zipfile
+import hashlib
 
-from io import BytesIO
-from utils import ImageUtil, generate_unique_name
+from itertools import chain
 from werkzeug.exceptions import BadRequest, NotFound, InternalServerError
-from flask_app import create_app
-from flask_app.services import require_login, fetch_project
+from flask_app import create_app, img_util, export_jobs, ingest, tiles, users
+from flask_app.services import require_login, fetch_project, not_modified, export_options, release_images
+from flask_app.export import stream_export_archive, async_stream_export_archive
+from flask_app.asgi import serving_async, Prepended
+from flask_app.multipart import MultipartReader
 from json import JSONDecodeError
 from flask.typing import ResponseReturnValue
-from flask import render_template, request, jsonify, session, g, redirect, url_for, send_file
-from src.model import Image, Project, Annotation, Category
+from flask import render_template, request, jsonify, session, g, redirect, url_for, current_app, Response, send_file
+from src.model import Image, Project, Annotation, Category, ExportJob
+from datetime import datetime
 from storage import (
-    user_repo,
     project_repo,
     annotation_repo,
     image_repo,
     category_repo,
+    export_job_repo,
     get_db_session
 )
 
 app = create_app(os.getenv('CONFIG', 'default'))
-img_util = ImageUtil()
 
 
 @app.before_request
@@ -35,7 +36,7 @@ def load_logged_in_user():
     if user_id is None:
         g.user = None
     else:
-        g.user = user_repo.get_by_id(user_id)
+        g.user = users.get(user_id)
 
 
 @app.route('/', methods=['GET'])
@@ -67,53 +68,39 @@ def fetch_project_id(id: str) -> ResponseReturnValue:
 @app.route('/projects', methods=['POST'])
 @require_login
 def create_project() -> ResponseReturnValue:
+    # The body is parsed as it arrives, the name and classes come before the images
+    reader = MultipartReader.from_request(request, current_app.config['UPLOAD_READ_SIZE'])
     try:
-        project_name = request.form['name'].upper()
+        form = reader.fields()
+        project_name = form['name'].upper()
         project = project_repo.get(project_name)
         if project:
             raise BadRequest('Project name already exist')
 
-        project = Project(name=project_name)
-        project_id = project_repo.add(project, g.user.id)
-
         ## Handle Categories (classes)
         # Make category names unique
         categories = {
             k.lower(): v
-            for k, v in json.loads(request.form['classes']).items()
+            for k, v in json.loads(form['classes']).items()
         }
+    except (KeyError, JSONDecodeError):
+        raise BadRequest('Invalid form input')
 
-        for name, color in categories.items():
-            category = Category(name=name, color=color)
-            _ = category_repo.add(category, project_id)
-
-        # Upload Images
-        image_names = []
-        files = []
-
-        for img in request.files.values():
-            image_name = generate_unique_name(image_names, 'image')
-            img.filename = image_name
-            image_names.append(image_name)
-            files.append((
-                img.filename,
-                img.stream,
-                img.mimetype
-            ))
+    project = Project(name=project_name)
+    project_id = project_repo.add(project, g.user.id)
 
-        try:
-            img_util.delete_allf"FLASK/{project_name}")
-            uploaded_imgs = img_util.upload_images(files, f"FLASK/{project_name}")
-        except Exception:
-            raise InternalServerError('Network Error')
+    for name, color in categories.items():
+        category = Category(name=name, color=color)
+        _ = category_repo.add(category, project_id)
 
-        for uploaded_img in uploaded_imgs:
-            image = Image(**uploaded_img)
-            _ = image_repo.add(image, project_id)
+    get_db_session().commit()
 
+    # Spool each upload as it is received, the ingest pipeline stores new content meanwhile
+    images = ingest.receive(reader.files(), project_id, f"FLASK/{project_name}", [])
+    # Images that reused stored content are ready already
+    if images:
+        project_repo.bump_revision(project_id)
         get_db_session().commit()
-    except (KeyError, JSONDecodeError):
-        raise BadRequest('Invalid form input')
 
     project = project_repo.get_by_id(project_id)
 
@@ -126,35 +113,87 @@ def create_project() -> ResponseReturnValue:
 @app.route('/projects/<string:id>', methods=['GET'])
 @require_login
 def read_project(id: str) -> ResponseReturnValue:
+    revision = project_repo.get_revision(id)
+    if revision is None:
+        raise NotFound('Project not found')
+
+    etag = f"{id}-{revision}"
+    response = not_modified(etag)
+    if response:
+        return response
+
     project = project_repo.get_with_relationships(id)
     if not project:
         raise NotFound('Project not found')
 
-    return jsonify({
+    response = jsonify({
         'status': 'success',
         'data': project.to_dict()
-    }), 200
+    })
+    response.set_etag(etag)
+
+    return response, 200
+
+
+@app.route('/projects/<string:id>/summary', methods=['GET'])
+@require_login
+def read_project_summary(id: str) -> ResponseReturnValue:
+    revision = project_repo.get_revision(id)
+    if revision is None:
+        raise NotFound('Project not found')
+
+    etag = f"{id}-{revision}"
+    response = not_modified(etag)
+    if response:
+        return response
+
+    summary = project_repo.get_summary(id)
+    if not summary:
+        raise NotFound('Project not found')
+
+    response = jsonify({
+        'status': 'success',
+        'data': summary
+    })
+    response.set_etag(etag)
+
+    return response, 200
 
 
 @app.route('/projects', methods=['GET'])
 @require_login
 def read_projects() -> ResponseReturnValue:
+    # Any project added, removed or changed changes the list's revisions
+    revisions = ','.join(f"{id}:{revision}" for id, revision in project_repo.list_revisions(g.user.id))
+    etag = hashlib.sha256(revisions.encode('utf-8')).hexdigest()[:32]
+    response = not_modified(etag)
+    if response:
+        return response
+
     projects = [project.to_dict() for project in project_repo.list(g.user.id)]
 
-    return jsonify({
+    response = jsonify({
         'status': 'success',
         'data': projects
-    }), 200
+    })
+    response.set_etag(etag)
+
+    return response, 200
 
 
 @app.route('/projects/<string:id>', methods=['DELETE'])
 @require_login
 def delete_project(id: str) -> ResponseReturnValue:
     project = fetch_project(id)
-    try:
-        img_util.delete_all(f"FLASK/{project.name}")
-    except Exception:
-        raise InternalServerError('Network Error')
+
+    # Files shared with images of other projects stay in the store
+    unused = release_images(project_ids=[project.id])
+    if unused:
+        try:
+            img_util.delete_many(unused)
+        except Exception:
+            raise InternalServerError('Network Error')
+        tiles.discard(unused)
 
     project_repo.remove(project.id)
     get_db_session().commit()
@@ -174,25 +213,28 @@ def create_annotation(p_id: str, id: str) -> ResponseReturnValue:
     if not image:
         raise NotFound('Image not found')
 
-    image_repo.remove_image_annotations(image.id)
-
     ## Handle Annotations
     try:
+        items = []
+        categories = {}
         for a in annotations:
-            annotation = Annotation(a['x'], a['y'], a['width'], a['height'])
+            annotation = Annotation(a['x'], a['y'], a['width'], a['height'], id=a.get('id'))
             category_name = a['category']['name'].lower()
-            category = category_repo.get(category_name)
-            if category:
-                category_id = category.id
-            else:
-                category = Category(category_name, a['category']['color'])
-                category_id = category_repo.add(category, p_id)
-
-            _ = annotation_repo.add(annotation, image.id, category_id)
-        get_db_session().commit()
-    except KeyError:
+            if category_name not in categories:
+                categories[category_name] = Category(category_name, a['category']['color'])
+
+            items.append((annotation, category_name))
+    except (KeyError, TypeError):
         raise BadRequest('Invalid input')
 
+    categories = category_repo.get_or_add_many(list(categories.values()), p_id)
+    for annotation, category_name in items:
+        annotation.category = categories[category_name]
+
+    annotation_repo.sync(image.id, [annotation for annotation, _ in items])
+    project_repo.bump_revision(p_id)
+    get_db_session().commit()
+
     return jsonify({'status': 'success', 'data': {}}), 200
 
 
@@ -201,42 +243,109 @@ def create_annotation(p_id: str, id: str) -> ResponseReturnValue:
 def add_project_images(id: str) -> ResponseReturnValue:
     project = fetch_project(id)
 
-    # Upload Images
-    images = []
-    files = []
-    image_names = project_repo.get_project_image_names(project.id)
-
-    for img in request.files.values():
-        image_name = generate_unique_name(image_names, 'image')
-        img.filename = image_name
-        image_names.append(image_name)
-        files.append((
-            img.filename,
-            img.stream,
-            img.mimetype
-        ))
-
-    try:
-        uploaded_imgs = img_util.upload_images(files, f"FLASK/{project.name}")
-    except Exception:
-        raise InternalServerError('Network Error')
+    # Spool each upload as it is received, the ingest pipeline stores new content meanwhile
+    reader = MultipartReader.from_request(request, current_app.config['UPLOAD_READ_SIZE'])
+    images = ingest.receive(
+        reader.files(),
+        project.id,
+        f"FLASK/{project.name}",
+        project_repo.get_project_image_names(project.id)
+    )
 
-    for uploaded_img in uploaded_imgs:
-        image = Image(**uploaded_img)
-        _ = image_repo.add(image, project.id)
+    project_repo.bump_revision(project.id)
+    get_db_session().commit()
 
+    data = []
+    for image in images:
         img = image.to_dict()
         img['annotations'] = []
-        images.append(img)
-
-    get_db_session().commit()
+        data.append(img)
 
     return jsonify({
         'status': 'success',
-        'data': images
+        'data': data
     }), 201
 
 
+@app.route('/projects/<string:id>/images', methods=['GET'])
+@require_login
+def read_project_images(id: str) -> ResponseReturnValue:
+    project = fetch_project(id)
+    cursor = request.args.get('cursor') or None
+    try:
+        limit = int(request.args.get('limit', current_app.config['IMAGES_PAGE_SIZE']))
+    except ValueError:
+        raise BadRequest('limit must be an integer')
+
+    if not 0 < limit <= current_app.config['IMAGES_PAGE_MAX']:
+        raise BadRequest(f"limit must be between 1 and {current_app.config['IMAGES_PAGE_MAX']}")
+
+    # One extra row tells whether there is a next page
+    images = image_repo.page(project.id, cursor, limit + 1)
+    next_cursor = images[limit - 1].id if len(images) > limit else None
+
+    return jsonify({
+        'status': 'success',
+        'data': [image.to_dict() for image in images[:limit]],
+        'next_cursor': next_cursor
+    }), 200
+
+
+@app.route('/projects/<string:id>/images/status', methods=['GET'])
+@require_login
+def read_project_images_status(id: str) -> ResponseReturnValue:
+    project = fetch_project(id)
+    ids = request.args.get('ids')
+    ids = ids.split(',') if ids else None
+
+    return jsonify({
+        'status': 'success',
+        'data': [image.to_dict() for image in image_repo.list(project.id, ids)]
+    }), 200
+
+
+@app.route('/projects/<string:id>/images', methods=['DELETE'])
+@require_login
+def delete_project_images(id: str) -> ResponseReturnValue:
+    project = fetch_project(id)
+    body = request.get_json()
+    ids = body.get('ids') if isinstance(body, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(image_id, str) for image_id in ids):
+        raise BadRequest('Invalid input')
+
+    # Ids of images that are not in the project are reported as not found
+    results = dict.fromkeys(ids, 'not_found')
+    ids = list(results)
+    batch_size = current_app.config['IMAGE_DELETE_BATCH_SIZE']
+
+    # A batch is committed once its files are deleted, a failing store only keeps that batch
+    for i in range(0, len(ids), batch_size):
+        batch = image_repo.get_ids(project.id, ids[i:i + batch_size])
+        if not batch:
+            continue
+
+        unused = release_images(ids=batch)
+        if unused:
+            try:
+                img_util.delete_many(unused)
+            except Exception:
+                get_db_session().rollback()
+                results.update(dict.fromkeys(batch, 'failed'))
+                continue
+
+        image_repo.remove_many(batch)
+        project_repo.bump_revision(project.id)
+        get_db_session().commit()
+
+        tiles.discard(unused)
+        results.update(dict.fromkeys(batch, 'deleted'))
+
+    return jsonify({
+        'status': 'success',
+        'data': [{'id': image_id, 'status': status} for image_id, status in results.items()]
+    }), 200
+
+
 @app.route('/images/<string:id>', methods=['DELETE'])
 @require_login
 def delete_image(id: str) -> ResponseReturnValue:
@@ -244,20 +353,95 @@ def delete_image(id: str) -> ResponseReturnValue:
     if not image:
         raise NotFound('Image not found')
 
-    try:
-        img_util.delete_image(image)
-    except Exception:
-        raise InternalServerError('Network Error')
+    # Pending or failed uploads, and files other images share, are not deleted
+    unused = release_images(ids=[image.id])
+    if unused:
+        try:
+            img_util.delete_many(unused)
+        except Exception:
+            raise InternalServerError('Network Error')
+        tiles.discard(unused)
 
+    project_repo.bump_revision(image_repo.get_project_id(image.id))
     image_repo.remove(image.id)
     get_db_session().commit()
 
     return jsonify({'status': 'success', 'data': {}}), 200
 
 
+@app.route('/images/<string:id>/thumbnail', methods=['GET'])
+@require_login
+def read_image_thumbnail(id: str) -> ResponseReturnValue:
+    image = image_repo.get_by_id(id)
+    if not image or image.status != 'ready':
+        raise NotFound('Image not found')
+
+    try:
+        tiles.ensure(image.url)
+    except Exception:
+        raise InternalServerError('Network Error')
+
+    return tiles.send(tiles.key(image.url), 'thumbnail.jpg')
+
+
+@app.route('/images/<string:id>/tiles', methods=['GET'])
+@require_login
+def read_image_tiles(id: str) -> ResponseReturnValue:
+    image = image_repo.get_by_id(id)
+    if not image or image.status != 'ready':
+        raise NotFound('Image not found')
+
+    try:
+        width = int(request.args.get('width', 0))
+        height = int(request.args.get('height', 0))
+    except ValueError:
+        raise BadRequest('width and height must be integers')
+
+    try:
+        info = tiles.ensure(image.url)
+    except Exception:
+        raise InternalServerError('Network Error')
+
+    key = tiles.key(image.url)
+
+    return jsonify({
+        'status': 'success',
+        'data': {
+            **info,
+            'level': tiles.level_for(info, width, height),
+            'thumbnail': f"/tiles/{key}/thumbnail.jpg",
+            'tiles': f"/tiles/{key}/{{level}}/{{x}}_{{y}}.jpg"
+        }
+    }), 200
+
+
+@app.route('/tiles/<string:key>/<path:name>', methods=['GET'])
+@require_login
+def read_tile(key: str, name: str) -> ResponseReturnValue:
+    return tiles.send(key, name)
+
+
+@app.route('/media/<path:path>', methods=['GET'])
+def read_media(path: str) -> ResponseReturnValue:
+    return img_util.store.send(path)
+
+
 @app.route('/export/<string:id>', methods=['GET'])
 @require_login
 def export_project(id: str) -> ResponseReturnValue:
+    revision = project_repo.get_revision(id)
+    if revision is None:
+        raise NotFound('Project does not exist')
+
+    format, compact = export_options()
+
+    # Weak: entries are written in download order, so archives of the same
+    # revision hold the same files but are not byte for byte identical
+    etag = f"{id}-{revision}-{format}" + ('-compact' if compact else '')
+    response = not_modified(etag, weak=True)
+    if response:
+        return response
+
     project = project_repo.export_project_data(id)
     if not project:
         raise NotFound('Project does not exist')
@@ -265,26 +449,95 @@ def export_project(id: str) -> ResponseReturnValue:
     project_name = project.pop('name')
     image_urls = project.pop('image_urls')
 
+    window = current_app.config['EXPORT_FETCH_WINDOW']
+    exporter = export_jobs.exporter(format, compact)
+    annotations = project_repo.iter_export_annotations(
+        id,
+        current_app.config['EXPORT_CURSOR_BATCH'],
+        by_image=exporter.by_image
+    )
+
+    # Pull the first chunk eagerly so a failing fetch still maps to a 500
     try:
-        responses = img_util.fetch_images(image_urls)
-    except requests.RequestException:
+        if serving_async():
+            # Sent from the server's event loop, which awaits the downloads
+            images = img_util.async_iter_images(image_urls, window)
+            archive = async_stream_export_archive(project, images, annotations, exporter)
+            body = Prepended(img_util.run(archive.__anext__()), archive)
+        else:
+            images = img_util.iter_images(image_urls, window)
+            archive = stream_export_archive(project, images, annotations, exporter)
+            body = chain([next(archive)], archive)
+    except Exception:
         raise InternalServerError('Network Error')
 
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
-        for img, response in zip(project['images'], responses):
-            zip_file.writestr(f"images/{img['filename']}", response.content)
+    response = Response(
+        body,
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename="{project_name}_{exporter.suffix}.zip"'
+        }
+    )
+    response.set_etag(etag, weak=True)
+
+    return response
+
 
-        project_str = json.dumps(project, indent=2)
-        zip_file.writestr("annotations.json", project_str)
+@app.route('/export/<string:id>', methods=['POST'])
+@require_login
+def create_export_job(id: str) -> ResponseReturnValue:
+    project = fetch_project(id)
+    format, compact = export_options()
+    exporter = export_jobs.exporter(format, compact)
+
+    job = ExportJob(filename=f"{project.name.lower()}_{exporter.suffix}.zip")
+    job_id = export_job_repo.add(job, project.id, g.user.id)
+    get_db_session().commit()
+
+    export_jobs.submit(job_id, project.id, exporter)
+
+    return jsonify({
+        'status': 'success',
+        'data': {'id': job_id}
+    }), 202
+
+
+@app.route('/export/jobs/<string:id>', methods=['GET'])
+@require_login
+def read_export_job(id: str) -> ResponseReturnValue:
+    job = export_job_repo.get_by_id(id, g.user.id)
+    if not job:
+        raise NotFound('Export job not found')
+
+    # Estimate the time left from the fetch rate so far
+    eta = None
+    if job.status == 'running' and job.images_fetched:
+        elapsed = (datetime.now() - job.started_at).total_seconds()
+        eta = elapsed / job.images_fetched * (job.images_total - job.images_fetched)
+
+    return jsonify({
+        'status': 'success',
+        'data': {**job.to_dict(), 'eta': eta}
+    }), 200
+
+
+@app.route('/export/jobs/<string:id>/download', methods=['GET'])
+@require_login
+def download_export_job(id: str) -> ResponseReturnValue:
+    job = export_job_repo.get_by_id(id, g.user.id)
+    if not job:
+        raise NotFound('Export job not found')
 
-    zip_buffer.seek(0)
+    if job.status == 'expired':
+        raise NotFound('Export has expired')
+    if job.status != 'done':
+        raise BadRequest('Export is not ready')
 
     return send_file(
-        zip_buffer,
+        export_jobs.artifact_path(job.id),
         mimetype='application/zip',
         as_attachment=True,
-        download_name=f"{project_name}_annotations.zip"
+        download_name=job.filename
     )
 
 
@@ -0,0 +1,27 @@
+"""image ingest status
+
+Revision ID: 2f7a9c3e5b64
+Revises: b6e1f4a3c820
+Create Date: 2026-10-18 09:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f7a9c3e5b64'
+down_revision = 'b6e1f4a3c820'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Every image stored before the ingest pipeline is ready
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('status', sa.String(length=16), nullable=False, server_default='ready'))
+
+
+def downgrade():
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.drop_column('status')
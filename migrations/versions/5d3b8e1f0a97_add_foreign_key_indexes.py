@@ -0,0 +1,112 @@
+"""add foreign key indexes and unique category names per project
+
+Revision ID: 5d3b8e1f0a97
+Revises: 2f7a9c3e5b64
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+import uuid
+
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d3b8e1f0a97'
+down_revision = '2f7a9c3e5b64'
+branch_labels = None
+depends_on = None
+
+categories = sa.table(
+    'categories',
+    sa.column('id'),
+    sa.column('project_id'),
+    sa.column('name'),
+    sa.column('color'),
+    sa.column('created_at'),
+    sa.column('updated_at')
+)
+annotations = sa.table('annotations', sa.column('id'), sa.column('image_id'), sa.column('category_id'))
+images = sa.table('images', sa.column('id'), sa.column('project_id'))
+
+
+def repair_categories(bind) -> None:
+    """Leave one category per name in each project, used only by annotations of that project.
+
+    Category lookups used to be global, so a project could get the same
+    name twice and annotations could be saved with another project's
+    category.
+    """
+    kept = {}
+    for id, project_id, name in bind.execute(
+        sa.select(categories.c.id, categories.c.project_id, categories.c.name)
+        .order_by(categories.c.created_at, categories.c.id)
+    ):
+        kept_id = kept.setdefault((project_id, name), id)
+        if kept_id != id:
+            bind.execute(annotations.update().where(annotations.c.category_id == id).values(category_id=kept_id))
+            bind.execute(categories.delete().where(categories.c.id == id))
+
+    # Annotations using another project's category get the same name in their own project
+    strays = {}
+    for annotation_id, project_id, name, color in bind.execute(
+        sa.select(annotations.c.id, images.c.project_id, categories.c.name, categories.c.color)
+        .join(images, annotations.c.image_id == images.c.id)
+        .join(categories, annotations.c.category_id == categories.c.id)
+        .where(categories.c.project_id != images.c.project_id)
+    ):
+        strays.setdefault((project_id, name, color), []).append(annotation_id)
+
+    for (project_id, name, color), annotation_ids in strays.items():
+        category_id = kept.get((project_id, name))
+        if category_id is None:
+            category_id = kept[(project_id, name)] = str(uuid.uuid4())
+            now = datetime.now()
+            bind.execute(categories.insert().values(
+                id=category_id,
+                project_id=project_id,
+                name=name,
+                color=color,
+                created_at=now,
+                updated_at=now
+            ))
+
+        bind.execute(
+            annotations.update()
+            .where(annotations.c.id.in_(annotation_ids))
+            .values(category_id=category_id)
+        )
+
+
+def upgrade():
+    with op.batch_alter_table('projects', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_projects_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_images_project_id'), ['project_id'], unique=False)
+
+    with op.batch_alter_table('annotations', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_annotations_image_id'), ['image_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_annotations_category_id'), ['category_id'], unique=False)
+
+    repair_categories(op.get_bind())
+
+    # Also serves lookups by project_id alone, as its leading column
+    with op.batch_alter_table('categories', schema=None) as batch_op:
+        batch_op.create_index('ix_categories_project_id_name', ['project_id', 'name'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('categories', schema=None) as batch_op:
+        batch_op.drop_index('ix_categories_project_id_name')
+
+    with op.batch_alter_table('annotations', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_annotations_category_id'))
+        batch_op.drop_index(batch_op.f('ix_annotations_image_id'))
+
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_images_project_id'))
+
+    with op.batch_alter_table('projects', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_projects_user_id'))
@@ -0,0 +1,90 @@
+"""initial schema
+
+Revision ID: 8c1d0e4b7a21
+Revises: 
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1d0e4b7a21'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('demo',
+    sa.Column('url', sa.String(length=256), nullable=False),
+    sa.Column('id', sa.String(length=60), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('users',
+    sa.Column('username', sa.String(length=60), nullable=False),
+    sa.Column('password', sa.String(length=60), nullable=False),
+    sa.Column('id', sa.String(length=60), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('username')
+    )
+    op.create_table('projects',
+    sa.Column('name', sa.String(length=256), nullable=False),
+    sa.Column('user_id', sa.String(length=60), nullable=False),
+    sa.Column('id', sa.String(length=60), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('categories',
+    sa.Column('project_id', sa.String(length=60), nullable=False),
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('color', sa.String(length=16), nullable=False),
+    sa.Column('id', sa.String(length=60), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('images',
+    sa.Column('project_id', sa.String(length=60), nullable=False),
+    sa.Column('url', sa.String(length=256), nullable=False),
+    sa.Column('filename', sa.String(length=32), nullable=False),
+    sa.Column('width', sa.Float(), nullable=False),
+    sa.Column('height', sa.Float(), nullable=False),
+    sa.Column('id', sa.String(length=60), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('annotations',
+    sa.Column('image_id', sa.String(length=60), nullable=False),
+    sa.Column('category_id', sa.String(length=60), nullable=False),
+    sa.Column('x', sa.Float(), nullable=False),
+    sa.Column('y', sa.Float(), nullable=False),
+    sa.Column('width', sa.Float(), nullable=False),
+    sa.Column('height', sa.Float(), nullable=False),
+    sa.Column('id', sa.String(length=60), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['category_id'], ['categories.id'], ),
+    sa.ForeignKeyConstraint(['image_id'], ['images.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('annotations')
+    op.drop_table('images')
+    op.drop_table('categories')
+    op.drop_table('projects')
+    op.drop_table('users')
+    op.drop_table('demo')
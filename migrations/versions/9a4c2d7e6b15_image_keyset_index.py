@@ -0,0 +1,29 @@
+"""index images by project and id for keyset pagination
+
+Revision ID: 9a4c2d7e6b15
+Revises: 5d3b8e1f0a97
+Create Date: 2026-10-18 11:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c2d7e6b15'
+down_revision = '5d3b8e1f0a97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The composite index also serves lookups by project_id alone
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.create_index('ix_images_project_id_id', ['project_id', 'id'], unique=False)
+        batch_op.drop_index(batch_op.f('ix_images_project_id'))
+
+
+def downgrade():
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_images_project_id'), ['project_id'], unique=False)
+        batch_op.drop_index('ix_images_project_id_id')
@@ -0,0 +1,43 @@
+"""export jobs
+
+Revision ID: b6e1f4a3c820
+Revises: 8c1d0e4b7a21
+Create Date: 2026-10-18 09:02:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e1f4a3c820'
+down_revision = '8c1d0e4b7a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # `db.create_all()` at startup may already have added the new table
+    if not sa.inspect(op.get_bind()).has_table('export_jobs'):
+        op.create_table('export_jobs',
+        sa.Column('project_id', sa.String(length=60), nullable=False),
+        sa.Column('user_id', sa.String(length=60), nullable=False),
+        sa.Column('filename', sa.String(length=300), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('images_total', sa.Integer(), nullable=False),
+        sa.Column('images_fetched', sa.Integer(), nullable=False),
+        sa.Column('bytes_written', sa.BigInteger(), nullable=False),
+        sa.Column('error', sa.String(length=256), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('id', sa.String(length=60), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('export_jobs')
@@ -0,0 +1,26 @@
+"""add a revision counter to projects
+
+Revision ID: c3e8f1a6d240
+Revises: 9a4c2d7e6b15
+Create Date: 2026-10-18 13:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e8f1a6d240'
+down_revision = '9a4c2d7e6b15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('projects', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('revision', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    with op.batch_alter_table('projects', schema=None) as batch_op:
+        batch_op.drop_column('revision')
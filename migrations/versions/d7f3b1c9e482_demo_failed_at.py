@@ -0,0 +1,26 @@
+"""mark demo images that could not be read
+
+Revision ID: d7f3b1c9e482
+Revises: a8d4f2c6e913
+Create Date: 2026-10-18 21:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7f3b1c9e482'
+down_revision = 'a8d4f2c6e913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('demo', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('failed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('demo', schema=None) as batch_op:
+        batch_op.drop_column('failed_at')
@@ -0,0 +1,47 @@
+"""share stored files between identical images through assets
+
+Revision ID: e5b2a9d4c731
+Revises: c3e8f1a6d240
+Create Date: 2026-10-18 15:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b2a9d4c731'
+down_revision = 'c3e8f1a6d240'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # `db.create_all()` at startup may already have added the new table
+    if not sa.inspect(op.get_bind()).has_table('assets'):
+        op.create_table('assets',
+        sa.Column('digest', sa.String(length=64), nullable=False),
+        sa.Column('url', sa.String(length=256), nullable=False),
+        sa.Column('width', sa.Float(), nullable=False),
+        sa.Column('height', sa.Float(), nullable=False),
+        sa.Column('refcount', sa.Integer(), nullable=False, server_default='1'),
+        sa.Column('id', sa.String(length=60), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('digest')
+        )
+
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('asset_id', sa.String(length=60), nullable=True))
+        batch_op.create_index(batch_op.f('ix_images_asset_id'), ['asset_id'], unique=False)
+        batch_op.create_foreign_key('fk_images_asset_id_assets', 'assets', ['asset_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_images_asset_id_assets', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_images_asset_id'))
+        batch_op.drop_column('asset_id')
+
+    op.drop_table('assets')
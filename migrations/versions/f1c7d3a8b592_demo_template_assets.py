@@ -0,0 +1,28 @@
+"""link demo images to the assets their clones share
+
+Revision ID: f1c7d3a8b592
+Revises: e5b2a9d4c731
+Create Date: 2026-10-18 17:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c7d3a8b592'
+down_revision = 'e5b2a9d4c731'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('demo', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('asset_id', sa.String(length=60), nullable=True))
+        batch_op.create_foreign_key('fk_demo_asset_id_assets', 'assets', ['asset_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('demo', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_demo_asset_id_assets', type_='foreignkey')
+        batch_op.drop_column('asset_id')
@@ -1,56 +1,93 @@
-import copy
 import uuid
 
+from datetime import datetime
+
 
 class BaseModel:
+    __slots__ = ('id',)
+
+    # Attributes that are never serialized
+    _hidden: frozenset[str] = frozenset()
+    _fields: tuple[str, ...] = ('id',)
+
     def __init__(self, id: str | None = None):
         if id is None:
             id = str(uuid.uuid4())
 
         self.id = id
 
-    def to_dict(self):
-        model_dict = copy.deepcopy(vars(self))
-        if 'password' in model_dict:
-            del model_dict['password']
+    def __init_subclass__(cls, **kwargs: dict) -> None:
+        super().__init_subclass__(**kwargs)
 
-        for k, v in model_dict.items():
-            if isinstance(v, BaseModel):
-                model_dict[k] = v.to_dict()
+        # Serialize slots in declaration order, base classes first
+        fields = []
+        for klass in reversed(cls.__mro__):
+            for name in klass.__dict__.get('__slots__', ()):
+                if name not in fields and name not in cls._hidden:
+                    fields.append(name)
+
+        cls._fields = tuple(fields)
 
-            if isinstance(v, list):
-                lst = []
-                for model in v:
-                    if isinstance(model, BaseModel):
-                        model = model.to_dict()
+    def to_dict(self) -> dict:
+        model_dict = {}
+        for k in self._fields:
+            try:
+                v = getattr(self, k)
+            except AttributeError:
+                # Relationships are only present once they have been loaded
+                continue
 
-                    lst.append(model)
+            if isinstance(v, BaseModel):
+                v = v.to_dict()
 
-                model_dict[k] = lst
+            elif isinstance(v, list):
+                v = [
+                    model.to_dict() if isinstance(model, BaseModel) else model
+                    for model in v
+                ]
+
+            model_dict[k] = v
 
         return model_dict
 
 
 class User(BaseModel):
-    def __init__(self, username: str, password: str, id: str | None = None) -> None:
+    __slots__ = ('username', 'password', 'expires_at')
+    _hidden = frozenset({'password'})
+
+    def __init__(
+        self,
+        username: str,
+        password: str | None,
+        expires_at: datetime | None = None,
+        id: str | None = None
+    ) -> None:
         super().__init__(id=id)
         self.username = username
         self.password = password
+        self.expires_at = expires_at
 
 
 class Project(BaseModel):
-    def __init__(self, name: str, id: str | None = None) -> None:
+    __slots__ = ('name', 'revision', 'categories', 'images')
+
+    def __init__(self, name: str, revision: int = 1, id: str | None = None) -> None:
         super().__init__(id=id)
         self.name = name
+        self.revision = revision
 
 
 class Demo(BaseModel):
+    __slots__ = ('url',)
+
     def __init__(self, url: str, id: str | None = None) -> None:
         super().__init__(id=id)
         self.url = url
 
 
 class Annotation(BaseModel):
+    __slots__ = ('x', 'y', 'width', 'height', 'category')
+
     def __init__(
         self,
         x: float,
@@ -67,12 +104,15 @@ class Annotation(BaseModel):
 
 
 class Image(BaseModel):
+    __slots__ = ('url', 'width', 'height', 'filename', 'status', 'annotations')
+
     def __init__(
         self,
         url: str,
         width: float,
         height: float,
         filename: str,
+        status: str = 'ready',
         id: str | None = None
     ) -> None:
         super().__init__(id=id)
@@ -80,10 +120,68 @@ class Image(BaseModel):
         self.width = width
         self.height = height
         self.filename = filename
+        self.status = status
+
+
+class Asset(BaseModel):
+    __slots__ = ('digest', 'url', 'width', 'height', 'refcount')
+
+    def __init__(
+        self,
+        digest: str,
+        url: str,
+        width: float,
+        height: float,
+        refcount: int = 1,
+        id: str | None = None
+    ) -> None:
+        super().__init__(id=id)
+        self.digest = digest
+        self.url = url
+        self.width = width
+        self.height = height
+        self.refcount = refcount
 
 
 class Category(BaseModel):
+    __slots__ = ('name', 'color')
+
     def __init__(self, name: str, color: str, id: str | None = None) -> None:
         super().__init__(id=id)
         self.name = name
         self.color = color
+
+
+class ExportJob(BaseModel):
+    __slots__ = (
+        'filename',
+        'status',
+        'images_total',
+        'images_fetched',
+        'bytes_written',
+        'error',
+        'started_at',
+        'finished_at'
+    )
+
+    def __init__(
+        self,
+        filename: str,
+        status: str = 'queued',
+        images_total: int = 0,
+        images_fetched: int = 0,
+        bytes_written: int = 0,
+        error: str | None = None,
+        started_at: datetime | None = None,
+        finished_at: datetime | None = None,
+        id: str | None = None
+    ) -> None:
+        super().__init__(id=id)
+        self.filename = filename
+        self.status = status
+        self.images_total = images_total
+        self.images_fetched = images_fetched
+        self.bytes_written = bytes_written
+        self.error = error
+        self.started_at = started_at
+        self.finished_at = finished_at
@@ -6,7 +6,9 @@ from storage.repository import (
     SQLAlchemyAnnotationRepository,
     SQLAlchemyProjectRepository,
     SQLAlchemyCategoryRepository,
-    SQLAlchemyDemoRepository
+    SQLAlchemyDemoRepository,
+    SQLAlchemyExportJobRepository,
+    SQLAlchemyAssetRepository
 )
 
 
@@ -16,6 +18,8 @@ image_repo = SQLAlchemyImageRepository(db.session)
 annotation_repo = SQLAlchemyAnnotationRepository(db.session)
 category_repo = SQLAlchemyCategoryRepository(db.session)
 demo_repo = SQLAlchemyDemoRepository(db.session)
+export_job_repo = SQLAlchemyExportJobRepository(db.session)
+asset_repo = SQLAlchemyAssetRepository(db.session)
 
 
 def get_db_session():
@@ -0,0 +1,171 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+import httpx
+
+from pathlib import Path
+
+
+class ImageCache:
+    """Bounded on-disk cache of remote images, keyed by URL.
+
+    Entries are plain files written atomically, so every worker on the host
+    shares the cache. A hit refreshes the entry's mtime, which is what the
+    LRU eviction orders by. Entries older than `freshness` are revalidated
+    with `If-None-Match`/`If-Modified-Since` before they are used again,
+    and entries not revalidated for `max_age` are dropped.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int,
+        max_age: float,
+        freshness: float,
+        sweep_interval: float = 60.0
+    ) -> None:
+        self.root = Path(root).resolve()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.freshness = freshness
+        self.sweep_interval = sweep_interval
+
+        self._last_sweep = 0.0
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, url: str) -> tuple[Path, Path]:
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        directory = self.root / key[:2]
+
+        return directory / f"{key}.bin", directory / f"{key}.json"
+
+    def _write(self, path: Path, data: bytes) -> None:
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def load(self, url: str) -> tuple[dict, float] | None:
+        """Return the cached validators of `url` and how long ago they were checked."""
+        _, meta_path = self._paths(url)
+        try:
+            validated_at = meta_path.stat().st_mtime
+            meta = json.loads(meta_path.read_bytes())
+        except (FileNotFoundError, ValueError):
+            return None
+
+        return meta, time.time() - validated_at
+
+    def read(self, url: str) -> bytes | None:
+        data_path, _ = self._paths(url)
+        try:
+            content = data_path.read_bytes()
+            os.utime(data_path)
+        except FileNotFoundError:
+            return None
+
+        return content
+
+    def store(self, url: str, content: bytes, headers: httpx.Headers) -> None:
+        data_path, meta_path = self._paths(url)
+        meta = {
+            'url': url,
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified')
+        }
+
+        # Data first, so a visible entry always has its content
+        self._write(data_path, content)
+        self._write(meta_path, json.dumps(meta).encode('utf-8'))
+
+        if time.time() - self._last_sweep > self.sweep_interval:
+            self.sweep()
+
+    def revalidated(self, url: str) -> None:
+        _, meta_path = self._paths(url)
+        try:
+            os.utime(meta_path)
+        except FileNotFoundError:
+            pass
+
+    def sweep(self) -> None:
+        """Drop expired entries, then least recently used ones down to 90% of `max_bytes`."""
+        self._last_sweep = time.time()
+
+        with open(self.root / '.lock', 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is already sweeping
+                return
+
+            now = time.time()
+            total = 0
+            entries = []
+            for meta_path in self.root.glob('*/*.json'):
+                data_path = meta_path.with_suffix('.bin')
+                try:
+                    validated_at = meta_path.stat().st_mtime
+                    data_stat = data_path.stat()
+                except FileNotFoundError:
+                    meta_path.unlink(missing_ok=True)
+                    continue
+
+                if now - validated_at > self.max_age:
+                    meta_path.unlink(missing_ok=True)
+                    data_path.unlink(missing_ok=True)
+                    continue
+
+                total += data_stat.st_size
+                entries.append((data_stat.st_mtime, data_stat.st_size, meta_path, data_path))
+
+            if total <= self.max_bytes:
+                return
+
+            entries.sort()
+            for _, size, meta_path, data_path in entries:
+                meta_path.unlink(missing_ok=True)
+                data_path.unlink(missing_ok=True)
+                total -= size
+                if total <= self.max_bytes * 0.9:
+                    break
+
+    async def fetch(self, client: httpx.AsyncClient, url: str) -> bytes:
+        cached = await asyncio.to_thread(self.load, url)
+        headers = {}
+
+        if cached is not None:
+            meta, age = cached
+            if age < self.freshness:
+                content = await asyncio.to_thread(self.read, url)
+                if content is not None:
+                    return content
+
+            if meta['etag']:
+                headers['If-None-Match'] = meta['etag']
+            if meta['last_modified']:
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        response = await client.get(url, headers=headers)
+        if response.status_code == 304:
+            content = await asyncio.to_thread(self.read, url)
+            if content is not None:
+                await asyncio.to_thread(self.revalidated, url)
+                return content
+
+            # Evicted since the validators were read
+            response = await client.get(url)
+
+        response.raise_for_status()
+        await asyncio.to_thread(self.store, url, response.content, response.headers)
+
+        return response.content
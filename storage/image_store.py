@@ -0,0 +1,381 @@
+import cloudinary
+import cloudinary.uploader
+import cloudinary.api
+import asyncio
+import hashlib
+import io
+import mmap
+import os
+import re
+import shutil
+import struct
+import tempfile
+import time
+import httpx
+
+from abc import ABC, abstractmethod
+from pathlib import Path
+from flask import send_from_directory
+from flask.typing import ResponseReturnValue
+from werkzeug.exceptions import NotFound
+
+NOT_IMPLEMENTED_ERROR = NotImplementedError('Method must be implemented')
+
+# Cloudinary configuration
+cloudinary.config(
+    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+    api_key=os.getenv("CLOUDINARY_API_KEY"),
+    api_secret=os.getenv("CLOUDINARY_API_SECRET"),
+)
+
+
+## Abstract Image Store
+class ImageStore(ABC):
+    """Where image files live.
+
+    Uploads return `{'url', 'width', 'height'}`. Images are grouped in
+    folders (one per project) so a project can be dropped at once.
+    """
+
+    @abstractmethod
+    async def upload(self, client: httpx.AsyncClient, file: tuple, folder: str) -> dict:
+        raise NOT_IMPLEMENTED_ERROR
+
+    async def fetch(self, client: httpx.AsyncClient, url: str) -> bytes:
+        response = await client.get(url)
+        response.raise_for_status()
+
+        return response.content
+
+    @abstractmethod
+    def delete(self, url: str) -> None:
+        raise NOT_IMPLEMENTED_ERROR
+
+    def delete_many(self, urls: list[str]) -> None:
+        for url in urls:
+            self.delete(url)
+
+    @abstractmethod
+    def delete_folder(self, folder: str) -> None:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def list_folders(self, parent: str) -> list[str]:
+        raise NOT_IMPLEMENTED_ERROR
+
+    def send(self, path: str) -> ResponseReturnValue:
+        raise NotFound('File not found')
+
+
+## Implementations of the Image Store
+class CloudinaryImageStore(ImageStore):
+    # Public ids the Admin API accepts per delete call
+    DELETE_BATCH_SIZE = 100
+
+    def __init__(self, api_url: str = 'https://api.cloudinary.com') -> None:
+        # Pointed at a local stand-in by the benchmarks
+        self.api_url = api_url.rstrip('/')
+
+    async def upload(self, client: httpx.AsyncClient, file: tuple, folder: str) -> dict:
+        cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME")
+        api_key = os.getenv("CLOUDINARY_API_KEY")
+        api_secret = os.getenv("CLOUDINARY_API_SECRET")
+        timestamp = str(int(time.time()))
+
+        # Build signature string
+        params_to_sign = f"folder={folder}&public_id={file[0]}&timestamp={timestamp}{api_secret}"
+        signature = hashlib.sha1(params_to_sign.encode("utf-8")).hexdigest()
+
+        upload_url = f"{self.api_url}/v1_1/{cloud_name}/image/upload"
+        data = {
+            "api_key": api_key,
+            "timestamp": timestamp,
+            "public_id": file[0],
+            "folder": folder,
+            "signature": signature,
+        }
+
+        response = await client.post(upload_url, data=data, files={"file": file})
+        response.raise_for_status()
+        response = response.json()
+
+        return {
+            'url': response['secure_url'],
+            'width': response['width'],
+            'height': response['height']
+        }
+
+    @staticmethod
+    def public_id(url: str) -> str:
+        # .../image/upload/v1712345678/FLASK/PROJECT/image-abcde.jpg -> FLASK/PROJECT/image-abcde
+        path = url.split('/upload/', 1)[1]
+        path = re.sub(r'^v\d+/', '', path)
+
+        return path.rsplit('.', 1)[0]
+
+    def delete(self, url: str) -> None:
+        public_id = self.public_id(url)
+        response = cloudinary.uploader.destroy(public_id, upload_prefix=self.api_url)
+        if response.get("result") != "ok":
+            raise Exception(f"Unexpected response for {public_id}: {response}")
+
+    def delete_many(self, urls: list[str]) -> None:
+        public_ids = [self.public_id(url) for url in urls]
+        for i in range(0, len(public_ids), self.DELETE_BATCH_SIZE):
+            batch = public_ids[i:i + self.DELETE_BATCH_SIZE]
+            response = cloudinary.api.delete_resources(batch, upload_prefix=self.api_url)
+            if "deleted" not in response:
+                raise Exception(f"Unexpected response for {len(batch)} images: {response}")
+
+    def delete_folder(self, folder: str) -> None:
+        response = cloudinary.api.delete_resources_by_prefix(folder + "/", upload_prefix=self.api_url)
+        if "deleted" not in response:
+            raise Exception(f"Unexpected response for {folder}: {response}")
+
+    def list_folders(self, parent: str) -> list[str]:
+        folders = []
+        next_cursor = None
+        while True:
+            options = {'max_results': 500, 'upload_prefix': self.api_url}
+            if next_cursor:
+                options['next_cursor'] = next_cursor
+
+            response = cloudinary.api.subfolders(parent, **options)
+            folders.extend(folder['path'] for folder in response['folders'])
+
+            next_cursor = response.get('next_cursor')
+            if not next_cursor:
+                return folders
+
+
+class LocalImageStore(ImageStore):
+    """Content-addressed image files on local disk.
+
+    Each distinct file is written once under `objects/` and named by its
+    SHA-256. A folder entry under `files/` is a hard link to the object, so
+    the object is removed with its last link and the app can serve entries
+    straight from disk.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, root: str, base_url: str = '/media') -> None:
+        self.root = Path(root).resolve()
+        self.base_url = base_url.rstrip('/')
+
+        for directory in ('objects', 'files', 'tmp'):
+            (self.root / directory).mkdir(parents=True, exist_ok=True)
+
+    def _object_path(self, digest: str, ext: str) -> Path:
+        return self.root / 'objects' / digest[:2] / f"{digest}{ext}"
+
+    def _entry_path(self, url: str) -> Path:
+        if not url.startswith(self.base_url + '/'):
+            raise ValueError(f"Not a local image url: {url}")
+
+        return self.root / 'files' / url[len(self.base_url) + 1:]
+
+    def save(self, file: tuple, folder: str) -> dict:
+        name, stream, _ = file
+        digest = hashlib.sha256()
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.root / 'tmp')
+        try:
+            try:
+                copy_stream(stream, fd, digest)
+            finally:
+                os.close(fd)
+
+            with open(tmp_path, 'rb') as f:
+                info = image_info(f)
+
+            if info is None:
+                raise ValueError(f"Unsupported image format: {name}")
+
+            ext, width, height = info
+            digest = digest.hexdigest()
+
+            object_path = self._object_path(digest, ext)
+            object_path.parent.mkdir(exist_ok=True)
+            if object_path.exists():
+                os.unlink(tmp_path)
+            else:
+                os.replace(tmp_path, object_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        entry = f"{folder}/{name}-{digest}{ext}"
+        entry_path = self.root / 'files' / entry
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(object_path, entry_path)
+        except FileExistsError:
+            pass
+
+        return {
+            'url': f"{self.base_url}/{entry}",
+            'width': width,
+            'height': height
+        }
+
+    async def upload(self, client: httpx.AsyncClient, file: tuple, folder: str) -> dict:
+        return await asyncio.to_thread(self.save, file, folder)
+
+    def read(self, url: str) -> bytes:
+        return self._entry_path(url).read_bytes()
+
+    async def fetch(self, client: httpx.AsyncClient, url: str) -> bytes:
+        if not url.startswith(self.base_url + '/'):
+            return await super().fetch(client, url)
+
+        return await asyncio.to_thread(self.read, url)
+
+    def _unlink(self, entry_path: Path) -> None:
+        stem, ext = os.path.splitext(entry_path.name)
+        object_path = self._object_path(stem[-64:], ext)
+
+        entry_path.unlink(missing_ok=True)
+        try:
+            if object_path.stat().st_nlink == 1:
+                object_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def delete(self, url: str) -> None:
+        self._unlink(self._entry_path(url))
+
+    def delete_folder(self, folder: str) -> None:
+        folder_path = self.root / 'files' / folder
+        if not folder_path.is_dir():
+            return
+
+        for entry_path in folder_path.rglob('*'):
+            if entry_path.is_file():
+                self._unlink(entry_path)
+
+        shutil.rmtree(folder_path, ignore_errors=True)
+
+    def list_folders(self, parent: str) -> list[str]:
+        parent_path = self.root / 'files' / parent
+        if not parent_path.is_dir():
+            return []
+
+        return sorted(f"{parent}/{path.name}" for path in parent_path.iterdir() if path.is_dir())
+
+    def send(self, path: str) -> ResponseReturnValue:
+        # Werkzeug hands the open file to the server's wsgi.file_wrapper (sendfile)
+        return send_from_directory(self.root / 'files', path, max_age=31536000)
+
+
+def create_image_store(config: dict) -> ImageStore:
+    if config['IMAGE_STORE'] == 'local':
+        return LocalImageStore(config['LOCAL_STORE_ROOT'], config['LOCAL_STORE_URL'])
+
+    return CloudinaryImageStore(config['CLOUDINARY_API_URL'])
+
+
+def write_all(fd: int, data: memoryview) -> None:
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+def copy_stream(stream, fd: int, digest=None) -> None:
+    """Copy an upload into `fd`, hashing it into `digest` when one is given.
+
+    In-memory bodies are hashed and written through a view of their buffer,
+    and bodies Werkzeug spooled to a temporary file are hashed through mmap
+    and copied in the kernel with sendfile, so no intermediate copies are made.
+    """
+    if isinstance(stream, (bytes, bytearray, memoryview)):
+        view = memoryview(stream)
+        if digest is not None:
+            digest.update(view)
+        write_all(fd, view)
+        return
+
+    if isinstance(stream, io.BytesIO):
+        with stream.getbuffer() as view:
+            if digest is not None:
+                digest.update(view)
+            write_all(fd, view)
+        return
+
+    try:
+        src_fd = stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        src_fd = None
+
+    if src_fd is not None:
+        size = os.fstat(src_fd).st_size
+        if size and digest is not None:
+            with mmap.mmap(src_fd, 0, access=mmap.ACCESS_READ) as view:
+                digest.update(view)
+
+        offset = 0
+        while offset < size:
+            offset += os.sendfile(fd, src_fd, offset, size - offset)
+        return
+
+    buffer = bytearray(LocalImageStore.CHUNK_SIZE)
+    view = memoryview(buffer)
+    while n := stream.readinto(buffer):
+        if digest is not None:
+            digest.update(view[:n])
+        write_all(fd, view[:n])
+
+
+def image_info(f) -> tuple[str, int, int] | None:
+    """Read the extension, width and height from an image file header."""
+    head = f.read(32)
+
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        width, height = struct.unpack('>II', head[16:24])
+        return '.png', width, height
+
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        width, height = struct.unpack('<HH', head[6:10])
+        return '.gif', width, height
+
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        chunk = head[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', head[26:30])
+            return '.webp', width & 0x3fff, height & 0x3fff
+
+        if chunk == b'VP8L':
+            bits = struct.unpack('<I', head[21:25])[0]
+            return '.webp', (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+
+        if chunk == b'VP8X':
+            width = int.from_bytes(head[24:27], 'little') + 1
+            height = int.from_bytes(head[27:30], 'little') + 1
+            return '.webp', width, height
+
+        return None
+
+    if head[:2] == b'\xff\xd8':
+        # Walk the JPEG segments up to the first start-of-frame marker
+        f.seek(2)
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xff:
+                return None
+
+            while marker[1] == 0xff:
+                marker = marker[1:] + f.read(1)
+
+            code = marker[1]
+            if code in (0xd8, 0x01) or 0xd0 <= code <= 0xd7:
+                continue
+
+            length = struct.unpack('>H', f.read(2))[0]
+            if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+                height, width = struct.unpack('>xHH', f.read(5))
+                return '.jpg', width, height
+
+            f.seek(length - 2, os.SEEK_CUR)
+
+    return None
@@ -29,8 +29,8 @@ class BaseORM:
 
 class AnnotationORM(BaseORM, db.Model):
     __tablename__ = 'annotations'
-    image_id = db.Column(db.String(60), db.ForeignKey('images.id'), nullable=False)
-    category_id = db.Column(db.String(60), db.ForeignKey('categories.id'), nullable=False)
+    image_id = db.Column(db.String(60), db.ForeignKey('images.id'), nullable=False, index=True)
+    category_id = db.Column(db.String(60), db.ForeignKey('categories.id'), nullable=False, index=True)
     x = db.Column(db.Float, nullable=False)
     y = db.Column(db.Float, nullable=False)
     width = db.Column(db.Float, nullable=False)
@@ -40,20 +40,60 @@ class AnnotationORM(BaseORM, db.Model):
 class DemoORM(BaseORM, db.Model):
     __tablename__ = 'demo'
     url = db.Column(db.String(256), nullable=False)
+    # Set once the image is part of the demo template, which holds a reference to it
+    asset_id = db.Column(db.String(60), db.ForeignKey('assets.id'))
+    # Set when the downloaded image could not be read, so it is not downloaded again
+    failed_at = db.Column(db.DateTime)
+
+
+class ExportJobORM(BaseORM, db.Model):
+    __tablename__ = 'export_jobs'
+    project_id = db.Column(db.String(60), db.ForeignKey('projects.id'), nullable=False)
+    user_id = db.Column(db.String(60), db.ForeignKey('users.id'), nullable=False)
+    filename = db.Column(db.String(300), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    images_total = db.Column(db.Integer, nullable=False, default=0)
+    images_fetched = db.Column(db.Integer, nullable=False, default=0)
+    bytes_written = db.Column(db.BigInteger, nullable=False, default=0)
+    error = db.Column(db.String(256))
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
 
 
 class ImageORM(BaseORM, db.Model):
     __tablename__ = 'images'
+    __table_args__ = (
+        # Keyset pagination walks a project's images by id, project_id lookups use it too
+        db.Index('ix_images_project_id_id', 'project_id', 'id'),
+    )
     project_id = db.Column(db.String(60), db.ForeignKey('projects.id'), nullable=False)
+    # Unset for pending uploads and for images stored before assets were shared
+    asset_id = db.Column(db.String(60), db.ForeignKey('assets.id'), index=True)
     url = db.Column(db.String(256), nullable=False)
     filename = db.Column(db.String(32), nullable=False)
     width = db.Column(db.Float, nullable=False)
     height = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='ready', server_default='ready')
     annotations = db.relationship('AnnotationORM', backref='image', cascade='all')
 
 
+class AssetORM(BaseORM, db.Model):
+    __tablename__ = 'assets'
+    # SHA-256 of the file: identical uploads share one stored copy
+    digest = db.Column(db.String(64), nullable=False, unique=True)
+    url = db.Column(db.String(256), nullable=False)
+    width = db.Column(db.Float, nullable=False)
+    height = db.Column(db.Float, nullable=False)
+    # Images pointing at the asset, it leaves the image store with the last one
+    refcount = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+
 class CategoryORM(BaseORM, db.Model):
     __tablename__ = 'categories'
+    __table_args__ = (
+        # Category names are unique per project, project_id lookups use it too
+        db.Index('ix_categories_project_id_name', 'project_id', 'name', unique=True),
+    )
     project_id = db.Column(db.String(60), db.ForeignKey('projects.id'), nullable=False)
     name = db.Column(db.String(64), nullable=False)
     color = db.Column(db.String(16), nullable=False)
@@ -63,13 +103,18 @@ class CategoryORM(BaseORM, db.Model):
 class ProjectORM(BaseORM, db.Model):
     __tablename__ = 'projects'
     name = db.Column(db.String(256), nullable=False, unique=True)
-    user_id = db.Column(db.String(60), db.ForeignKey('users.id'), nullable=False)
+    # Bumped by every change to the project's categories, images or annotations
+    revision = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    user_id = db.Column(db.String(60), db.ForeignKey('users.id'), nullable=False, index=True)
     categories = db.relationship('CategoryORM', backref='project', cascade='all')
     images = db.relationship('ImageORM', backref='project', cascade='all')
+    export_jobs = db.relationship('ExportJobORM', backref='project', cascade='all')
 
 
 class UserORM(BaseORM, db.Model):
     __tablename__ = 'users'
     username = db.Column(db.String(60), nullable=False, unique=True)
     password = db.Column(db.String(60), nullable=False)
+    # Demo users are removed by the reaper once this has passed
+    expires_at = db.Column(db.DateTime, index=True)
     projects = db.relationship('ProjectORM', backref='user', cascade='all')
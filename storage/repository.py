@@ -1,9 +1,13 @@
-from typing import Any
-from src.model import User, Project, Image, Annotation, Category, Demo
-from storage.orm import UserORM, ProjectORM, ImageORM, AnnotationORM, CategoryORM, DemoORM
+import uuid
+
+from datetime import datetime
+from typing import Any, Iterator
+from collections import Counter
+from src.model import User, Project, Image, Annotation, Category, Demo, ExportJob, Asset
+from storage.orm import UserORM, ProjectORM, ImageORM, AnnotationORM, CategoryORM, DemoORM, ExportJobORM, AssetORM
+from sqlalchemy import select, insert, update, delete, func, or_, exists
 from sqlalchemy.orm import Session
 from abc import ABC, abstractmethod
-from pathlib import Path
 
 NOT_IMPLEMENTED_ERROR = NotImplementedError('Method must be implemented')
 
@@ -22,6 +26,10 @@ class UserRepository(ABC):
     def get_by_id(self, id: str) -> User | None:
         raise NOT_IMPLEMENTED_ERROR
 
+    @abstractmethod
+    def get_identity(self, id: str) -> User | None:
+        raise NOT_IMPLEMENTED_ERROR
+
     @abstractmethod
     def get_usernames(self) -> list[str]:
         raise NOT_IMPLEMENTED_ERROR
@@ -30,6 +38,18 @@ class UserRepository(ABC):
     def remove(self, id: str) -> None:
         raise NOT_IMPLEMENTED_ERROR
 
+    @abstractmethod
+    def expire(self, id: str, at: datetime) -> None:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def claim_expired(self, now: datetime, lease_until: datetime, limit: int) -> list[str]:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def remove_many(self, ids: list[str]) -> None:
+        raise NOT_IMPLEMENTED_ERROR
+
 
 class ProjectRepository(ABC):
     @abstractmethod
@@ -48,10 +68,30 @@ class ProjectRepository(ABC):
     def get_with_relationships(self, id: str) -> Project | None:
         raise NOT_IMPLEMENTED_ERROR
 
+    @abstractmethod
+    def get_summary(self, id: str) -> dict | None:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def get_revision(self, id: str) -> int | None:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def list_revisions(self, user_id: str) -> list[tuple[str, int]]:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def bump_revision(self, id: str) -> None:
+        raise NOT_IMPLEMENTED_ERROR
+
     @abstractmethod
     def get_project_image_names(self, id: str) -> list[str]:
         raise NOT_IMPLEMENTED_ERROR
 
+    @abstractmethod
+    def get_ids(self, user_ids: list[str]) -> list[str]:
+        raise NOT_IMPLEMENTED_ERROR
+
     @abstractmethod
     def list(self, user_id: str) -> list[Project]:
         raise NOT_IMPLEMENTED_ERROR
@@ -64,12 +104,20 @@ class ProjectRepository(ABC):
     def export_project_data(self, id: str) -> dict:
         raise NOT_IMPLEMENTED_ERROR
 
+    @abstractmethod
+    def iter_export_annotations(self, id: str, batch_size: int = 1000, by_image: bool = False) -> Iterator[dict]:
+        raise NOT_IMPLEMENTED_ERROR
+
 
 class AnnotationRepository(ABC):
     @abstractmethod
     def add(self, annotation: Annotation, image_id: str, category_id: str) -> str:
         raise NOT_IMPLEMENTED_ERROR
 
+    @abstractmethod
+    def sync(self, image_id: str, annotations: list[Annotation]) -> None:
+        raise NOT_IMPLEMENTED_ERROR
+
 
 class CategoryRepository(ABC):
     @abstractmethod
@@ -77,25 +125,87 @@ class CategoryRepository(ABC):
         raise NOT_IMPLEMENTED_ERROR
 
     @abstractmethod
-    def get(self, name: str) -> Category | None:
+    def get(self, name: str, project_id: str) -> Category | None:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def get_or_add_many(self, categories: list[Category], project_id: str) -> dict[str, Category]:
         raise NOT_IMPLEMENTED_ERROR
 
 
 class ImageRepository(ABC):
     @abstractmethod
-    def add(self, image: Image, project_id: str) -> str:
+    def add(self, image: Image, project_id: str, asset_id: str | None = None) -> str:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def add_many(self, images: list[tuple[Image, str | None]], project_id: str) -> None:
         raise NOT_IMPLEMENTED_ERROR
 
     @abstractmethod
     def get_by_id(self, id: str) -> Image | None:
         raise NOT_IMPLEMENTED_ERROR
 
+    @abstractmethod
+    def page(self, project_id: str, after: str | None, limit: int) -> list[Image]:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def get_storage_refs(
+        self,
+        ids: list[str] | None = None,
+        project_ids: list[str] | None = None
+    ) -> tuple[list[str], list[str]]:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def get_ids(self, project_id: str, ids: list[str]) -> list[str]:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def fail_stale(self, before: datetime) -> list[tuple[str, str]]:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def remove_many(self, ids: list[str]) -> None:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def list(self, project_id: str, ids: list[str] | None = None) -> list[Image]:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def get_project_id(self, id: str) -> str | None:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def folder_in_use(self, folder: str) -> bool:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def update(self, id: str, **fields: dict) -> int:
+        raise NOT_IMPLEMENTED_ERROR
+
     @abstractmethod
     def remove(self, id: str) -> None:
         raise NOT_IMPLEMENTED_ERROR
 
+
+class AssetRepository(ABC):
+    @abstractmethod
+    def add(self, asset: Asset) -> str:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def acquire(self, digest: str) -> Asset | None:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def retain(self, ids: list[str]) -> None:
+        raise NOT_IMPLEMENTED_ERROR
+
     @abstractmethod
-    def remove_image_annotations(self, id: str) -> None:
+    def release(self, ids: list[str]) -> list[str]:
         raise NOT_IMPLEMENTED_ERROR
 
 
@@ -104,6 +214,56 @@ class DemoRepository(ABC):
     def get_image_urls(self) -> list[str]:
         raise NOT_IMPLEMENTED_ERROR
 
+    @abstractmethod
+    def get_unlinked(self) -> list[Demo]:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def link(self, id: str, asset_id: str) -> None:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def fail(self, id: str) -> None:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def get_template(self) -> list[Asset]:
+        raise NOT_IMPLEMENTED_ERROR
+
+
+class ExportJobRepository(ABC):
+    @abstractmethod
+    def add(self, job: ExportJob, project_id: str, user_id: str) -> str:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def get_by_id(self, id: str, user_id: str) -> ExportJob | None:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def get_statuses(self, ids: list[str]) -> dict[str, str]:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def get_ids(self, user_ids: list[str]) -> list[str]:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def update(self, id: str, **fields: dict) -> None:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def start(self, id: str, images_total: int, at: datetime) -> bool:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def fail_stale(self, before: datetime, at: datetime) -> list[str]:
+        raise NOT_IMPLEMENTED_ERROR
+
+    @abstractmethod
+    def expire_finished(self, before: datetime) -> list[str]:
+        raise NOT_IMPLEMENTED_ERROR
+
 
 ## Implementations of the Model Repositories
 class BaseSQLAlchemyRepository:
@@ -136,6 +296,14 @@ class SQLAlchemyUserRepsitory(BaseSQLAlchemyRepository, UserRepository):
 
         return None
 
+    def get_identity(self, id: str) -> User | None:
+        """Return a user without loading its password hash."""
+        row = self._session.query(UserORM.username).filter_by(id=id).first()
+        if row:
+            return User(username=row.username, password=None, id=id)
+
+        return None
+
     def get_usernames(self) -> list[str]:
         return [
             user.username
@@ -146,6 +314,58 @@ class SQLAlchemyUserRepsitory(BaseSQLAlchemyRepository, UserRepository):
         user_orm = self._session.query(UserORM).filter_by(id=id).first()
         self._session.delete(user_orm)
 
+    def expire(self, id: str, at: datetime) -> None:
+        self._session.query(UserORM).filter_by(id=id).update({'expires_at': at})
+
+    def claim_expired(self, now: datetime, lease_until: datetime, limit: int) -> list[str]:
+        """Claim up to `limit` users that expired by `now`, oldest first.
+
+        Claimed users expire again at `lease_until`, which should be unique
+        to the caller: concurrent reapers each get the rows whose expiry they
+        moved, and the rows of a reaper that died are claimed again once its
+        lease has passed. Commit right away to make the claim visible.
+        """
+        ids = list(self._session.scalars(
+            select(UserORM.id)
+            .where(UserORM.expires_at <= now)
+            .order_by(UserORM.expires_at)
+            .limit(limit)
+        ))
+        if not ids:
+            return []
+
+        self._session.execute(
+            update(UserORM)
+            .where(UserORM.id.in_(ids), UserORM.expires_at <= now)
+            .values(expires_at=lease_until)
+            .execution_options(synchronize_session=False)
+        )
+
+        return list(self._session.scalars(
+            select(UserORM.id).where(UserORM.id.in_(ids), UserORM.expires_at == lease_until)
+        ))
+
+    def remove_many(self, ids: list[str]) -> None:
+        """Delete users with their projects and everything in them, one statement per table.
+
+        Release the references of their images to stored files first.
+        """
+        if not ids:
+            return
+
+        project_ids = select(ProjectORM.id).where(ProjectORM.user_id.in_(ids))
+        image_ids = select(ImageORM.id).where(ImageORM.project_id.in_(project_ids))
+        statements = (
+            delete(AnnotationORM).where(AnnotationORM.image_id.in_(image_ids)),
+            delete(ImageORM).where(ImageORM.project_id.in_(project_ids)),
+            delete(CategoryORM).where(CategoryORM.project_id.in_(project_ids)),
+            delete(ExportJobORM).where(or_(ExportJobORM.user_id.in_(ids), ExportJobORM.project_id.in_(project_ids))),
+            delete(ProjectORM).where(ProjectORM.user_id.in_(ids)),
+            delete(UserORM).where(UserORM.id.in_(ids))
+        )
+        for statement in statements:
+            self._session.execute(statement.execution_options(synchronize_session=False))
+
 
 class SQLAlchemyProjectRepository(BaseSQLAlchemyRepository, ProjectRepository):
     def add(self, project: Project, user_id: str) -> str:
@@ -170,41 +390,122 @@ class SQLAlchemyProjectRepository(BaseSQLAlchemyRepository, ProjectRepository):
 
     def get_project_image_names(self, id: str) -> list[str]:
         return [
-            Path(img.url).stem
-            for img in self._session.query(ImageORM).filter_by(project_id=id).all()
+            filename
+            for filename, in self._session.query(ImageORM.filename).filter_by(project_id=id)
         ]
 
+    def get_ids(self, user_ids: list[str]) -> list[str]:
+        if not user_ids:
+            return []
+
+        return list(self._session.scalars(select(ProjectORM.id).where(ProjectORM.user_id.in_(user_ids))))
+
     def get_with_relationships(self, id: str) -> Project | None:
+        """Load a project with its categories, images and annotations.
+
+        The graph is fetched with one query per table, whatever the size of
+        the project, and annotations share the `Category` objects of the
+        project instead of getting a copy each.
+        """
         project_orm = self._session.query(ProjectORM).filter_by(id=id).first()
         if project_orm is None:
             return None
 
         project = Project(**project_orm.to_dict())
-        categories = [
-            Category(**category.to_dict())
-            for category in project_orm.categories
-        ]
-
-        images = [
-            Image(**image.to_dict())
-            for image in project_orm.images
-        ]
+        categories = {
+            category_orm.id: Category(**category_orm.to_dict())
+            for category_orm in self._session.query(CategoryORM).filter_by(project_id=id)
+        }
+
+        images = {}
+        for image_orm in self._session.query(ImageORM).filter_by(project_id=id):
+            image = Image(**image_orm.to_dict())
+            image.annotations = []
+            images[image_orm.id] = image
+
+        annotation_orms = (
+            self._session.query(AnnotationORM)
+            .join(ImageORM, AnnotationORM.image_id == ImageORM.id)
+            .filter(ImageORM.project_id == id)
+        )
+
+        unresolved = []
+        for a_orm in annotation_orms:
+            annotation = Annotation(**a_orm.to_dict())
+            if a_orm.category_id in categories:
+                annotation.category = categories[a_orm.category_id]
+            else:
+                unresolved.append((annotation, a_orm.category_id))
+            images[a_orm.image_id].annotations.append(annotation)
+
+        # Annotations saved before category lookups were scoped to the project
+        # may use a category of another project
+        if unresolved:
+            foreign = {
+                category_orm.id: Category(**category_orm.to_dict())
+                for category_orm in self._session.query(CategoryORM).filter(
+                    CategoryORM.id.in_({category_id for _, category_id in unresolved})
+                )
+            }
+            for annotation, category_id in unresolved:
+                annotation.category = foreign[category_id]
+
+        project.categories = list(categories.values())
+        project.images = list(images.values())
 
-        for image, image_orm in zip(images, project_orm.images):
-            annotations = [
-                Annotation(**annotation.to_dict())
-                for annotation in image_orm.annotations
-            ]
-
-            for a, a_orm in zip(annotations, image_orm.annotations):
-                a.category = Category(**a_orm.category.to_dict())
+        return project
 
-            image.annotations = annotations
+    def get_summary(self, id: str) -> dict | None:
+        """Return a project with its categories and counts, but none of its images."""
+        project_orm = self._session.query(ProjectORM).filter_by(id=id).first()
+        if project_orm is None:
+            return None
 
-        project.categories = categories
-        project.images = images
+        project = Project(**project_orm.to_dict())
+        project.categories = [
+            Category(**category_orm.to_dict())
+            for category_orm in self._session.query(CategoryORM).filter_by(project_id=id)
+        ]
 
-        return project
+        image_counts = dict(
+            self._session.query(ImageORM.status, func.count())
+            .filter(ImageORM.project_id == id)
+            .group_by(ImageORM.status)
+            .all()
+        )
+        annotation_count = (
+            self._session.query(func.count(AnnotationORM.id))
+            .join(ImageORM, AnnotationORM.image_id == ImageORM.id)
+            .filter(ImageORM.project_id == id)
+            .scalar()
+        )
+
+        return {
+            **project.to_dict(),
+            'image_count': sum(image_counts.values()),
+            'image_status_counts': image_counts,
+            'annotation_count': annotation_count
+        }
+
+    def get_revision(self, id: str) -> int | None:
+        return self._session.query(ProjectORM.revision).filter_by(id=id).scalar()
+
+    def list_revisions(self, user_id: str) -> list[tuple[str, int]]:
+        query = (
+            self._session.query(ProjectORM.id, ProjectORM.revision)
+            .filter_by(user_id=user_id)
+            .order_by(ProjectORM.id)
+        )
+
+        return [(id, revision) for id, revision in query]
+
+    def bump_revision(self, id: str) -> None:
+        # Incremented in SQL so concurrent writers never lose a bump
+        self._session.execute(
+            update(ProjectORM)
+            .where(ProjectORM.id == id)
+            .values(revision=ProjectORM.revision + 1)
+        )
 
     def list(self, user_id: str = None) -> list[Project]:
         if user_id:
@@ -227,57 +528,110 @@ class SQLAlchemyProjectRepository(BaseSQLAlchemyRepository, ProjectRepository):
         self._session.delete(project_orm)
 
     def export_project_data(self, id: str) -> dict:
+        """Return the name, categories and ready images of a project, in COCO form.
+
+        Annotations are left out: `iter_export_annotations` streams them.
+        """
         project = {}
         project_orm = self._session.query(ProjectORM).filter_by(id=id).first()
         if project_orm:
             categories = [
-                {'id': category_orm.id, 'name': category_orm.name}
-                for category_orm in project_orm.categories
+                {'id': category_id, 'name': name}
+                for category_id, name in (
+                    self._session.query(CategoryORM.id, CategoryORM.name).filter_by(project_id=id)
+                )
             ]
 
+            # Annotations saved before category lookups were scoped to the project
+            # may use a category of another project
+            categories.extend(
+                {'id': category_id, 'name': name}
+                for category_id, name in (
+                    self._session.query(CategoryORM.id, CategoryORM.name)
+                    .join(AnnotationORM, AnnotationORM.category_id == CategoryORM.id)
+                    .join(ImageORM, AnnotationORM.image_id == ImageORM.id)
+                    .filter(ImageORM.project_id == id, ImageORM.status == 'ready', CategoryORM.project_id != id)
+                    .distinct()
+                )
+            )
+
             images = []
             image_urls = []
-            annotations = []
-            for image_orm in project_orm.images:
-                image_dict = image_orm.to_dict()
-                image_urls.append(image_dict.pop('url'))
-                images.append(image_dict)
-
-                for annotation_orm in image_orm.annotations:
-                    annotation = {
-                        'id': annotation_orm.id,
-                        'image_id': annotation_orm.image_id,
-                        'category_id': annotation_orm.category_id,
-                        'iscrowd': 0,
-                        'area': annotation_orm.width * annotation_orm.height,
-                        'bbox': [
-                            annotation_orm.x,
-                            annotation_orm.y,
-                            annotation_orm.width,
-                            annotation_orm.height
-                        ]
-                    }
-
-                    annotations.append(annotation)
+            # Uploads still in the ingest pipeline have nothing to export
+            rows = (
+                self._session.query(ImageORM.id, ImageORM.filename, ImageORM.width, ImageORM.height, ImageORM.url)
+                .filter_by(project_id=id, status='ready')
+                .order_by(ImageORM.id)
+            )
+            for row in rows:
+                images.append({'id': row.id, 'filename': row.filename, 'width': row.width, 'height': row.height})
+                image_urls.append(row.url)
 
             project.update(
                 name=project_orm.name.lower(),
                 images=images,
                 categories=categories,
-                image_urls=image_urls,
-                annotations=annotations
+                image_urls=image_urls
             )
 
         return project
 
+    def iter_export_annotations(self, id: str, batch_size: int = 1000, by_image: bool = False) -> Iterator[dict]:
+        """Stream the COCO annotations of a project's ready images.
+
+        Rows come from a server-side cursor, `batch_size` at a time, on a
+        connection of its own. The session can keep committing while the
+        stream is consumed, and the stream can be consumed after the request
+        that created it has ended. With `by_image`, the annotations of each
+        image come one after the other.
+        """
+        query = (
+            select(
+                AnnotationORM.id,
+                AnnotationORM.image_id,
+                AnnotationORM.category_id,
+                AnnotationORM.x,
+                AnnotationORM.y,
+                AnnotationORM.width,
+                AnnotationORM.height
+            )
+            .join(ImageORM, AnnotationORM.image_id == ImageORM.id)
+            .where(ImageORM.project_id == id, ImageORM.status == 'ready')
+        )
+        if by_image:
+            query = query.order_by(AnnotationORM.image_id)
+        engine = self._session.get_bind()
+
+        def annotations() -> Iterator[dict]:
+            with engine.connect() as conn:
+                for row in conn.execution_options(yield_per=batch_size).execute(query):
+                    yield {
+                        'id': row.id,
+                        'image_id': row.image_id,
+                        'category_id': row.category_id,
+                        'iscrowd': 0,
+                        'area': row.width * row.height,
+                        'bbox': [row.x, row.y, row.width, row.height]
+                    }
+
+        return annotations()
+
 
 class SQLAlchemyImageRepository(BaseSQLAlchemyRepository, ImageRepository):
-    def add(self, image: Image, project_id: str) -> str:
-        image_orm = ImageORM(project_id=project_id, **image.to_dict())
+    def add(self, image: Image, project_id: str, asset_id: str | None = None) -> str:
+        image_orm = ImageORM(project_id=project_id, asset_id=asset_id, **image.to_dict())
         self._session.add(image_orm)
 
         return image_orm.id
 
+    def add_many(self, images: list[tuple[Image, str | None]], project_id: str) -> None:
+        """Insert `(image, asset_id)` pairs in a single statement."""
+        if images:
+            self._session.execute(insert(ImageORM), [
+                {'project_id': project_id, 'asset_id': asset_id, **image.to_dict()}
+                for image, asset_id in images
+            ])
+
     def get_by_id(self, id: str) -> Image | None:
         image_orm = self._session.query(ImageORM).filter_by(id=id).first()
         if image_orm:
@@ -285,17 +639,209 @@ class SQLAlchemyImageRepository(BaseSQLAlchemyRepository, ImageRepository):
 
         return None
 
+    def page(self, project_id: str, after: str | None, limit: int) -> list[Image]:
+        """Return up to `limit` images of a project whose id sorts after `after`.
+
+        Pages are keyset ranges of `ix_images_project_id_id`, so a page costs
+        the same however deep into the project it is. Annotations are loaded
+        for the page only, in one more query.
+        """
+        query = self._session.query(ImageORM).filter(ImageORM.project_id == project_id)
+        if after is not None:
+            query = query.filter(ImageORM.id > after)
+
+        images = {}
+        for image_orm in query.order_by(ImageORM.id).limit(limit):
+            image = Image(**image_orm.to_dict())
+            image.annotations = []
+            images[image_orm.id] = image
+
+        if not images:
+            return []
+
+        categories = {}
+        annotation_rows = (
+            self._session.query(AnnotationORM, CategoryORM)
+            .join(CategoryORM, AnnotationORM.category_id == CategoryORM.id)
+            .filter(AnnotationORM.image_id.in_(images))
+        )
+        for a_orm, category_orm in annotation_rows:
+            if category_orm.id not in categories:
+                categories[category_orm.id] = Category(**category_orm.to_dict())
+
+            annotation = Annotation(**a_orm.to_dict())
+            annotation.category = categories[category_orm.id]
+            images[a_orm.image_id].annotations.append(annotation)
+
+        return list(images.values())
+
+    def get_storage_refs(
+        self,
+        ids: list[str] | None = None,
+        project_ids: list[str] | None = None
+    ) -> tuple[list[str], list[str]]:
+        """Return what the selected images hold in the image store.
+
+        That is the asset of each image that has one, repeated for every
+        image sharing it, and the URLs of the images stored before assets
+        existed, which nothing else references.
+        """
+        query = select(ImageORM.asset_id, ImageORM.url)
+        if ids is not None:
+            query = query.where(ImageORM.id.in_(ids))
+        if project_ids is not None:
+            query = query.where(ImageORM.project_id.in_(project_ids))
+
+        asset_ids = []
+        urls = []
+        for asset_id, url in self._session.execute(query):
+            if asset_id:
+                asset_ids.append(asset_id)
+            elif url:
+                urls.append(url)
+
+        return asset_ids, urls
+
+    def get_ids(self, project_id: str, ids: list[str]) -> list[str]:
+        """Return those of `ids` that are images of the project."""
+        return list(self._session.scalars(
+            select(ImageORM.id).where(ImageORM.project_id == project_id, ImageORM.id.in_(ids))
+        ))
+
+    def fail_stale(self, before: datetime) -> list[tuple[str, str]]:
+        """Fail the images pending since before `before`, returning their ids and projects."""
+        stale = (ImageORM.status == 'pending', ImageORM.updated_at < before)
+        rows = self._session.execute(select(ImageORM.id, ImageORM.project_id).where(*stale)).all()
+        if rows:
+            self._session.execute(
+                update(ImageORM)
+                .where(ImageORM.id.in_([id for id, _ in rows]), *stale)
+                .values(status='failed')
+                .execution_options(synchronize_session=False)
+            )
+
+        return [(id, project_id) for id, project_id in rows]
+
+    def remove_many(self, ids: list[str]) -> None:
+        """Delete images with their annotations, one statement per table.
+
+        Release the references of the images to stored files first.
+        """
+        if not ids:
+            return
+
+        statements = (
+            delete(AnnotationORM).where(AnnotationORM.image_id.in_(ids)),
+            delete(ImageORM).where(ImageORM.id.in_(ids))
+        )
+        for statement in statements:
+            self._session.execute(statement.execution_options(synchronize_session=False))
+
+    def list(self, project_id: str, ids: list[str] | None = None) -> list[Image]:
+        query = self._session.query(ImageORM).filter_by(project_id=project_id)
+        if ids is not None:
+            query = query.filter(ImageORM.id.in_(ids))
+
+        return [Image(**image_orm.to_dict()) for image_orm in query]
+
+    def get_project_id(self, id: str) -> str | None:
+        return self._session.query(ImageORM.project_id).filter_by(id=id).scalar()
+
+    def folder_in_use(self, folder: str) -> bool:
+        """Return whether an image, asset or demo image is stored in `folder`."""
+        pattern = f"%/{folder}/%"
+
+        return self._session.scalar(select(
+            exists().where(ImageORM.url.like(pattern))
+            | exists().where(AssetORM.url.like(pattern))
+            | exists().where(DemoORM.url.like(pattern))
+        ))
+
+    def update(self, id: str, **fields: dict) -> int:
+        return self._session.query(ImageORM).filter_by(id=id).update(fields)
+
     def remove(self, id: str) -> None:
         image_orm = self._session.query(ImageORM).filter_by(id=id).first()
         self._session.delete(image_orm)
 
-    def remove_image_annotations(self, id: str) -> None:
-        image_orm = self._session.query(ImageORM).filter_by(id=id).first()
-        if image_orm:
-            for a in image_orm.annotations:
-                self._session.delete(a)
 
-        self._session.commit()
+class SQLAlchemyAssetRepository(AssetRepository, BaseSQLAlchemyRepository):
+    def add(self, asset: Asset) -> str:
+        asset_orm = AssetORM(**asset.to_dict())
+        self._session.add(asset_orm)
+
+        return asset_orm.id
+
+    def acquire(self, digest: str) -> Asset | None:
+        """Take a reference to the asset holding `digest`, if one is stored.
+
+        The count is raised in SQL, so concurrent uploads of the same content
+        cannot lose a reference, and the row stays locked until commit
+        against a concurrent `release` of its last reference.
+        """
+        acquired = self._session.execute(
+            update(AssetORM)
+            .where(AssetORM.digest == digest)
+            .values(refcount=AssetORM.refcount + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not acquired:
+            return None
+
+        asset_orm = self._session.query(AssetORM).filter_by(digest=digest).first()
+
+        return Asset(**asset_orm.to_dict())
+
+    def _add_refs(self, ids: list[str], sign: int) -> None:
+        # One statement per distinct count, usually just one
+        by_count = {}
+        for id, count in Counter(ids).items():
+            by_count.setdefault(count, []).append(id)
+
+        for count, asset_ids in by_count.items():
+            self._session.execute(
+                update(AssetORM)
+                .where(AssetORM.id.in_(asset_ids))
+                .values(refcount=AssetORM.refcount + sign * count)
+                .execution_options(synchronize_session=False)
+            )
+
+    def retain(self, ids: list[str]) -> None:
+        """Add one reference per id, which may repeat, to assets known to exist."""
+        self._add_refs(ids, 1)
+
+    def release(self, ids: list[str]) -> list[str]:
+        """Drop one reference per id, which may repeat, and remove the assets left unused.
+
+        Returns the URLs of the removed assets, for the caller to delete from
+        the image store once the references are gone.
+        """
+        if not ids:
+            return []
+
+        self._add_refs(ids, -1)
+
+        unused = self._session.execute(
+            select(AssetORM.id, AssetORM.url)
+            .where(AssetORM.id.in_(set(ids)), AssetORM.refcount <= 0)
+        ).all()
+        if not unused:
+            return []
+
+        # Images still pointing at them are being removed by the caller
+        self._session.execute(
+            update(ImageORM)
+            .where(ImageORM.asset_id.in_([id for id, _ in unused]))
+            .values(asset_id=None)
+            .execution_options(synchronize_session=False)
+        )
+        self._session.execute(
+            delete(AssetORM)
+            .where(AssetORM.id.in_([id for id, _ in unused]))
+            .execution_options(synchronize_session=False)
+        )
+
+        return [url for _, url in unused]
 
 
 class SQLAlchemyAnnotationRepository(AnnotationRepository, BaseSQLAlchemyRepository):
@@ -305,6 +851,72 @@ class SQLAlchemyAnnotationRepository(AnnotationRepository, BaseSQLAlchemyReposit
 
         return annotation_orm.id
 
+    def sync(self, image_id: str, annotations: list[Annotation]) -> None:
+        """Make the stored annotations of an image match `annotations`.
+
+        Rows are matched by annotation id, so the image is brought up to date
+        with at most one INSERT, one UPDATE and one DELETE statement. Every
+        annotation must carry a `category` with its id resolved. Only the
+        image's own rows are changed: an id of another image's annotation is
+        stored under a new id.
+        """
+        fields = ('category_id', 'x', 'y', 'width', 'height')
+        stored = {
+            row.id: tuple(row[1:])
+            for row in self._session.execute(
+                select(AnnotationORM.id, *(getattr(AnnotationORM, f) for f in fields))
+                .where(AnnotationORM.image_id == image_id)
+            )
+        }
+
+        rows = {
+            a.id: {
+                'id': a.id,
+                'category_id': a.category.id,
+                'x': a.x,
+                'y': a.y,
+                'width': a.width,
+                'height': a.height
+            }
+            for a in annotations
+        }
+
+        new_rows = []
+        changed_rows = []
+        for id, row in rows.items():
+            if id not in stored:
+                new_rows.append({'image_id': image_id, **row})
+            elif stored[id] != tuple(row[f] for f in fields):
+                changed_rows.append(row)
+
+        removed_ids = stored.keys() - rows.keys()
+
+        if new_rows:
+            # Ids come from the client, they may belong to annotations of other images
+            taken = set(self._session.scalars(
+                select(AnnotationORM.id).where(AnnotationORM.id.in_([row['id'] for row in new_rows]))
+            ))
+            for row in new_rows:
+                if row['id'] in taken:
+                    row['id'] = str(uuid.uuid4())
+
+            self._session.execute(insert(AnnotationORM), new_rows)
+
+        if changed_rows:
+            self._session.execute(
+                update(AnnotationORM)
+                .where(AnnotationORM.image_id == image_id)
+                .execution_options(synchronize_session=None),
+                changed_rows
+            )
+
+        if removed_ids:
+            self._session.execute(
+                delete(AnnotationORM)
+                .where(AnnotationORM.image_id == image_id, AnnotationORM.id.in_(removed_ids))
+                .execution_options(synchronize_session=False)
+            )
+
 
 class SQLAlchemyCategoryRepository(CategoryRepository, BaseSQLAlchemyRepository):
     def add(self, category: Category, project_id: str) -> str:
@@ -313,13 +925,37 @@ class SQLAlchemyCategoryRepository(CategoryRepository, BaseSQLAlchemyRepository)
 
         return category_orm.id
 
-    def get(self, name: str) -> Category | None:
-        category_orm = self._session.query(CategoryORM).filter_by(name=name).first()
+    def get(self, name: str, project_id: str) -> Category | None:
+        category_orm = self._session.query(CategoryORM).filter_by(project_id=project_id, name=name).first()
         if category_orm:
             return Category(**category_orm.to_dict())
 
         return None
 
+    def get_or_add_many(self, categories: list[Category], project_id: str) -> dict[str, Category]:
+        """Resolve categories of a project by name, adding the missing ones in bulk."""
+        if not categories:
+            return {}
+
+        names = [category.name for category in categories]
+        resolved = {
+            category_orm.name: Category(**category_orm.to_dict())
+            for category_orm in self._session.query(CategoryORM).filter(
+                CategoryORM.project_id == project_id,
+                CategoryORM.name.in_(names)
+            )
+        }
+
+        missing = [category for category in categories if category.name not in resolved]
+        if missing:
+            self._session.execute(insert(CategoryORM), [
+                {'project_id': project_id, **category.to_dict()}
+                for category in missing
+            ])
+            resolved.update((category.name, category) for category in missing)
+
+        return resolved
+
 
 class SQLAlchemyDemoRepository(DemoRepository, BaseSQLAlchemyRepository):
     def get_image_urls(self) -> list[str]:
@@ -327,3 +963,100 @@ class SQLAlchemyDemoRepository(DemoRepository, BaseSQLAlchemyRepository):
             demo.url
             for demo in self._session.query(DemoORM).all()
         ]
+
+    def get_unlinked(self) -> list[Demo]:
+        """Return the demo images that are neither assets yet nor known to be unreadable."""
+        query = self._session.query(DemoORM.id, DemoORM.url).filter(
+            DemoORM.asset_id.is_(None),
+            DemoORM.failed_at.is_(None)
+        )
+
+        return [Demo(url, id=id) for id, url in query]
+
+    def link(self, id: str, asset_id: str) -> None:
+        self._session.query(DemoORM).filter_by(id=id).update({'asset_id': asset_id})
+
+    def fail(self, id: str) -> None:
+        self._session.query(DemoORM).filter_by(id=id).update({'failed_at': datetime.now()})
+
+    def get_template(self) -> list[Asset]:
+        """Return the assets of the demo images, one per image, in a stable order."""
+        query = (
+            self._session.query(AssetORM)
+            .join(DemoORM, DemoORM.asset_id == AssetORM.id)
+            .order_by(DemoORM.id)
+        )
+
+        return [Asset(**asset_orm.to_dict()) for asset_orm in query]
+
+
+class SQLAlchemyExportJobRepository(ExportJobRepository, BaseSQLAlchemyRepository):
+    def add(self, job: ExportJob, project_id: str, user_id: str) -> str:
+        job_orm = ExportJobORM(project_id=project_id, user_id=user_id, **job.to_dict())
+        self._session.add(job_orm)
+
+        return job_orm.id
+
+    def get_by_id(self, id: str, user_id: str) -> ExportJob | None:
+        job_orm = self._session.query(ExportJobORM).filter_by(id=id, user_id=user_id).first()
+        if job_orm:
+            return ExportJob(**job_orm.to_dict())
+
+        return None
+
+    def get_statuses(self, ids: list[str]) -> dict[str, str]:
+        if not ids:
+            return {}
+
+        return dict(self._session.execute(
+            select(ExportJobORM.id, ExportJobORM.status).where(ExportJobORM.id.in_(ids))
+        ).all())
+
+    def get_ids(self, user_ids: list[str]) -> list[str]:
+        if not user_ids:
+            return []
+
+        return list(self._session.scalars(select(ExportJobORM.id).where(ExportJobORM.user_id.in_(user_ids))))
+
+    def update(self, id: str, **fields: dict) -> None:
+        self._session.query(ExportJobORM).filter_by(id=id).update(fields)
+
+    def start(self, id: str, images_total: int, at: datetime) -> bool:
+        """Move a queued job to running, or return False if it is not queued anymore."""
+        return bool(
+            self._session.query(ExportJobORM)
+            .filter_by(id=id, status='queued')
+            .update({'status': 'running', 'images_total': images_total, 'started_at': at})
+        )
+
+    def fail_stale(self, before: datetime, at: datetime) -> list[str]:
+        """Fail the queued and running jobs that have not been updated since `before`.
+
+        Their worker went away: running jobs save their progress every
+        second, and queued jobs only wait for one of a worker's runners.
+        """
+        stale = (ExportJobORM.status.in_(('queued', 'running')), ExportJobORM.updated_at < before)
+        ids = list(self._session.scalars(select(ExportJobORM.id).where(*stale)))
+        if ids:
+            self._session.execute(
+                update(ExportJobORM)
+                .where(ExportJobORM.id.in_(ids), *stale)
+                .values(status='failed', error='Export was interrupted', finished_at=at)
+                .execution_options(synchronize_session=False)
+            )
+
+        return ids
+
+    def expire_finished(self, before: datetime) -> list[str]:
+        """Mark the jobs that finished before `before` expired, returning their ids."""
+        expired = (ExportJobORM.status == 'done', ExportJobORM.finished_at < before)
+        ids = list(self._session.scalars(select(ExportJobORM.id).where(*expired)))
+        if ids:
+            self._session.execute(
+                update(ExportJobORM)
+                .where(ExportJobORM.id.in_(ids), *expired)
+                .values(status='expired')
+                .execution_options(synchronize_session=False)
+            )
+
+        return ids
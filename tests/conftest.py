@@ -0,0 +1,28 @@
+import pytest
+
+from flask_app import create_app
+from storage.orm import db
+
+
+@pytest.fixture
+def app():
+    app = create_app('test')
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def query_counter(app):
+    """Collect the statements sent to the database while the test runs."""
+    from sqlalchemy import event
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    yield statements
+    event.remove(db.engine, 'before_cursor_execute', count)
@@ -0,0 +1,98 @@
+import asyncio
+
+from flask import Flask, Response, request
+from flask_app.asgi import AsgiApp, Prepended, serving_async
+from utils import ImageUtil
+
+
+def asgi_request(application: AsgiApp, method: str, path: str, chunks: list[bytes]) -> tuple[int, bytes]:
+    """Run a lifespan and one request through `application`, sending the body in `chunks`."""
+    async def run() -> tuple[int, bytes]:
+        lifespan = asyncio.Queue()
+        lifespan_sent = []
+
+        async def lifespan_send(message):
+            lifespan_sent.append(message['type'])
+
+        lifespan_task = asyncio.create_task(application({'type': 'lifespan'}, lifespan.get, lifespan_send))
+        await lifespan.put({'type': 'lifespan.startup'})
+
+        incoming = [
+            {'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+            for i, chunk in enumerate(chunks)
+        ]
+        sent = []
+
+        async def receive():
+            return incoming.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': method,
+            'path': path,
+            'query_string': b'',
+            'headers': [(b'content-type', b'application/octet-stream')]
+        }
+        await application(scope, receive, send)
+
+        await lifespan.put({'type': 'lifespan.shutdown'})
+        await lifespan_task
+        assert lifespan_sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+
+        return sent[0]['status'], b''.join(message.get('body', b'') for message in sent[1:])
+
+    return asyncio.run(run())
+
+
+def test_views_run_in_threads_and_async_bodies_on_the_loop():
+    app = Flask(__name__)
+    app.config['ASGI_THREADS'] = 2
+
+    async def countdown():
+        for i in range(3, 0, -1):
+            await asyncio.sleep(0)
+            yield str(i).encode()
+
+    @app.route('/echo', methods=['POST'])
+    def echo():
+        return Response(chunk for chunk in [request.get_data(), b'!'])
+
+    @app.route('/countdown')
+    def count():
+        assert serving_async()
+        return Response(countdown())
+
+    application = AsgiApp(app, ImageUtil())
+
+    assert asgi_request(application, 'POST', '/echo', [b'ab', b'', b'cd']) == (200, b'abcd!')
+    assert asgi_request(application, 'GET', '/countdown', [b'']) == (200, b'321')
+    assert asgi_request(application, 'GET', '/missing', [b''])[0] == 404
+
+
+def test_async_bodies_left_unsent_are_closed():
+    app = Flask(__name__)
+    app.config['ASGI_THREADS'] = 2
+    closed = []
+
+    async def download():
+        try:
+            yield b'first'
+            yield b'second'
+        finally:
+            closed.append(True)
+
+    @app.route('/download', methods=['GET'])
+    def fetch():
+        # Started by the view, as the export starts its downloads
+        rest = download()
+        return Response(Prepended(application.img_util.run(rest.__anext__()), rest))
+
+    application = AsgiApp(app, ImageUtil())
+
+    assert asgi_request(application, 'GET', '/download', [b'']) == (200, b'firstsecond')
+    assert asgi_request(application, 'HEAD', '/download', [b'']) == (200, b'')
+    assert closed == [True, True]
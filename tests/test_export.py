@@ -0,0 +1,182 @@
+import asyncio
+import io
+import json
+import zipfile
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask_app.export import (
+    CocoExporter,
+    VocExporter,
+    YoloExporter,
+    async_stream_export_archive,
+    iter_coco_json,
+    stream_export_archive
+)
+from flask_app import export_jobs
+from src.model import User, Project, Image, Annotation, Category, ExportJob
+from storage import user_repo, project_repo, image_repo, annotation_repo, category_repo, export_job_repo, get_db_session
+from storage.orm import ExportJobORM
+
+PROJECT = {
+    'images': [{'id': 'image-1', 'filename': 'image-abcde', 'width': 640.0, 'height': 480.0}],
+    'categories': [{'id': 'category-1', 'name': 'car\nbus'}]
+}
+ANNOTATIONS = [
+    {'id': f"annotation-{i}", 'image_id': 'image-1', 'category_id': 'category-1', 'iscrowd': 0, 'area': 4.0, 'bbox': [1.0, 2.0, 2.0, 2.0]}
+    for i in range(3)
+]
+
+
+def test_iter_coco_json_matches_json_dumps():
+    for annotations in (ANNOTATIONS, []):
+        document = {**PROJECT, 'annotations': annotations}
+
+        assert ''.join(iter_coco_json(PROJECT, iter(annotations))) == json.dumps(document, indent=2)
+
+
+def test_iter_coco_json_compact():
+    document = {**PROJECT, 'annotations': ANNOTATIONS}
+
+    assert ''.join(iter_coco_json(PROJECT, iter(ANNOTATIONS), compact=True)) == json.dumps(document, separators=(',', ':'))
+
+
+def test_yolo_labels_are_normalized_and_ordered():
+    project = {
+        'images': [*PROJECT['images'], {'id': 'image-2', 'filename': 'empty.png', 'width': 10.0, 'height': 10.0}],
+        'categories': [{'id': 'category-0', 'name': 'bus'}, {'id': 'category-1', 'name': 'car'}]
+    }
+    images = iter([(1, b'empty'), (0, b'image')])
+
+    with ThreadPoolExecutor(2) as executor:
+        exporter = YoloExporter(executor)
+        exporter.BATCH_SIZE = 1
+        archive = b''.join(stream_export_archive(project, images, iter(ANNOTATIONS), exporter))
+
+    with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+        assert zip_file.namelist() == [
+            'images/empty.png', 'images/image-abcde', 'classes.txt', 'data.yaml',
+            'labels/image-abcde.txt', 'labels/empty.txt'
+        ]
+        assert zip_file.read('classes.txt') == b'bus\ncar\n'
+        assert zip_file.read('labels/image-abcde.txt') == b'1 0.003125 0.006250 0.003125 0.004167\n' * 3
+        assert zip_file.read('labels/empty.txt') == b''
+
+
+def test_voc_annotation_escapes_names():
+    image = {'id': 'image-1', 'filename': 'a&b.jpg', 'width': 640.0, 'height': 480.0}
+    xml = VocExporter(None).render(image, ANNOTATIONS[:1], {'category-1': '<car>'}).decode()
+
+    assert '<filename>a&amp;b.jpg</filename>' in xml
+    assert '<name>&lt;car&gt;</name>' in xml
+    assert '<xmin>1</xmin>' in xml and '<ymax>4</ymax>' in xml
+
+
+def test_async_archive_matches_sync_archive():
+    async def images():
+        yield 0, b'image'
+
+    async def collect() -> bytes:
+        archive = async_stream_export_archive(PROJECT, images(), iter(ANNOTATIONS), CocoExporter())
+        return b''.join([chunk async for chunk in archive])
+
+    expected = b''.join(stream_export_archive(PROJECT, iter([(0, b'image')]), iter(ANNOTATIONS), CocoExporter()))
+
+    with zipfile.ZipFile(io.BytesIO(asyncio.run(collect()))) as zip_file, \
+            zipfile.ZipFile(io.BytesIO(expected)) as expected_file:
+        assert zip_file.namelist() == expected_file.namelist()
+        assert all(zip_file.read(name) == expected_file.read(name) for name in zip_file.namelist())
+
+
+def test_annotations_written_after_the_snapshot_are_left_out(app):
+    user_id = user_repo.add(User(username='exporter', password='password'))
+    project_id = project_repo.add(Project(name='RACED'), user_id)
+    car_id = category_repo.add(Category(name='car', color='red'), project_id)
+    image_id = image_repo.add(Image('http://img/0.jpg', 640, 480, 'image-0'), project_id)
+    pending_id = image_repo.add(Image('', 0, 0, 'image-1', status='pending'), project_id)
+    annotation_repo.add(Annotation(1, 2, 3, 4), image_id, car_id)
+    get_db_session().commit()
+
+    project = project_repo.export_project_data(project_id)
+    project.pop('name')
+    project.pop('image_urls')
+
+    # While the images download, an upload finishes and a new category is used
+    image_repo.update(pending_id, status='ready', url='http://img/1.jpg', width=640, height=480)
+    annotation_repo.add(Annotation(5, 6, 7, 8), pending_id, car_id)
+    bus_id = category_repo.add(Category(name='bus', color='blue'), project_id)
+    annotation_repo.add(Annotation(9, 9, 9, 9), image_id, bus_id)
+    get_db_session().commit()
+
+    for exporter in (CocoExporter(), YoloExporter(ThreadPoolExecutor(2))):
+        annotations = project_repo.iter_export_annotations(project_id, by_image=exporter.by_image)
+        archive = b''.join(stream_export_archive(project, iter([(0, b'image')]), annotations, exporter))
+
+        with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+            if isinstance(exporter, CocoExporter):
+                coco = json.loads(zip_file.read('annotations.json'))
+                assert [a['bbox'] for a in coco['annotations']] == [[1, 2, 3, 4]]
+            else:
+                assert zip_file.read('labels/image-0.txt').count(b'\n') == 1
+                assert 'labels/image-1.txt' not in zip_file.namelist()
+
+
+def test_annotations_using_a_category_of_another_project_are_exported(app):
+    user_id = user_repo.add(User(username='legacy', password='password'))
+    project_id = project_repo.add(Project(name='LEGACY'), user_id)
+    other_id = project_repo.add(Project(name='OWNER'), user_id)
+    car_id = category_repo.add(Category(name='car', color='red'), project_id)
+    bus_id = category_repo.add(Category(name='bus', color='blue'), other_id)
+    image_id = image_repo.add(Image('http://img/0.jpg', 640, 480, 'image-0'), project_id)
+    annotation_repo.add(Annotation(1, 2, 3, 4), image_id, car_id)
+    annotation_repo.add(Annotation(5, 6, 7, 8), image_id, bus_id)
+    get_db_session().commit()
+
+    project = project_repo.export_project_data(project_id)
+    assert sorted(category['name'] for category in project['categories']) == ['bus', 'car']
+
+    for exporter in (CocoExporter(), YoloExporter(ThreadPoolExecutor(2)), VocExporter(ThreadPoolExecutor(2))):
+        annotations = project_repo.iter_export_annotations(project_id, by_image=exporter.by_image)
+        archive = b''.join(stream_export_archive(project, iter([(0, b'image')]), annotations, exporter))
+
+        with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+            if isinstance(exporter, CocoExporter):
+                coco = json.loads(zip_file.read('annotations.json'))
+                assert sorted(a['bbox'] for a in coco['annotations']) == [[1, 2, 3, 4], [5, 6, 7, 8]]
+            elif isinstance(exporter, YoloExporter):
+                assert zip_file.read('labels/image-0.txt').count(b'\n') == 2
+            else:
+                assert zip_file.read('Annotations/image-0.xml').count(b'<object>') == 2
+
+def test_sweep_fails_interrupted_jobs_and_deletes_files_of_no_job(app, tmp_path):
+    app.config['EXPORT_DIR'] = str(tmp_path)
+    user_id = user_repo.add(User(username='sweeper', password='password'))
+    project_id = project_repo.add(Project(name='SWEPT'), user_id)
+    now = datetime.now()
+    jobs = {
+        'interrupted': ExportJob('a.zip', status='running'),
+        'queued': ExportJob('b.zip'),
+        'old': ExportJob('c.zip', status='done', finished_at=now - timedelta(days=2)),
+        'done': ExportJob('d.zip', status='done', finished_at=now)
+    }
+    for job in jobs.values():
+        export_job_repo.add(job, project_id, user_id)
+    get_db_session().commit()
+    get_db_session().query(ExportJobORM).filter_by(id=jobs['interrupted'].id).update(
+        {'updated_at': now - timedelta(hours=1)}
+    )
+    get_db_session().commit()
+
+    for name, suffix in (('interrupted', '.part'), ('queued', '.part'), ('old', '.zip'), ('done', '.zip')):
+        (tmp_path / f"{jobs[name].id}{suffix}").write_bytes(b'zip')
+    (tmp_path / 'deleted-job.zip').write_bytes(b'zip')
+
+    assert export_jobs.sweep() == (1, 1)
+
+    statuses = export_job_repo.get_statuses([job.id for job in jobs.values()])
+    assert [statuses[job.id] for job in jobs.values()] == ['failed', 'queued', 'expired', 'done']
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        [f"{jobs['queued'].id}.part", f"{jobs['done'].id}.zip"]
+    )
+    # A job failed while it waited is not started anymore
+    assert not export_job_repo.start(jobs['interrupted'].id, 1, now)
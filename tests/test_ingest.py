@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask_app import ingest
+from flask_app.ingest import UploadQueue
+from src.model import User, Project, Image
+from storage import user_repo, project_repo, image_repo, get_db_session
+from storage.orm import ImageORM
+
+
+class RecordingPipeline:
+    def __init__(self) -> None:
+        self.executor = ThreadPoolExecutor(8)
+        self.running = 0
+        self.peak = 0
+        self.done = []
+        self.gate = threading.Event()
+        self._lock = threading.Lock()
+
+    def _run(self, image_id: str, *args: tuple) -> None:
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        self.gate.wait()
+        time.sleep(0.001)
+        with self._lock:
+            self.running -= 1
+            self.done.append(image_id)
+        if image_id == 'image-3':
+            raise RuntimeError('upload failed')
+
+
+def test_upload_queue_bounds_the_uploads_of_a_request_without_blocking():
+    pipeline = RecordingPipeline()
+    uploads = UploadQueue(pipeline, concurrency=2)
+
+    # Returns while every upload is held back
+    for i in range(10):
+        uploads.put(f"image-{i}", 'image', 'image/png', 'FLASK/P', 'digest')
+    pipeline.gate.set()
+
+    pipeline.executor.shutdown(wait=True)
+    assert pipeline.peak == 2
+    assert sorted(pipeline.done) == sorted(f"image-{i}" for i in range(10))
+
+
+def test_sweep_fails_images_left_pending_and_deletes_old_spool_files(app, tmp_path):
+    app.config['INGEST_DIR'] = str(tmp_path)
+    user_id = user_repo.add(User(username='uploader', password='password'))
+    project_id = project_repo.add(Project(name='UPLOADS'), user_id)
+    stale_id = image_repo.add(Image('', 0, 0, 'image-0', status='pending'), project_id)
+    fresh_id = image_repo.add(Image('', 0, 0, 'image-1', status='pending'), project_id)
+    get_db_session().commit()
+    an_hour_ago = datetime.now() - timedelta(hours=1)
+    get_db_session().query(ImageORM).filter_by(id=stale_id).update({'updated_at': an_hour_ago})
+    get_db_session().commit()
+
+    for image_id in (stale_id, fresh_id):
+        (tmp_path / image_id).write_bytes(b'png')
+    os.utime(tmp_path / stale_id, (an_hour_ago.timestamp(), an_hour_ago.timestamp()))
+
+    assert ingest.sweep() == 1
+
+    assert [image.status for image in image_repo.list(project_id, [stale_id])] == ['failed']
+    assert [image.status for image in image_repo.list(project_id, [fresh_id])] == ['pending']
+    assert [path.name for path in tmp_path.iterdir()] == [fresh_id]
+    assert project_repo.get_revision(project_id) == 2
@@ -0,0 +1,52 @@
+import io
+import pytest
+
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.test import encode_multipart
+from flask_app.multipart import MultipartReader
+
+
+def multipart_reader(values: MultiDict, **kwargs) -> MultipartReader:
+    boundary, body = encode_multipart(values)
+    return MultipartReader(io.BytesIO(body), boundary.encode('latin-1'), **kwargs)
+
+
+def test_parts_are_read_incrementally_in_order():
+    first = bytes(range(256)) * 40
+    second = b'\r\n--not-the-boundary\r\n' * 100
+    reader = multipart_reader(MultiDict([
+        ('name', 'cats'),
+        ('classes', '{"cat": "#fff"}'),
+        ('a', FileStorage(io.BytesIO(first), 'a.png', content_type='image/png')),
+        ('b', FileStorage(io.BytesIO(second), 'b.jpg', content_type='image/jpeg')),
+        ('c', FileStorage(io.BytesIO(b'skipped'), 'c.png', content_type='image/png'))
+    ]), read_size=7)
+
+    assert reader.fields() == {'name': 'cats', 'classes': '{"cat": "#fff"}'}
+
+    files = reader.files()
+    a = next(files)
+    assert (a.filename, a.mimetype) == ('a.png', 'image/png')
+    assert a.read() == first
+
+    # A part left partly read is skipped, and cannot be read any further
+    b = next(files)
+    assert b.read(10) == second[:10]
+    c = next(files)
+    assert b.read() == b''
+    assert (c.filename, c.read()) == ('c.png', b'skipped')
+    assert next(files, None) is None
+
+
+def test_limits_and_invalid_bodies():
+    reader = multipart_reader(MultiDict([('name', 'x' * 100)]), max_field_size=50)
+    with pytest.raises(RequestEntityTooLarge):
+        reader.fields()
+
+    boundary, body = encode_multipart(MultiDict([
+        ('a', FileStorage(io.BytesIO(b'data' * 100), 'a.png', content_type='image/png'))
+    ]))
+    reader = MultipartReader(io.BytesIO(body[:-60]), boundary.encode('latin-1'))
+    with pytest.raises(BadRequest):
+        [part.read() for part in reader.files()]
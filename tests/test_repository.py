@@ -0,0 +1,254 @@
+from datetime import datetime, timedelta
+from src.model import User, Project, Image, Annotation, Category, Asset, Demo
+from storage import user_repo, project_repo, image_repo, annotation_repo, category_repo, asset_repo, demo_repo, get_db_session
+from storage.orm import DemoORM
+
+
+def seed_project(name: str, n_images: int, n_boxes: int) -> str:
+    user_id = user_repo.add(User(username=f"user-{name}", password='password'))
+    project_id = project_repo.add(Project(name=name), user_id)
+    category_ids = [
+        category_repo.add(Category(name=category, color='red'), project_id)
+        for category in ('car', 'bus')
+    ]
+
+    for i in range(n_images):
+        image_id = image_repo.add(Image(f"http://img/{name}/{i}.jpg", 640, 480, f"image-{i}"), project_id)
+        for j in range(n_boxes):
+            annotation = Annotation(j, j, 10, 10)
+            annotation_repo.add(annotation, image_id, category_ids[j % 2])
+
+    get_db_session().commit()
+    get_db_session().expire_all()
+
+    return project_id
+
+
+def test_get_with_relationships_loads_full_graph(app):
+    project_id = seed_project('SMALL', n_images=3, n_boxes=4)
+
+    project = project_repo.get_with_relationships(project_id)
+
+    assert len(project.images) == 3
+    assert len(project.categories) == 2
+    assert all(len(image.annotations) == 4 for image in project.images)
+    assert {a.category.name for a in project.images[0].annotations} == {'car', 'bus'}
+
+
+def test_get_with_relationships_shares_categories(app):
+    project_id = seed_project('SHARED', n_images=2, n_boxes=4)
+
+    project = project_repo.get_with_relationships(project_id)
+
+    categories = {id(c) for c in project.categories}
+    assert all(id(a.category) in categories for image in project.images for a in image.annotations)
+
+
+def test_get_with_relationships_resolves_categories_of_other_projects(app):
+    project_id = seed_project('LEGACY', n_images=1, n_boxes=0)
+    other_id = seed_project('OWNER', n_images=0, n_boxes=0)
+    image_id = image_repo.list(project_id)[0].id
+    annotation_repo.add(Annotation(1, 1, 5, 5), image_id, category_repo.get('bus', other_id).id)
+    get_db_session().commit()
+
+    project = project_repo.get_with_relationships(project_id)
+
+    [annotation] = project.images[0].annotations
+    assert annotation.category.name == 'bus'
+    assert annotation.category not in project.categories
+
+
+def test_get_with_relationships_query_count_is_constant(app, query_counter):
+    small_id = seed_project('SMALL', n_images=2, n_boxes=2)
+    large_id = seed_project('LARGE', n_images=40, n_boxes=10)
+
+    query_counter.clear()
+    project_repo.get_with_relationships(small_id)
+    small_queries = len(query_counter)
+
+    get_db_session().expire_all()
+    query_counter.clear()
+    project_repo.get_with_relationships(large_id)
+
+    assert len(query_counter) == small_queries
+
+
+def test_get_with_relationships_unknown_project(app):
+    assert project_repo.get_with_relationships('missing') is None
+
+
+def test_page_walks_every_image_once(app):
+    project_id = seed_project('PAGED', n_images=7, n_boxes=2)
+
+    seen = []
+    after = None
+    while True:
+        page = image_repo.page(project_id, after, 3)
+        if not page:
+            break
+
+        assert all(len(image.annotations) == 2 for image in page)
+        seen.extend(image.id for image in page)
+        after = page[-1].id
+
+    assert len(seen) == 7
+    assert seen == sorted(set(seen))
+
+
+def test_get_summary_counts_without_images(app):
+    project_id = seed_project('SUMMARY', n_images=3, n_boxes=4)
+
+    summary = project_repo.get_summary(project_id)
+
+    assert 'images' not in summary
+    assert len(summary['categories']) == 2
+    assert summary['image_count'] == 3
+    assert summary['image_status_counts'] == {'ready': 3}
+    assert summary['annotation_count'] == 12
+
+
+def test_bump_revision_increments_in_sql(app):
+    project_id = seed_project('REVISED', n_images=1, n_boxes=0)
+    assert project_repo.get_revision(project_id) == 1
+
+    project_repo.bump_revision(project_id)
+    project_repo.bump_revision(project_id)
+    get_db_session().commit()
+
+    assert project_repo.get_revision(project_id) == 3
+    assert project_repo.list_revisions(user_repo.get('user-REVISED').id) == [(project_id, 3)]
+
+
+def test_assets_are_released_with_their_last_image(app):
+    project_id = seed_project('ASSETS', n_images=1, n_boxes=0)
+    asset_id = asset_repo.add(Asset('d' * 64, 'http://img/shared.jpg', 640, 480, refcount=2))
+    for i in range(2):
+        image_repo.add(Image('http://img/shared.jpg', 640, 480, f"copy-{i}"), project_id, asset_id)
+    get_db_session().commit()
+
+    assert asset_repo.acquire('e' * 64) is None
+    assert asset_repo.acquire('d' * 64).refcount == 3
+
+    asset_ids, urls = image_repo.get_storage_refs(project_ids=[project_id])
+    assert asset_ids == [asset_id, asset_id]
+    assert urls == ['http://img/ASSETS/0.jpg']
+
+    # One reference is left after dropping two of three
+    assert asset_repo.release(asset_ids) == []
+    assert asset_repo.release([asset_id]) == ['http://img/shared.jpg']
+    assert asset_repo.acquire('d' * 64) is None
+
+
+def test_demo_clones_share_the_template_assets(app):
+    project_id = seed_project('DEMO', n_images=0, n_boxes=0)
+    get_db_session().add(DemoORM(**Demo('http://img/demo.jpg').to_dict()))
+    [demo] = demo_repo.get_unlinked()
+    asset_id = asset_repo.add(Asset('f' * 64, demo.url, 640, 480))
+    demo_repo.link(demo.id, asset_id)
+    get_db_session().commit()
+
+    assert demo_repo.get_unlinked() == []
+    template = demo_repo.get_template()
+    image_repo.add_many([(Image(asset.url, asset.width, asset.height, 'clone'), asset.id) for asset in template], project_id)
+    asset_repo.retain([asset.id for asset in template])
+    get_db_session().commit()
+
+    # The template keeps its reference once the clone is gone
+    asset_ids, _ = image_repo.get_storage_refs(project_ids=[project_id])
+    assert asset_ids == [asset_id]
+    assert asset_repo.release(asset_ids) == []
+    assert asset_repo.acquire('f' * 64).refcount == 2
+
+
+def test_failed_demo_images_are_not_fetched_again(app):
+    for url in ('http://img/demo.jpg', 'http://img/broken.jpg'):
+        get_db_session().add(DemoORM(**Demo(url).to_dict()))
+    broken = next(demo for demo in demo_repo.get_unlinked() if demo.url.endswith('broken.jpg'))
+    demo_repo.fail(broken.id)
+    get_db_session().commit()
+
+    assert [demo.url for demo in demo_repo.get_unlinked()] == ['http://img/demo.jpg']
+    assert demo_repo.get_template() == []
+
+def test_expired_users_are_claimed_once_and_removed_with_their_projects(app):
+    project_id = seed_project('EXPIRED', n_images=2, n_boxes=3)
+    user_id = user_repo.get('user-EXPIRED').id
+    seed_project('LIVE', n_images=1, n_boxes=1)
+    now = datetime.now()
+    user_repo.expire(user_id, now - timedelta(seconds=1))
+    get_db_session().commit()
+
+    lease_until = now + timedelta(seconds=600)
+    assert user_repo.claim_expired(now, lease_until, 10) == [user_id]
+    assert user_repo.claim_expired(now, lease_until + timedelta(microseconds=1), 10) == []
+    assert project_repo.get_ids([user_id]) == [project_id]
+
+    user_repo.remove_many([user_id])
+    get_db_session().commit()
+
+    assert user_repo.get_by_id(user_id) is None
+    assert project_repo.get_by_id(project_id) is None
+    assert image_repo.list(project_id) == []
+    assert len(project_repo.get_with_relationships(project_repo.get('LIVE').id).images) == 1
+
+
+def test_remove_many_deletes_images_with_their_annotations(app, query_counter):
+    project_id = seed_project('PRUNED', n_images=4, n_boxes=3)
+    other_id = seed_project('KEPT', n_images=1, n_boxes=3)
+    image_ids = [image.id for image in image_repo.list(project_id)]
+    other_image_id = image_repo.list(other_id)[0].id
+
+    ids = image_repo.get_ids(project_id, image_ids[:3] + [other_image_id, 'missing'])
+    assert sorted(ids) == sorted(image_ids[:3])
+
+    query_counter.clear()
+    image_repo.remove_many(ids)
+    get_db_session().commit()
+    assert len([s for s in query_counter if s.startswith('DELETE')]) == 2
+
+    assert [image.id for image in image_repo.list(project_id)] == image_ids[3:]
+    assert project_repo.get_summary(project_id)['annotation_count'] == 3
+    assert project_repo.get_summary(other_id)['annotation_count'] == 3
+
+
+def test_sync_diffs_against_the_image_rows_only(app, query_counter):
+    project_id = seed_project('SYNCED', n_images=2, n_boxes=3)
+    image, other = image_repo.list(project_id)
+    graph = {i.id: i for i in project_repo.get_with_relationships(project_id).images}
+    foreign_id = graph[other.id].annotations[0].id
+
+    kept, changed, _ = sorted(graph[image.id].annotations, key=lambda a: a.id)
+    changed.x = 99
+    added = [Annotation(1, 2, 3, 4), Annotation(5, 6, 7, 8, id=foreign_id)]
+    for annotation in added:
+        annotation.category = category_repo.get('car', project_id)
+
+    query_counter.clear()
+    annotation_repo.sync(image.id, [kept, changed, *added])
+    get_db_session().commit()
+    writes = [s.split()[0] for s in query_counter if not s.startswith('SELECT')]
+    assert sorted(writes) == ['DELETE', 'INSERT', 'UPDATE']
+
+    graph = {i.id: i for i in project_repo.get_with_relationships(project_id).images}
+    rows = {a.id: (a.x, a.y) for a in graph[image.id].annotations}
+    assert len(rows) == 4
+    assert rows[kept.id] == (kept.x, kept.y)
+    assert rows[changed.id] == (99, changed.y)
+    assert foreign_id not in rows and (5, 6) in rows.values()
+    # The other image keeps its annotation
+    assert foreign_id in {a.id for a in graph[other.id].annotations}
+
+
+def test_get_or_add_many_adds_only_missing_categories_of_the_project(app, query_counter):
+    project_id = seed_project('NAMED', n_images=0, n_boxes=0)
+    other_id = seed_project('OTHER', n_images=0, n_boxes=0)
+
+    query_counter.clear()
+    resolved = category_repo.get_or_add_many([Category('car', 'blue'), Category('van', 'green')], project_id)
+    get_db_session().commit()
+
+    assert len([s for s in query_counter if s.startswith('INSERT')]) == 1
+    assert resolved['car'].id == category_repo.get('car', project_id).id
+    assert resolved['car'].id != category_repo.get('car', other_id).id
+    assert resolved['van'].id == category_repo.get('van', project_id).id
+    assert category_repo.get('van', other_id) is None
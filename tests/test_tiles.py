@@ -0,0 +1,22 @@
+import json
+
+from PIL import Image as PILImage
+from flask_app.tiles import TileService, build_pyramid
+
+
+def test_build_pyramid_levels_and_tiles(tmp_path):
+    source = tmp_path / 'source.png'
+    PILImage.new('RGB', (600, 300), (10, 20, 30)).save(source)
+    target = tmp_path / 'pyramid'
+
+    info = build_pyramid(str(source), str(target), tile_size=256, thumbnail_size=64, quality=80)
+
+    assert info['levels'] == [[150, 75], [300, 150], [600, 300]]
+    assert json.loads((target / 'info.json').read_text()) == info
+    assert sorted(p.name for p in (target / '2').iterdir()) == ['0_0.jpg', '0_1.jpg', '1_0.jpg', '1_1.jpg', '2_0.jpg', '2_1.jpg']
+    assert PILImage.open(target / '2' / '2_1.jpg').size == (88, 44)
+    assert PILImage.open(target / 'thumbnail.jpg').size == (64, 32)
+
+    tiles = TileService(None)
+    assert tiles.level_for(info, 200, 100) == 1
+    assert tiles.level_for(info, 2000, 100) == 2
@@ -1,27 +1,25 @@
-import cloudinary
-import cloudinary.uploader
-import cloudinary.api
 import os
 import logging
 import string
 import random
 import asyncio
-import hashlib
-import time
 import httpx
+import atexit
+import contextlib
+import contextvars
+import threading
+
+from typing import AsyncIterator, Iterator, TypeVar
 
 from src.model import Image
+from storage.image_store import ImageStore, CloudinaryImageStore, create_image_store
+from storage.image_cache import ImageCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Cloudinary configuration
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-)
+T = TypeVar('T')
 
 
 def generate_unique_name(str_list: list[str], affix: str) -> str:
@@ -33,82 +31,266 @@ def generate_unique_name(str_list: list[str], affix: str) -> str:
     return random_name
 
 
+def file_size(content) -> int:
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        return len(content)
+
+    try:
+        return os.fstat(content.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        # In-memory streams
+        return len(content.getbuffer()) if hasattr(content, 'getbuffer') else 0
+
+
+async def iterate_in_thread(iterator: Iterator[T], maxsize: int = 4) -> AsyncIterator[T]:
+    """Yield the items of a blocking iterator on the event loop.
+
+    The iterator is driven from a single worker thread, since database
+    cursors must stay on the thread that opened them, and at most
+    `maxsize` items are read ahead of the consumer.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize)
+    stopped = threading.Event()
+    end = object()
+
+    def pump() -> None:
+        try:
+            for item in iterator:
+                asyncio.run_coroutine_threadsafe(queue.put((item, None)), loop).result()
+                if stopped.is_set():
+                    return
+            asyncio.run_coroutine_threadsafe(queue.put((end, None)), loop).result()
+        except BaseException as e:
+            if not stopped.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put((end, e)), loop).result()
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    # The thread sees the context of the consumer, e.g. its request metrics
+    future = loop.run_in_executor(None, contextvars.copy_context().run, pump)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+
+            yield item
+    finally:
+        stopped.set()
+        # Make room for an item the thread may be blocked on
+        while not queue.empty():
+            queue.get_nowait()
+        await future
+
+
 class ImageUtil:
-    def __init__(self, retries: int = 1) -> None:
+    """Moves images in and out of an `ImageStore` over a pooled HTTP client.
+
+    The client lives on an event loop running in a background thread, so
+    connections and TLS sessions are kept alive across requests. Both are
+    created lazily in each worker process and closed when it exits. Under
+    an ASGI server the client is attached to the server's own loop instead,
+    where async views await it directly.
+    """
+
+    def __init__(
+        self,
+        store: ImageStore | None = None,
+        retries: int = 1,
+        upload_retries: int = 3,
+        upload_concurrency: int = 8,
+        upload_backoff_base: float = 0.5,
+        upload_backoff_max: float = 10.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 30.0
+    ) -> None:
+        self.store = store or CloudinaryImageStore()
+        self.cache = None
+        self.metrics = None
         self.retries = retries
+        self.upload_retries = upload_retries
+        self.upload_concurrency = upload_concurrency
+        self.upload_backoff_base = upload_backoff_base
+        self.upload_backoff_max = upload_backoff_max
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(timeout)
 
-    async def async_upload_images(self, files: list[tuple], folder: str) -> list[dict]:
-        async def upload(client: httpx.AsyncClient, file: tuple):
-            cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME")
-            api_key = os.getenv("CLOUDINARY_API_KEY")
-            api_secret = os.getenv("CLOUDINARY_API_SECRET")
-            timestamp = str(int(time.time()))
-
-            # Build signature string
-            params_to_sign = f"folder={folder}&public_id={file[0]}&timestamp={timestamp}{api_secret}"
-            signature = hashlib.sha1(params_to_sign.encode("utf-8")).hexdigest()
-
-            upload_url = f"https://api.cloudinary.com/v1_1/{cloud_name}/image/upload"
-            data = {
-                "api_key": api_key,
-                "timestamp": timestamp,
-                "public_id": file[0],
-                "folder": folder,
-                "signature": signature,
-            }
-
-            response = await client.post(upload_url, data=data, files={"file": file})
-            response.raise_for_status()
-
-            return response.json()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._thread = None
+        self._client = None
+
+        atexit.register(self.close)
+
+    def init_app(self, app) -> None:
+        self.store = create_image_store(app.config)
+        self.metrics = app.extensions.get('metrics')
+        if app.config['IMAGE_CACHE_DIR']:
+            self.cache = ImageCache(
+                app.config['IMAGE_CACHE_DIR'],
+                max_bytes=app.config['IMAGE_CACHE_MAX_BYTES'],
+                max_age=app.config['IMAGE_CACHE_MAX_AGE'],
+                freshness=app.config['IMAGE_CACHE_FRESHNESS']
+            )
+        self.upload_retries = app.config['UPLOAD_RETRIES']
+        self.upload_concurrency = app.config['UPLOAD_CONCURRENCY']
+        self.upload_backoff_base = app.config['UPLOAD_BACKOFF_BASE']
+        self.upload_backoff_max = app.config['UPLOAD_BACKOFF_MAX']
+        self.limits = httpx.Limits(
+            max_connections=app.config['HTTP_MAX_CONNECTIONS'],
+            max_keepalive_connections=app.config['HTTP_MAX_KEEPALIVE_CONNECTIONS'],
+            keepalive_expiry=app.config['HTTP_KEEPALIVE_EXPIRY']
+        )
+        self.timeout = httpx.Timeout(app.config['HTTP_TIMEOUT'])
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        self._ensure_loop()
+        return self._client
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        # A forked worker inherits the attributes but not the loop thread
+        if self._pid == os.getpid():
+            return self._loop
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name='image-util-loop',
+                    daemon=True
+                )
+                self._thread.start()
+                self._pid = os.getpid()
+
+        return self._loop
+
+    def _outbound(self, operation: str):
+        if self.metrics is None:
+            return contextlib.nullcontext({'bytes': 0})
+
+        return self.metrics.outbound(operation)
+
+    async def _fetch(self, url: str) -> bytes:
+        with self._outbound('fetch') as call:
+            # Remote files go through the disk cache, the store reads its own files
+            if self.cache is not None and url.startswith(('http://', 'https://')):
+                content = await self.cache.fetch(self.client, url)
+            else:
+                content = await self.store.fetch(self.client, url)
+
+            call['bytes'] = len(content)
+
+        return content
+
+    def run(self, coro):
+        """Run a coroutine on the client's loop from a thread other than the loop's and return its result."""
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    def attach(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Run the client on `loop`, the running loop of an ASGI server, instead of a thread of its own."""
+        with self._lock:
+            self._loop = loop
+            self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            self._thread = None
+            self._pid = os.getpid()
+
+    async def detach(self) -> None:
+        with self._lock:
+            client, self._client = self._client, None
+            self._loop = None
+            self._pid = None
+
+        await client.aclose()
+
+    def close(self) -> None:
+        with self._lock:
+            # Attached clients are closed by `detach`, on their loop
+            if self._pid != os.getpid() or self._thread is None:
+                return
 
-        attempt = 0
-        while attempt < self.retries:
             try:
-                logger.info(f"Uploading image to folder: {folder}")
+                asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result(timeout=5)
+            except Exception as e:
+                logger.warning(f"Failed to close HTTP client: {e}")
+
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop.close()
+            self._pid = None
+
+    async def async_upload_images(self, files: list[tuple], folder: str) -> list[dict]:
+        """Upload `files` with bounded concurrency and per-file retries.
 
-                async with httpx.AsyncClient(timeout=httpx.Timeout(30.0)) as client:
-                    tasks = [upload(client, file) for file in files]
-                    responses = await asyncio.gather(*tasks)
+        Returns one result per file, in order: `{'filename', 'status': 'uploaded', 'image'}`
+        on success or `{'filename', 'status': 'failed', 'error'}` once its retries ran out.
+        """
+        semaphore = asyncio.Semaphore(self.upload_concurrency)
 
-                logger.info("Images uploaded successfully")
+        async def upload_with_retries(file: tuple) -> dict:
+            attempt = 0
+            while True:
+                try:
+                    # A failed attempt may have consumed part of the stream
+                    if hasattr(file[1], 'seek'):
+                        file[1].seek(0)
 
-                return [
-                    {
-                        'url': response['secure_url'],
+                    async with semaphore:
+                        with self._outbound('upload') as call:
+                            call['bytes'] = file_size(file[1])
+                            uploaded = await self.store.upload(self.client, file, folder)
+
+                    return {
                         'filename': file[0],
-                        'width': response['width'],
-                        'height': response['height']
+                        'status': 'uploaded',
+                        'image': {'filename': file[0], **uploaded}
                     }
-                    for file, response in zip(files, responses)
-                ]
-            except Exception as e:
-                attempt += 1
-                logger.warning(f"Upload attempt {attempt} failed: {e}")
-                if not (attempt < self.retries):
-                    logger.error(f"Failed to upload image after {self.retries} attempts.")
-                    raise
+                except Exception as e:
+                    attempt += 1
+                    logger.warning(f"Upload attempt {attempt} failed for {file[0]}: {e}")
+                    if not (attempt < self.upload_retries):
+                        logger.error(f"Failed to upload {file[0]} after {self.upload_retries} attempts.")
+                        return {'filename': file[0], 'status': 'failed', 'error': str(e)}
 
-    def upload_images(self, files: list[tuple], folder: str) -> list[dict]:
-        return asyncio.run(self.async_upload_images(files, folder))
+                # Exponential backoff with full jitter, outside the semaphore
+                delay = min(self.upload_backoff_max, self.upload_backoff_base * 2 ** attempt)
+                await asyncio.sleep(random.uniform(0, delay))
+
+        logger.info(f"Uploading {len(files)} images to folder: {folder}")
+        results = await asyncio.gather(*(upload_with_retries(file) for file in files))
+
+        failed = sum(result['status'] == 'failed' for result in results)
+        logger.info(f"Uploaded {len(results) - failed} images, {failed} failed")
 
-    async def async_fetch_images(self, urls: list[str]) -> list[httpx.Response]:
-        async def fetch(client: httpx.AsyncClient, url: str) -> httpx.Response:
-            response = await client.get(url)
-            response.raise_for_status()
+        return results
 
-            return response
+    def upload_images(self, files: list[tuple], folder: str) -> list[dict]:
+        return self.run(self.async_upload_images(files, folder))
 
+    async def async_fetch_images(self, urls: list[str]) -> list[bytes]:
         attempt = 0
         while attempt < self.retries:
             try:
                 logger.info(f"Fetching images")
 
-                async with httpx.AsyncClient(timeout=httpx.Timeout(30.0)) as client:
-                    tasks = [fetch(client, url) for url in urls]
-                    responses = await asyncio.gather(*tasks)
+                tasks = [self._fetch(url) for url in urls]
+                responses = await asyncio.gather(*tasks)
 
-                logger.info("Images uploaded successfully")
+                logger.info("Images fetched successfully")
 
                 return responses
             except Exception as e:
@@ -118,47 +300,108 @@ class ImageUtil:
                     logger.error(f"Failed to download images after {self.retries} attempts.")
                     raise
 
-    def fetch_images(self, urls: str) -> list[httpx.Response]:
-        return asyncio.run(self.async_fetch_images(urls))
+    def fetch_images(self, urls: list[str]) -> list[bytes]:
+        return self.run(self.async_fetch_images(urls))
+
+    async def async_iter_images(self, urls: list[str], window: int) -> AsyncIterator[tuple[int, bytes]]:
+        """Yield `(index, content)` as downloads finish, with at most `window` in flight."""
+        async def fetch(index: int, url: str) -> tuple[int, bytes]:
+            attempt = 0
+            while True:
+                try:
+                    return index, await self._fetch(url)
+                except Exception as e:
+                    attempt += 1
+                    logger.warning(f"Fetch attempt {attempt} failed for {url}: {e}")
+                    if not (attempt < self.retries):
+                        logger.error(f"Failed to download {url} after {self.retries} attempts.")
+                        raise
+
+        pending = set()
+        urls = iter(enumerate(urls))
+
+        try:
+            for index, url in urls:
+                pending.add(asyncio.ensure_future(fetch(index, url)))
+                if len(pending) < window:
+                    continue
+
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def iter_images(self, urls: list[str], window: int) -> Iterator[tuple[int, bytes]]:
+        images = self.async_iter_images(urls, window)
+        try:
+            while True:
+                try:
+                    yield self.run(images.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            # Generators left open at exit are finalized after `close()`,
+            # when their tasks died with the loop
+            if self._pid == os.getpid():
+                self.run(images.aclose())
 
     def delete_image(self, image: Image) -> None:
         attempt = 0
         while attempt < self.retries:
             try:
-                public_id = image.url.rsplit('/', 2)[1:]
-                public_id = public_id[0] + '/' + public_id[1].rsplit('.', 1)[0]
+                logger.info(f"Deleting image: {image.url}")
+                with self._outbound('delete'):
+                    self.store.delete(image.url)
+                logger.info(f"Image deleted successfully: {image.url}")
+                break
+            except Exception as e:
+                attempt += 1
+                logger.warning(f"Attempt {attempt} failed for {image.url}: {e}")
+                if not (attempt < self.retries):
+                    logger.error(f"Failed to delete image {image.url} after {self.retries} attempts.")
+                    raise
 
-                logger.info(f"Deleting image: {public_id}")
-                response = cloudinary.uploader.destroy(public_id)
-                if response.get("result") == "ok":
-                    logger.info(f"Image deleted successfully: {public_id}")
-                    break
-                else:
-                    logger.warning(f"Unexpected response for {public_id}: {response}")
-                    raise Exception('Unexpected response')
+    def delete_many(self, urls: list[str]) -> None:
+        attempt = 0
+        while attempt < self.retries:
+            try:
+                logger.info(f"Deleting {len(urls)} images")
+                with self._outbound('delete_many'):
+                    self.store.delete_many(urls)
+                logger.info("Images deleted successfully")
+                break
             except Exception as e:
                 attempt += 1
-                logger.warning(f"Attempt {attempt} failed for {public_id}: {e}")
+                logger.warning(f"Attempt {attempt} failed: {e}")
                 if not (attempt < self.retries):
-                    logger.error(f"Failed to delete image {public_id} after {self.retries} attempts.")
+                    logger.error(f"Failed to delete {len(urls)} images after {self.retries} attempts.")
                     raise
 
+    def list_folders(self, parent: str) -> list[str]:
+        with self._outbound('list_folders'):
+            return self.store.list_folders(parent)
+
     def delete_all(self, folder: str) -> None:
         attempt = 0
         while attempt < self.retries:
             try:
-                logger.info(f"Deleting images")
-                response = cloudinary.api.delete_resources_by_prefix(folder + "/")
-                print(response)
-                if "deleted" in response:
-                    logger.info("Images deleted successfully")
-                    break
-                else:
-                    logger.warning("Unexpected response")
-                    raise Exception('Unexpected response')
+                logger.info(f"Deleting images in {folder}")
+                with self._outbound('delete_folder'):
+                    self.store.delete_folder(folder)
+                logger.info("Images deleted successfully")
+                break
             except Exception as e:
                 attempt += 1
-                logger.warning(f"Attempt {attempt} failed")
+                logger.warning(f"Attempt {attempt} failed: {e}")
                 if not (attempt < self.retries):
-                    logger.error(f"Failed to delete images after attempts.")
+                    logger.error(f"Failed to delete images after {self.retries} attempts.")
                     raise